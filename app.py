@@ -1,17 +1,29 @@
-from flask import Flask, render_template, request, jsonify
-from models import init_db, add_device, add_link, get_devices_by_map, get_links_by_map, create_map, get_maps, delete_map, update_map
-from snmp_handler import SNMPHandler
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from models import init_db, get_db_writer, get_map_version, get_topology_changes, get_topology_payload, delete_device, create_map, get_maps, delete_map, update_map, get_capabilities, save_capabilities, get_device_communities, get_device_rtts, save_device_rtts, get_device_states, get_map_neighbors, set_map_schedule, set_map_scan_summary
+from snmp_handler import SNMPHandler, CapabilityCache, RttEstimator, RetryBudget, get_scan_engine, probe_communities_async
+from snmp_sweep import LivenessSweep
+from scan_log import get_scan_log
+from scan_registry import ScanRegistry
+from scan_scheduler import ScanScheduler, CronSchedule
+from sharded_scan import run_sharded_scan, default_shard_count
+from graph_layout import ensure_layout
+from topology_export import stream_export, clear_export_cache, MIMETYPES
+from topology_analytics import get_map_graph, forget_map
+from scan_metrics import ScanMetrics
+import scan_metrics
+import snmp_handler
+import asyncio
 import ipaddress
-import threading
+import json
+import multiprocessing
+import time
 
 app = Flask(__name__)
 
 # Initialize DB on startup
 init_db()
 
-# Simple in-memory log storage
-scan_logs = {} # {map_id: [logs...]}
-scan_active = {} # {map_id: bool}
+# Scan logs, state and progress live in scan_log.ScanLog (one bounded buffer per map)
 
 @app.route('/')
 def index():
@@ -46,11 +58,22 @@ def edit_map(map_id):
         return jsonify({'error': 'Name required'}), 400
     
     update_map(map_id, name, network, community)
+    if 'rescan_schedule' in data:
+        # Cron-like "minute hour day month weekday"; empty disables periodic rescans
+        rescan_schedule = (data.get('rescan_schedule') or '').strip() or None
+        if rescan_schedule:
+            try:
+                CronSchedule(rescan_schedule)
+            except ValueError as e:
+                return jsonify({'error': f'Invalid rescan schedule: {e}'}), 400
+        set_map_schedule(map_id, rescan_schedule)
     return jsonify({'status': 'updated'})
 
 @app.route('/api/maps/<int:map_id>', methods=['DELETE'])
 def remove_map(map_id):
     delete_map(map_id)
+    clear_export_cache(map_id)
+    forget_map(map_id)
     return jsonify({'status': 'deleted'})
 
 @app.route('/scan', methods=['POST'])
@@ -59,11 +82,16 @@ def scan_network():
     network = data.get('network') # e.g., 192.168.1.0/24
     community = data.get('community')
     map_id = data.get('map_id', 1)
+    # Worker processes for very large spaces; 0 means one per CPU
+    shards = data.get('shards', 1)
     
     if not network or not community:
         return jsonify({'error': 'Missing network or community'}), 400
+    if not isinstance(shards, int) or shards < 0:
+        return jsonify({'error': 'shards must be a non-negative integer'}), 400
+    shards = shards or default_shard_count()
 
-    if scan_active.get(map_id, False):
+    if scheduler.active_job(map_id):
          return jsonify({'error': 'Scan already in progress for this map'}), 409
 
     # Save settings to map record for future rescans
@@ -72,24 +100,25 @@ def scan_network():
     if m:
         update_map(map_id, m['name'], network, community)
 
-    # Initialize logs for map if needed
-    scan_logs[map_id] = []
-    log_message(map_id, f"Starting scan for {network} on Map {map_id}")
-    scan_active[map_id] = True
-
-    # Start scan in a separate thread to not block UI
-    thread = threading.Thread(target=perform_scan, args=(map_id, network, community))
-    thread.start()
+    # Queue the scan on the scheduler so the request returns immediately
+    job = scheduler.submit(map_id, network, community, shards=shards)
+    if not job:
+         return jsonify({'error': 'Scan already in progress for this map'}), 409
 
-    return jsonify({'status': 'Scan started', 'message': f'Scanning {network} with community {community}'})
+    return jsonify({'status': 'Scan started', 'job_id': job.id, 'message': f'Scanning {network} with community {community}'})
 
 @app.route('/scan/stop', methods=['POST'])
 def stop_scan():
     data = request.json
     map_id = data.get('map_id', 1)
     
-    if map_id in scan_active and scan_active[map_id]:
-        scan_active[map_id] = False # Signal to stop
+    if scheduler.cancel(map_id):
+        get_scan_log(map_id).set_active(False)
+        log_message(map_id, "Queued scan cancelled.")
+        return jsonify({'status': 'Cancelled', 'message': 'Queued scan cancelled.'})
+
+    if get_scan_log(map_id).active:
+        get_scan_log(map_id).set_active(False) # Signal to stop
         log_message(map_id, "Stopping scan...")
         return jsonify({'status': 'Stopping', 'message': 'Scan stop requested.'})
     
@@ -97,156 +126,437 @@ def stop_scan():
 
 @app.route('/api/maps/<int:map_id>/rescan', methods=['POST'])
 def rescan_map(map_id):
+    # Incremental unless the client asks for {"full": true}
+    data = request.get_json(silent=True) or {}
+    incremental = not data.get('full', False)
     maps = get_maps()
     m = next((x for x in maps if x['id'] == map_id), None)
     if not m or not m.get('network') or not m.get('community'):
          return jsonify({'error': 'Map has no saved scan settings'}), 400
 
-    if scan_active.get(map_id, False):
+    job = scheduler.submit(map_id, m['network'], m['community'], incremental=incremental)
+    if not job:
          return jsonify({'error': 'Scan already in progress for this map'}), 409
+    return jsonify({'status': 'Rescan started', 'job_id': job.id})
 
-    scan_logs[map_id] = []
-    log_message(map_id, f"Rescanning {m['network']} on Map {map_id}")
-    scan_active[map_id] = True
-    thread = threading.Thread(target=perform_scan, args=(map_id, m['network'], m['community']))
-    thread.start()
-    return jsonify({'status': 'Rescan started'})
+@app.route('/api/scans')
+def list_scans():
+    return jsonify(scheduler.list_jobs())
 
 @app.route('/api/devices')
 def get_devices():
     map_id = request.args.get('map_id', 1, type=int)
-    devices = get_devices_by_map(map_id)
-    links = get_links_by_map(map_id)
-    return jsonify({'nodes': devices, 'edges': links})
+    since = request.args.get('since', type=int)
+
+    # Coordinates for devices the last scan added (no-op when the layout is current)
+    try:
+        ensure_layout(map_id)
+    except Exception as e:
+        print(f"Layout error for map {map_id}: {e}")
+
+    # Unchanged maps are answered from the version alone
+    version = get_map_version(map_id)
+    etag = f"{map_id}-{version}"
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    elif since is not None and since <= version:
+        # Delta: only rows added/changed/removed after the client's version; the ETag
+        # comes from the version read with the delta, in case a write landed meanwhile
+        changes = get_topology_changes(map_id, since)
+        etag = f"{map_id}-{changes['version']}"
+        response = jsonify(changes)
+    else:
+        # Full topology (first load, or a client ahead of the server after a reset), pre-encoded by the store
+        version, payload = get_topology_payload(map_id)
+        etag = f"{map_id}-{version}"
+        response = app.response_class(payload, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/maps/<int:map_id>/layout', methods=['POST'])
+def relayout_map(map_id):
+    # Lays the whole map out again; clients pick the moves up as a normal delta
+    version = ensure_layout(map_id, full=True)
+    return jsonify({'status': 'ok', 'version': version})
+
+@app.route('/api/maps/<int:map_id>/export.<fmt>')
+def export_map(map_id, fmt):
+    # Vector SVG/PDF streamed from the server (topology_export), cached per topology version
+    if fmt not in MIMETYPES:
+        return jsonify({'error': 'Format must be svg or pdf'}), 404
+    version, chunks = stream_export(map_id, fmt)
+    etag = f"{map_id}-{version}-{fmt}"
+    if request.if_none_match.contains_weak(etag):
+        chunks.close()
+        response = app.response_class(status=304)
+    else:
+        response = Response(chunks, mimetype=MIMETYPES[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename="mapa-rede-{map_id}-v{version}.{fmt}"'
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# --- Analytics (topology_analytics, cached until the map changes) ---
+
+@app.route('/api/maps/<int:map_id>/analytics/path')
+def analytics_path(map_id):
+    source = request.args.get('source')
+    target = request.args.get('target')
+    absent = [name for name, value in (('source', source), ('target', target)) if not value]
+    if absent:
+        return jsonify({'error': f"Missing query parameter: {', '.join(absent)}"}), 400
+    graph = get_map_graph(map_id)
+    missing = [ip for ip in (source, target) if ip not in graph.index]
+    if missing:
+        return jsonify({'error': f"Device not on this map: {', '.join(missing)}"}), 404
+    result = graph.shortest_path(source, target)
+    if result is None:
+        return jsonify({'version': graph.version, 'path': None, 'links': [], 'hops': None})
+    path, links = result
+    return jsonify({'version': graph.version, 'path': path, 'links': links, 'hops': len(links)})
+
+@app.route('/api/maps/<int:map_id>/analytics/cut-points')
+def analytics_cut_points(map_id):
+    graph = get_map_graph(map_id)
+    return jsonify({'version': graph.version, **graph.cut_points()})
+
+@app.route('/api/maps/<int:map_id>/analytics/components')
+def analytics_components(map_id):
+    graph = get_map_graph(map_id)
+    components = graph.components()
+    return jsonify({'version': graph.version, 'count': len(components), 'components': components})
+
+@app.route('/api/maps/<int:map_id>/analytics/stp-tree')
+def analytics_stp_tree(map_id):
+    graph = get_map_graph(map_id)
+    return jsonify({'version': graph.version, **graph.stp_tree()})
+
+@app.route('/api/maps/<int:map_id>/devices/<ip>', methods=['DELETE'])
+def remove_device(map_id, ip):
+    delete_device(map_id, ip)
+    return jsonify({'status': 'deleted'})
 
 @app.route('/api/logs')
 def get_logs():
     map_id = request.args.get('map_id', 1, type=int)
-    logs = scan_logs.get(map_id, [])
-    active = scan_active.get(map_id, False)
-    return jsonify({'logs': logs, 'active': active})
+    after = request.args.get('after', 0, type=int)
+    return jsonify(get_scan_log(map_id).read(after))
+
+# Seconds between keep-alive comments on idle log streams
+LOG_STREAM_HEARTBEAT = 15
+# Changes closer than this are sent together in one event
+LOG_STREAM_COALESCE = 0.2
+
+@app.route('/api/logs/stream')
+def stream_logs():
+    """Server-Sent Events: pushes new log lines, scan state and progress for a map."""
+    map_id = request.args.get('map_id', 1, type=int)
+    # EventSource sends the last event id back when it reconnects
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', 0, type=int)
+    scan_log = get_scan_log(map_id)
+
+    def events():
+        nonlocal after
+        revision = None
+        while True:
+            new_revision = scan_log.wait(revision, LOG_STREAM_HEARTBEAT)
+            if new_revision == revision:
+                yield ": keep-alive\n\n"
+                continue
+            revision = new_revision
+            data = scan_log.read(after)
+            after = data['seq']
+            yield f"id: {after}\ndata: {json.dumps(data)}\n\n"
+            time.sleep(LOG_STREAM_COALESCE)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text exposition format
+    return Response(scan_metrics.render(), mimetype='text/plain; version=0.0.4')
 
 def log_message(map_id, msg):
     print(f"[Map {map_id}] {msg}")
-    if map_id not in scan_logs:
-        scan_logs[map_id] = []
-    scan_logs[map_id].append(msg)
+    get_scan_log(map_id).append(msg)
+
+# Max hosts being discovered at the same time by one scan
+SCAN_CONCURRENCY = 50
+
+# CIDRs with more addresses than this are pre-swept with raw UDP probes
+SWEEP_MIN_HOSTS = 16
+
+# CIDR addresses stop being generated while this many hosts wait in the frontier
+FRONTIER_HIGH_WATER = 1000
+# Seconds between frontier size/throughput log lines
+FRONTIER_REPORT_INTERVAL = 5
+
+def on_scan_queued(job, ahead):
+    scan_log = get_scan_log(job.map_id)
+    scan_log.clear()
+    kind = 'incremental rescan' if job.incremental else 'scan'
+    origin = 'Scheduled' if job.trigger == 'schedule' else 'Queued'
+    log_message(job.map_id, f"{origin} {kind} of {job.network} on Map {job.map_id} (job {job.id}, {ahead} ahead in queue)")
+    scan_log.set_active(True)
+
+async def run_scan_job(job, limiter):
+    await perform_scan_async(job.map_id, job.network, job.community, job.incremental, limiter, job.shards)
 
-from concurrent.futures import ThreadPoolExecutor
+def perform_scan(map_id, network_cidr, community_string, incremental=False, shards=1):
+    """Blocking entry point: runs the discovery on the shared scan engine loop and returns its summary."""
+    return get_scan_engine().run(perform_scan_async(map_id, network_cidr, community_string, incremental, shards=shards))
 
-def perform_scan(map_id, network_cidr, community_string):
+async def perform_scan_async(map_id, network_cidr, community_string, incremental=False, limiter=None, shards=1):
+    """Discovers the network into map_id.
+
+    With shards > 1 the discovery runs in that many worker processes (see
+    sharded_scan); incremental rescans always run in-process.
+
+    With incremental=True, known devices whose sysUpTime and LLDP remote table
+    change time show no reboot or neighbor change since their last walk are not
+    walked again: their stored links are kept and only last_seen is touched.
+
+    Returns a summary dict: elapsed seconds, hosts probed, responders, links,
+    unchanged devices, timeouts, retries, DB rows/commits written, and the
+    per-phase timings and per-OID-family SNMP counts of scan_metrics. The
+    summary is also stored on the map.
+    """
     log_message(map_id, f"Starting optimized parallel scan for {network_cidr}")
+    scan_start = time.monotonic()
     
     # Parse comma-separated communities
     communities = [c.strip() for c in community_string.split(',') if c.strip()]
     if not communities:
         communities = ['public']
 
-    scanned_ips = set()
-    scanned_ips_lock = threading.Lock()
-    
-    scan_active[map_id] = True
+    def log_walk(ip, walk):
+        log_message(map_id, f"  Walk {walk.base_oid} on {ip}: {len(walk.varbinds)} rows in {walk.packets} packets ({walk.mode})")
+
+    # Known MIB support per sysObjectID lets the handlers skip probes that are known to fail
+    capabilities = CapabilityCache(await asyncio.to_thread(get_capabilities))
+    # Per-device RTT estimates (warm from the last scan) set every request's timeout and retries
+    rtt = {ip: RttEstimator(srtt, rttvar) for ip, (srtt, rttvar) in (await asyncio.to_thread(get_device_rtts, map_id)).items()}
+    retry_budget = RetryBudget()
+    metrics = ScanMetrics()
+    handlers = [SNMPHandler(comm, on_walk=log_walk, capabilities=capabilities, rtt=rtt, retry_budget=retry_budget,
+                            limiter=limiter, metrics=metrics)
+                for comm in communities]
+    handlers_by_community = {h.community: h for h in handlers}
+    known_communities = await asyncio.to_thread(get_device_communities, map_id)
+    # Device/link upserts are queued to the single DB writer instead of committing row by row
+    db = get_db_writer()
+    rows_before, commits_before, commit_seconds_before = db.rows_written, db.commits, db.commit_seconds
+    # Merges the two ends' reports of each link (and neighbor stubs) so each is written once
+    registry = ScanRegistry(db, map_id)
+    # Change markers and adjacency from the previous scan, for incremental rescans
+    device_states = await asyncio.to_thread(get_device_states, map_id) if incremental else {}
+    stored_neighbors = await asyncio.to_thread(get_map_neighbors, map_id) if incremental else {}
+    sweep_hints = {} # {ip: community} that answered the liveness sweep
+    scanned_ips = set() # integer IPs already queued, so each host is probed once
+    frontier = asyncio.Queue() # integer IPs waiting for a worker
+    frontier_space = asyncio.Event()
+    stats = {'probed': 0, 'in_flight': 0, 'responders': 0, 'links': 0, 'unchanged': 0}
+    scan_log = get_scan_log(map_id)
     
-    def scan_ip_worker(ip_str):
-        if not scan_active.get(map_id, False):
+    scan_log.set_active(True)
+
+    def enqueue(ip_str):
+        try:
+            ip_int = int(ipaddress.ip_address(ip_str))
+        except ValueError:
+            return
+        if ip_int not in scanned_ips:
+            scanned_ips.add(ip_int)
+            frontier.put_nowait(ip_int)
+
+    async def produce(candidates):
+        # Addresses from the CIDR (or sweep) wait while the frontier is full;
+        # LLDP neighbors are enqueued by the workers without waiting.
+        try:
+            async for ip_str in candidates:
+                if not scan_log.active:
+                    break
+                while frontier.qsize() >= FRONTIER_HIGH_WATER:
+                    frontier_space.clear()
+                    await frontier_space.wait()
+                enqueue(ip_str)
+        finally:
+            await candidates.aclose()
+
+    async def worker():
+        while True:
+            ip_int = await frontier.get()
+            frontier_space.set()
+            stats['in_flight'] += 1
+            scan_metrics.SCAN_WORKERS_ACTIVE.inc()
+            try:
+                ip_str = str(ipaddress.ip_address(ip_int))
+                with metrics.timed('host'):
+                    try:
+                        neighbor_ips = await scan_ip(ip_str)
+                    finally:
+                        registry.finished(ip_str)
+                for n_ip in neighbor_ips:
+                    enqueue(n_ip)
+            except Exception as e:
+                log_message(map_id, f"Error scanning {ipaddress.ip_address(ip_int)}: {e}")
+            finally:
+                stats['in_flight'] -= 1
+                stats['probed'] += 1
+                scan_metrics.SCAN_WORKERS_ACTIVE.dec()
+                scan_metrics.SCAN_HOSTS.inc()
+                metrics.sample_db_queue(db.queue_depth())
+                stats['links'] = registry.link_count
+                scan_log.update_progress(probed=stats['probed'], responders=stats['responders'], links=stats['links'])
+                frontier.task_done()
+
+    async def report():
+        started = time.monotonic()
+        while True:
+            await asyncio.sleep(FRONTIER_REPORT_INTERVAL)
+            elapsed = time.monotonic() - started
+            log_message(map_id, f"Frontier: {frontier.qsize()} queued, {stats['in_flight']} in flight, "
+                                f"{stats['probed']} probed ({stats['probed'] / elapsed:.1f} hosts/s)")
+
+    async def scan_ip(ip_str):
+        if not scan_log.active:
             return []
 
-        # Try to find a working community
-        valid_snmp = None
-        sys_info = None
-        
-        for comm in communities:
-            snmp = SNMPHandler(comm)
-            sys_info = snmp.get_system_info(ip_str)
-            if sys_info:
-                valid_snmp = snmp
-                break
+        # Try the community that answered the sweep or worked last time, then all others at once
+        known = known_communities.get(ip_str)
+        preferred = handlers_by_community.get(sweep_hints.get(ip_str) or known)
+        with metrics.timed('community_probe'):
+            valid_snmp, sys_info = await probe_communities_async(handlers, ip_str, preferred)
         
         if sys_info and valid_snmp:
             log_message(map_id, f"Found device: {sys_info['sysName']} ({ip_str})")
+            stats['responders'] += 1
+            if valid_snmp.community != known:
+                db.set_device_community(map_id, ip_str, valid_snmp.community)
             
-            # Use lock for DB calls if they share connections (add_device uses its own)
-            add_device(map_id, ip_str, sys_info['sysName'], sys_info['sysDescr'], sys_info['sysObjectID'])
-            
-            # Get Neighbors via LLDP and recurse
-            neighbors = valid_snmp.get_neighbors_details(ip_str)
-            
-            # Fetch STP Root Port
-            stp_root_port = valid_snmp.get_stp_root_port(ip_str)
-
+            uptime, lldp_last_change = sys_info['sysUpTime'], sys_info['lldpLastChange']
+            previous = device_states.get(ip_str)
+            if (previous and uptime is not None and lldp_last_change is not None and previous[1] == lldp_last_change
+                    and previous[0] is not None and uptime >= previous[0]):
+                # No reboot and no LLDP neighbor change since the last walk: keep the stored row and links
+                # (only last_seen and the change markers move). Follow only neighbors that answered SNMP
+                # before; the silent ones would just time out again.
+                stats['unchanged'] += 1
+                registry.unchanged(ip_str)
+                db.set_device_state(map_id, ip_str, uptime, lldp_last_change)
+                return [n_ip for n_ip in stored_neighbors.get(ip_str, []) if n_ip in device_states]
+
+            registry.device(ip_str, sys_info['sysName'], sys_info['sysDescr'], sys_info['sysObjectID'])
+
+            # Get Neighbors via LLDP (ports, speed, status, VLAN, STP root from one snapshot) and recurse
             found_neighbor_ips = []
-            for neighbor in neighbors:
-                n_ip = neighbor.get('ip')
-                local_port = neighbor.get('local_port', 'Unknown') 
-                remote_port = neighbor.get('remote_port', 'Unknown') 
-                n_type = neighbor.get('device_type', 'router')
-
-                if n_ip:
-                     log_message(map_id, f"  Found Link: {ip_str} -> {n_ip} ({n_type})")
-                     
-                     sys_name = neighbor.get('sys_name', "Unknown")
-                     add_device(map_id, n_ip, sys_name, "Discovered via LLDP", "Unknown", device_type=n_type)
-
-                     # Fetch Speed, Status and VLAN
-                     speed = ""
-                     status = "Unknown"
-                     source_vlan = None
-                     source_is_root = 0
-                     
-                     if 'local_port_index' in neighbor:
-                         speed = valid_snmp.get_interface_speed(ip_str, neighbor['local_port_index'])
-                         status = valid_snmp.get_interface_status(ip_str, neighbor['local_port_index'])
-                         source_vlan = valid_snmp.get_port_vlan_details(ip_str, neighbor['local_port_index'])
-                         
-                         if stp_root_port and int(neighbor['local_port_index']) == stp_root_port:
-                             source_is_root = 1
-                    
-                     add_link(map_id, ip_str, n_ip, "LLDP", source_port=local_port, target_port=remote_port, speed=speed, status=status, source_vlan=source_vlan, source_is_root=source_is_root)
-                     found_neighbor_ips.append(n_ip)
+            for link in await valid_snmp.get_links_async(ip_str):
+                n_ip = link['ip']
+                log_message(map_id, f"  Found Link: {ip_str} -> {n_ip} ({link['device_type']})")
+                registry.link(ip_str, link)
+                found_neighbor_ips.append(n_ip)
+
+            # Baseline for the next incremental rescan, recorded once the walk is done
+            db.set_device_state(map_id, ip_str, uptime, lldp_last_change)
             
             return found_neighbor_ips
         return []
 
+    async def sweep_candidates(network):
+        # Only hosts that answer a raw GET(sysObjectID) go through full discovery
+        sweep = LivenessSweep(communities, port=snmp_handler.SNMP_PORT)
+        log_message(map_id, f"Sweeping {network.num_addresses} addresses at {sweep.rate} packets/s...")
+        sweep_start = time.monotonic()
+        async for ip, community in sweep.run(str(ip) for ip in network.hosts()):
+            sweep_hints[ip] = community
+            yield ip
+        metrics.observe('sweep', time.monotonic() - sweep_start)
+        log_message(map_id, f"Sweep found {sweep.responders} responders ({sweep.sent} packets in {time.monotonic() - sweep_start:.1f}s)")
+
+    async def host_candidates(hosts):
+        for ip in hosts:
+            yield ip
+
+    workers = []
+    reporter = None
+    scan_metrics.SCANS_ACTIVE.inc()
     try:
-        # Initial candidates
-        initial_ips = []
-        if '/' in network_cidr:
-            network = ipaddress.ip_network(network_cidr, strict=False)
-            initial_ips = [str(ip) for ip in network.hosts()]
+        if shards > 1 and not incremental:
+            # CPU-bound discovery of large spaces: split across processes, results are written here
+            log_message(map_id, f"Splitting discovery across {shards} processes...")
+            learned, measured_rtts, shard_stats = await run_sharded_scan(
+                map_id, network_cidr, communities, shards, capabilities.entries, known_communities,
+                {ip: (e.srtt, e.rttvar) for ip, e in rtt.items() if e.srtt is not None},
+                log=lambda msg: log_message(map_id, msg), is_active=lambda: scan_log.active,
+                on_progress=scan_log.update_progress, metrics=metrics, registry=registry, limiter=limiter)
+            for (sys_object_id, mib), supported in learned.items():
+                capabilities.learn(sys_object_id, mib, supported)
+            rtt.update({ip: RttEstimator(srtt, rttvar) for ip, (srtt, rttvar) in measured_rtts.items()})
+            retry_budget.used += shard_stats['retries']
+            retry_budget.timeouts += shard_stats['timeouts']
+            stats.update(probed=shard_stats['probed'], responders=shard_stats['responders'], links=shard_stats['links'])
+            log_message(map_id, f"Shards probed {shard_stats['probed']} hosts in {shard_stats['elapsed']:.1f}s "
+                                f"({shard_stats['probed'] / max(shard_stats['elapsed'], 0.001):.1f} hosts/s)")
         else:
-            initial_ips = [network_cidr]
-
-        with ThreadPoolExecutor(max_workers=50) as executor:
-            to_process = initial_ips
-            while to_process:
-                if not scan_active.get(map_id, False):
-                    break
-
-                # Filter out already scanned
-                with scanned_ips_lock:
-                    current_batch = [ip for ip in to_process if ip not in scanned_ips]
-                    for ip in current_batch:
-                        scanned_ips.add(ip)
-
-                if not current_batch:
-                    break
-
-                # Map batch to workers
-                log_message(map_id, f"Probing {len(current_batch)} IPs in parallel...")
-                results = list(executor.map(scan_ip_worker, current_batch))
-                
-                # Collect new IPs found via LLDP
-                next_batch = []
-                for neighbors_found in results:
-                    next_batch.extend(neighbors_found)
-                
-                to_process = next_batch
+            # Initial candidates, generated lazily
+            if '/' in network_cidr:
+                network = ipaddress.ip_network(network_cidr, strict=False)
+                if network.num_addresses > SWEEP_MIN_HOSTS:
+                    candidates = sweep_candidates(network)
+                else:
+                    candidates = host_candidates(str(ip) for ip in network.hosts())
+            else:
+                candidates = host_candidates([network_cidr])
+
+            log_message(map_id, f"Probing with {SCAN_CONCURRENCY} workers...")
+            workers = [asyncio.ensure_future(worker()) for _ in range(SCAN_CONCURRENCY)]
+            reporter = asyncio.ensure_future(report())
+            await produce(candidates)
+            await frontier.join()
 
         log_message(map_id, "Scan complete.")
+        if incremental:
+            log_message(map_id, f"Incremental: {stats['unchanged']} of {stats['responders']} devices unchanged, not walked again")
     except Exception as e:
         log_message(map_id, f"Scan Error: {str(e)}")
     finally:
-        scan_active[map_id] = False
+        for task in workers + ([reporter] if reporter else []):
+            task.cancel()
+        log_message(map_id, f"Capability cache: {capabilities.summary()}")
+        log_message(map_id, f"Retries used: {retry_budget.used} of {retry_budget.limit}")
+        # Links whose other end was never scanned (stopped scan, out of range) and stubs of silent neighbors
+        registry.flush()
+        stats['links'] = registry.link_count
+        # Everything queued by this scan (finished or stopped) is on disk before the RTT update below
+        with metrics.timed('db_flush'):
+            await asyncio.to_thread(db.flush)
+        log_message(map_id, f"Persisted {db.rows_written - rows_before} rows in {db.commits - commits_before} transactions")
+        await asyncio.to_thread(save_capabilities, capabilities.dirty)
+        await asyncio.to_thread(save_device_rtts, map_id, {ip: (e.srtt, e.rttvar) for ip, e in rtt.items() if e.srtt is not None})
+        scan_log.set_active(False)
+        scan_metrics.SCANS_ACTIVE.dec()
+        scan_metrics.SCANS.inc(kind='incremental' if incremental else 'sharded' if shards > 1 else 'full')
+
+    summary = {
+        'finished_at': time.time(), 'network': network_cidr, 'incremental': incremental, 'shards': shards,
+        'elapsed': time.monotonic() - scan_start, 'probed': stats['probed'], 'responders': stats['responders'],
+        'links': stats['links'], 'unchanged': stats['unchanged'], 'timeouts': retry_budget.timeouts,
+        'retries': retry_budget.used, 'rows_written': db.rows_written - rows_before, 'commits': db.commits - commits_before,
+        'commit_seconds': round(db.commit_seconds - commit_seconds_before, 4),
+    }
+    summary.update(metrics.summary())
+    await asyncio.to_thread(set_map_scan_summary, map_id, summary)
+    return summary
+
+# Every scan (manual, rescan or periodic) goes through this scheduler
+scheduler = ScanScheduler(run_scan_job, on_queue=on_scan_queued)
+# Not in shard processes, which re-import this file as __mp_main__ when it is run as a script
+if multiprocessing.parent_process() is None:
+    scheduler.start()
 
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=5050)
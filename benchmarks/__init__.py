@@ -0,0 +1 @@
+"""Local SNMP agent simulator and scan benchmarks (run from the repository root)."""
@@ -0,0 +1,181 @@
+"""Checks the snmp_ber codec against pysnmp and compares decode throughput.
+
+--validate encodes a corpus of requests and responses with both pysnmp
+(pyasn1) and snmp_ber and requires identical bytes, then decodes the
+responses with snmp_ber and requires the same values (and the same str()
+the scanner sees). Without it, it times decoding a typical GETBULK reply.
+
+    python -m benchmarks.ber_benchmark --validate
+    python -m benchmarks.ber_benchmark --varbinds 25 --repeat 20000
+"""
+import argparse
+import sys
+import time
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto.api import v2c
+
+import snmp_ber
+
+REQUEST_IDS = [0, 1, 127, 128, 255, 256, 32767, 32768, 2 ** 31 - 1, -1, -128, -129]
+COMMUNITIES = ['public', '', 'x' * 200]
+OIDS = [
+    (1, 3, 6, 1, 2, 1, 1, 5, 0),
+    (1, 3, 6, 1, 2, 1, 2, 2, 1, 8),
+    (1, 0, 8802, 1, 1, 2, 1, 4, 1, 1, 7),
+    (1, 3, 6, 1, 4, 1, 9, 9, 68, 1, 2, 2, 1, 2, 4294967295),
+    (1, 3, 6, 1, 2, 1, 17, 7, 1, 4, 2, 1, 4, 0, 128),
+    (2, 999, 3),
+]
+# (pysnmp value, snmp_ber value)
+VALUES = [
+    (v2c.Integer(0), snmp_ber.Integer(0)),
+    (v2c.Integer(-5), snmp_ber.Integer(-5)),
+    (v2c.Integer(2 ** 31 - 1), snmp_ber.Integer(2 ** 31 - 1)),
+    (v2c.Integer(-2 ** 31), snmp_ber.Integer(-2 ** 31)),
+    (v2c.OctetString(b''), snmp_ber.OctetString(b'')),
+    (v2c.OctetString(b'core-sw-01'), snmp_ber.OctetString(b'core-sw-01')),
+    (v2c.OctetString(b'\xff\x00\x80ab'), snmp_ber.OctetString(b'\xff\x00\x80ab')),
+    (v2c.OctetString(b'a' * 300), snmp_ber.OctetString(b'a' * 300)),
+    (v2c.ObjectIdentifier((1, 3, 6, 1, 4, 1, 9, 1, 516)), snmp_ber.ObjectIdentifier((1, 3, 6, 1, 4, 1, 9, 1, 516))),
+    (v2c.IpAddress('10.1.2.3'), snmp_ber.IpAddress(bytes([10, 1, 2, 3]))),
+    (v2c.Counter32(0), snmp_ber.Counter32(0)),
+    (v2c.Counter32(4294967295), snmp_ber.Counter32(4294967295)),
+    (v2c.Gauge32(1000000000), snmp_ber.Gauge32(1000000000)),
+    (v2c.TimeTicks(123456), snmp_ber.TimeTicks(123456)),
+    (v2c.Counter64(2 ** 64 - 1), snmp_ber.Counter64(2 ** 64 - 1)),
+    (v2c.NoSuchObject(''), snmp_ber.NO_SUCH_OBJECT),
+    (v2c.NoSuchInstance(''), snmp_ber.NO_SUCH_INSTANCE),
+    (v2c.EndOfMibView(''), snmp_ber.END_OF_MIB_VIEW),
+]
+
+PDU_CLASSES = {
+    snmp_ber.TAG_GET_REQUEST: v2c.GetRequestPDU,
+    snmp_ber.TAG_GET_NEXT_REQUEST: v2c.GetNextRequestPDU,
+    snmp_ber.TAG_GET_BULK_REQUEST: v2c.GetBulkRequestPDU,
+    snmp_ber.TAG_RESPONSE: v2c.ResponsePDU,
+}
+
+def pysnmp_message(request_id, community, pdu_tag, varbinds, non_repeaters=0, max_repetitions=0):
+    """The same message built and encoded by pysnmp."""
+    pdu = PDU_CLASSES[pdu_tag]()
+    api = v2c.apiBulkPDU if pdu_tag == snmp_ber.TAG_GET_BULK_REQUEST else v2c.apiPDU
+    api.set_defaults(pdu)
+    api.set_request_id(pdu, request_id)
+    if pdu_tag == snmp_ber.TAG_GET_BULK_REQUEST:
+        api.set_non_repeaters(pdu, non_repeaters)
+        api.set_max_repetitions(pdu, max_repetitions)
+    api.set_varbinds(pdu, varbinds)
+    message = v2c.Message()
+    v2c.apiMessage.set_defaults(message)
+    v2c.apiMessage.set_community(message, community)
+    v2c.apiMessage.set_pdu(message, pdu)
+    return encoder.encode(message)
+
+def validate():
+    failures = 0
+    checked = 0
+
+    def check(what, expected, got):
+        nonlocal failures, checked
+        checked += 1
+        if expected != got:
+            failures += 1
+            print(f"MISMATCH {what}:\n  pysnmp   {expected!r}\n  snmp_ber {got!r}")
+
+    for request_id in REQUEST_IDS:
+        for community in COMMUNITIES:
+            for pdu_tag in (snmp_ber.TAG_GET_REQUEST, snmp_ber.TAG_GET_NEXT_REQUEST):
+                check(f"request {pdu_tag:#x} id={request_id}",
+                      pysnmp_message(request_id, community, pdu_tag, [(oid, v2c.null) for oid in OIDS]).hex(),
+                      snmp_ber.encode_request(community, request_id, pdu_tag, OIDS).hex())
+            for non_repeaters, max_repetitions in ((0, 10), (1, 25), (0, 200)):
+                check(f"getbulk id={request_id} {non_repeaters}/{max_repetitions}",
+                      pysnmp_message(request_id, community, snmp_ber.TAG_GET_BULK_REQUEST, [(oid, v2c.null) for oid in OIDS * 20],
+                                     non_repeaters, max_repetitions).hex(),
+                      snmp_ber.encode_request(community, request_id, snmp_ber.TAG_GET_BULK_REQUEST, OIDS * 20,
+                                              non_repeaters, max_repetitions).hex())
+
+    for oid in OIDS:
+        expected = pysnmp_message(7, 'public', snmp_ber.TAG_RESPONSE, [(oid, pv) for pv, _ in VALUES])
+        check(f"response {oid}", expected.hex(),
+              snmp_ber.encode_message('public', 7, snmp_ber.TAG_RESPONSE, [(oid, bv) for _, bv in VALUES]).hex())
+        community, pdu_tag, request_id, error_status, error_index, varbinds = snmp_ber.decode_message(expected)
+        check("decoded header", (b'public', snmp_ber.TAG_RESPONSE, 7, 0, 0),
+              (community, pdu_tag, request_id, error_status, error_index))
+        for (name, value), (pysnmp_value, ber_value) in zip(varbinds, VALUES):
+            check(f"decoded name {oid}", oid, tuple(name))
+            check(f"decoded type {ber_value!r}", type(ber_value), type(value))
+            check(f"decoded value {ber_value!r}", bytes(ber_value) if isinstance(ber_value, bytes) else ber_value,
+                  bytes(value) if isinstance(value, bytes) else value)
+            check(f"str() of {ber_value!r}", str(pysnmp_value), str(value))
+
+    # Error status in a reply
+    message = pysnmp_message(9, 'public', snmp_ber.TAG_RESPONSE, [(OIDS[0], v2c.null)])
+    message_object, _ = decoder.decode(message, asn1Spec=v2c.Message())
+    pdu = v2c.apiMessage.get_pdu(message_object)
+    v2c.apiPDU.set_error_status(pdu, 2)
+    v2c.apiPDU.set_error_index(pdu, 1)
+    v2c.apiMessage.set_pdu(message_object, pdu)
+    _, _, _, error_status, error_index, _ = snmp_ber.decode_message(encoder.encode(message_object))
+    check("error status", (2, 1), (error_status, error_index))
+    check("error status name", 'noSuchName', snmp_ber.ErrorStatus(error_status).prettyPrint())
+
+    # Unsupported input must raise BerError, never decode to something wrong
+    for data in (message[:-1], b'\x30\x80' + message[2:], message[:5] + b'\x00' + message[6:]):
+        checked += 1
+        try:
+            snmp_ber.decode_message(data)
+            failures += 1
+            print(f"MISMATCH accepted malformed message {data.hex()}")
+        except snmp_ber.BerError:
+            pass
+
+    print(f"{checked} checks, {failures} mismatches")
+    return failures == 0
+
+def typical_reply(varbinds):
+    """A GETBULK reply walking ifName/ifHighSpeed-like columns."""
+    bindings = []
+    for i in range(varbinds):
+        if i % 2:
+            bindings.append(((1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 15, 10100 + i), v2c.Gauge32(1000)))
+        else:
+            bindings.append(((1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 1, 10100 + i), v2c.OctetString(f'Gi1/0/{i}')))
+    return pysnmp_message(123456, 'public', snmp_ber.TAG_RESPONSE, bindings)
+
+def timed(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Validates and times the snmp_ber codec against pysnmp")
+    parser.add_argument('--validate', action='store_true', help="only check the codec against pysnmp")
+    parser.add_argument('--varbinds', type=int, default=25, help="varbinds in the timed reply")
+    parser.add_argument('--repeat', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.validate:
+        sys.exit(0 if validate() else 1)
+
+    message = typical_reply(args.varbinds)
+    spec = v2c.Message()
+
+    def decode_pysnmp():
+        decoded, _ = decoder.decode(message, asn1Spec=spec)
+        return [(tuple(name), value) for name, value in v2c.apiPDU.get_varbinds(v2c.apiMessage.get_pdu(decoded))]
+
+    pysnmp_seconds = timed(decode_pysnmp, args.repeat)
+    ber_seconds = timed(lambda: snmp_ber.decode_message(message), args.repeat)
+    request_seconds = timed(lambda: snmp_ber.encode_request('public', 1, snmp_ber.TAG_GET_BULK_REQUEST, OIDS[:2], 0, 25), args.repeat)
+    print(f"{'reply_bytes':<24} {len(message)}")
+    print(f"{'varbinds':<24} {args.varbinds}")
+    print(f"{'pysnmp_decode_per_s':<24} {args.repeat / pysnmp_seconds:,.0f}")
+    print(f"{'snmp_ber_decode_per_s':<24} {args.repeat / ber_seconds:,.0f}")
+    print(f"{'speedup':<24} {pysnmp_seconds / ber_seconds:.1f}x")
+    print(f"{'snmp_ber_encode_per_s':<24} {args.repeat / request_seconds:,.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""Scan benchmarks against the local SNMP agent simulator.
+
+Every case generates a topology, serves it with benchmarks.snmp_simulator in
+a subprocess and runs a full perform_scan discovery of it in another
+subprocess with a fresh database, so wall time and peak memory belong to the
+scan alone. Packets are counted by the simulator (every datagram the scan
+sent to the simulated addresses, sweep probes included).
+
+Results are written as JSON; --compare reads an earlier result file and
+exits with status 1 if any metric of a case got worse by more than
+--tolerance (plus a small absolute slack per metric).
+
+    python -m benchmarks.scan_benchmark                          # quick suite
+    python -m benchmarks.scan_benchmark --suite full -o full.json
+    python -m benchmarks.scan_benchmark --compare baseline.json
+    python -m benchmarks.scan_benchmark --topology mesh --devices 300 --loss 0.02 --latency 10
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.snmp_simulator import SimulatedNetwork, SIMULATOR_PORT
+
+# Format of the result files; bumped when metrics change meaning
+RESULT_FORMAT = 1
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def case(name, topology, devices, loss=0.0, latency=0.0, jitter=0.0, unresponsive=0.0, target='cidr', shards=1):
+    # latency and jitter in ms; target is 'cidr' (the covering network) or 'root' (seed from device 0 over LLDP)
+    return {'name': name, 'topology': topology, 'devices': devices, 'loss': loss, 'latency': latency,
+            'jitter': jitter, 'unresponsive': unresponsive, 'target': target, 'shards': shards}
+
+QUICK_SUITE = [
+    case('tree-10', 'tree', 10),
+    case('mesh-10', 'mesh', 10),
+    case('tree-100', 'tree', 100),
+    case('mesh-100', 'mesh', 100),
+    case('mesh-100-root', 'mesh', 100, target='root'),
+    case('tree-100-lossy', 'tree', 100, loss=0.02, latency=5, jitter=5, unresponsive=0.05),
+]
+SUITES = {
+    'quick': QUICK_SUITE,
+    'full': QUICK_SUITE + [
+        case('tree-1000', 'tree', 1000),
+        case('mesh-1000', 'mesh', 1000),
+        case('mesh-1000-root', 'mesh', 1000, target='root'),
+        case('mesh-1000-lossy', 'mesh', 1000, loss=0.02, latency=20, jitter=10, unresponsive=0.05),
+        case('tree-5000', 'tree', 5000),
+        case('mesh-5000', 'mesh', 5000),
+    ],
+}
+
+# Metrics compared between runs: (worse when higher, absolute slack before a change counts)
+COMPARED_METRICS = {
+    'wall_time_s': (True, 0.5),
+    'packets_sent': (True, 20),
+    'timeouts': (True, 5),
+    'db_rows_written': (True, 20),
+    'peak_rss_kb': (True, 4096),
+    'devices': (False, 0),
+    'links': (False, 0),
+}
+
+def build_network(spec):
+    return SimulatedNetwork(spec['topology'], spec['devices'], unresponsive=spec['unresponsive'])
+
+def run_case(spec, port, timeout=None, log_path=None):
+    """Runs one case; returns its metrics."""
+    network = build_network(spec)
+    target = network.cidr if spec['target'] == 'cidr' else network.address(0)
+    simulator = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.snmp_simulator', '--topology', spec['topology'],
+         '--devices', str(spec['devices']), '--unresponsive', str(spec['unresponsive']), '--loss', str(spec['loss']),
+         '--latency', str(spec['latency']), '--jitter', str(spec['jitter']), '--port', str(port)],
+        stdout=subprocess.PIPE, text=True)
+    try:
+        if simulator.stdout.readline().strip() != 'READY':
+            raise RuntimeError("simulator did not start")
+        with tempfile.TemporaryDirectory() as work:
+            result_path = os.path.join(work, 'result.json')
+            log = open(log_path, 'a') if log_path else subprocess.DEVNULL
+            try:
+                subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.scan_benchmark', '--run-scan', json.dumps(spec),
+                     '--target', target, '--db', os.path.join(work, 'bench.db'), '--port', str(port),
+                     '--result', result_path],
+                    stdout=log, stderr=subprocess.STDOUT, timeout=timeout, check=True)
+            finally:
+                if log_path:
+                    log.close()
+            with open(result_path) as f:
+                metrics = json.load(f)
+    finally:
+        simulator.send_signal(signal.SIGTERM)
+        out, _ = simulator.communicate(timeout=30)
+    counters = json.loads(out.strip().splitlines()[-1])
+
+    metrics['packets_sent'] = counters['received']
+    metrics['expected_devices'] = spec['devices']
+    metrics['expected_links'] = network.expected_links()
+    metrics['simulator'] = counters
+    return metrics
+
+def run_scan(spec, target, db_path, port, result_path):
+    """Scan subprocess: discovers target into a fresh database and writes the metrics."""
+    import models
+    models.DB_NAME = db_path
+    import snmp_handler
+    snmp_handler.SNMP_PORT = port
+    import app
+
+    map_id = models.create_map(spec['name'])
+    started = time.monotonic()
+    summary = app.perform_scan(map_id, target, 'public', shards=spec['shards'])
+    wall_time = time.monotonic() - started
+
+    metrics = {
+        'wall_time_s': round(wall_time, 3),
+        'hosts_probed': summary['probed'],
+        'responders': summary['responders'],
+        'timeouts': summary['timeouts'],
+        'retries': summary['retries'],
+        'db_rows_written': summary['rows_written'],
+        'db_commits': summary['commits'],
+        'devices': len(models.get_devices_by_map(map_id)),
+        'links': len(models.get_links_by_map(map_id)),
+        # ru_maxrss is in KB on Linux; shard processes are reported apart
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'shard_peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        # Where the time went (scan_metrics phases), for digging into a regression
+        'phases': summary['phases'],
+    }
+    with open(result_path, 'w') as f:
+        json.dump(metrics, f)
+
+def compare(results, baseline, tolerance):
+    """Returns one line per metric that got worse than in baseline."""
+    previous = {c['name']: c for c in baseline.get('cases', [])}
+    regressions = []
+    for current in results['cases']:
+        old = previous.get(current['name'])
+        if old is None or old['params'] != current['params']:
+            continue
+        for metric, (higher_is_worse, slack) in COMPARED_METRICS.items():
+            before, after = old['metrics'].get(metric), current['metrics'].get(metric)
+            if before is None or after is None:
+                continue
+            if higher_is_worse:
+                worse = after > before * (1 + tolerance) + slack
+            else:
+                worse = after < before * (1 - tolerance) - slack
+            if worse:
+                regressions.append(f"{current['name']}: {metric} {before} -> {after}")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results):
+    print(f"{'case':<20} {'wall s':>8} {'packets':>9} {'timeouts':>9} {'rows':>8} {'devices':>11} {'links':>13} {'rss MB':>7}")
+    for c in results['cases']:
+        m = c['metrics']
+        if 'error' in m:
+            print(f"{c['name']:<20} failed: {m['error']}")
+            continue
+        print(f"{c['name']:<20} {m['wall_time_s']:>8.2f} {m['packets_sent']:>9} {m['timeouts']:>9} "
+              f"{m['db_rows_written']:>8} {m['devices']:>5}/{m['expected_devices']:<5} "
+              f"{m['links']:>6}/{m['expected_links']:<6} {m['peak_rss_kb'] / 1024:>7.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks full scans against simulated SNMP agents")
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--case', action='append', help="run only this case of the suite (repeatable)")
+    parser.add_argument('--topology', choices=['tree', 'mesh'], help="run one ad-hoc case instead of a suite")
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0, help="ms")
+    parser.add_argument('--jitter', type=float, default=0.0, help="ms")
+    parser.add_argument('--unresponsive', type=float, default=0.0)
+    parser.add_argument('--target', default='cidr', help="'cidr' or 'root'")
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--port', type=int, default=SIMULATOR_PORT)
+    parser.add_argument('--timeout', type=float, help="seconds allowed per scan")
+    parser.add_argument('-o', '--output', help="result file (default: benchmarks/results/<suite>-<time>.json)")
+    parser.add_argument('--log', help="append the scans' output to this file")
+    parser.add_argument('--compare', help="earlier result file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="relative change allowed by --compare")
+    # Internal: the scan subprocess of one case
+    parser.add_argument('--run-scan', help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scan:
+        run_scan(json.loads(args.run_scan), args.target, args.db, args.port, args.result)
+        return
+
+    if args.topology:
+        suite = 'custom'
+        name = f"{args.topology}-{args.devices}"
+        cases = [case(name, args.topology, args.devices, args.loss, args.latency, args.jitter, args.unresponsive,
+                      args.target, args.shards)]
+    else:
+        suite = args.suite
+        cases = [c for c in SUITES[suite] if not args.case or c['name'] in args.case]
+
+    results = {
+        'format': RESULT_FORMAT,
+        'suite': suite,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'cases': [],
+    }
+    for spec in cases:
+        print(f"Running {spec['name']}...", flush=True)
+        params = {k: v for k, v in spec.items() if k != 'name'}
+        try:
+            metrics = run_case(spec, args.port, args.timeout, args.log)
+        except Exception as e:
+            metrics = {'error': str(e)}
+        results['cases'].append({'name': spec['name'], 'params': params, 'metrics': metrics})
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{suite}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_table(results)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+"""Simulated SNMPv2c agents for benchmarking discovery on one machine.
+
+A SimulatedNetwork is a generated topology (a tree or a mesh of switches)
+whose devices live on consecutive loopback addresses (127.20.0.1, ...).
+AgentSimulator answers GET, GETNEXT and GETBULK for all of them from a
+single UDP socket: the destination address of each request (IP_PKTINFO)
+says which device is asked, and the reply goes out from that address. Every
+device serves the system group, IF-MIB, Q-BRIDGE, BRIDGE-MIB STP and
+LLDP-MIB remote tables the scanner reads, built from its place in the
+topology.
+
+Loss, latency and silent (unresponsive) hosts are simulated per request.
+Linux only: it relies on the whole 127/8 being on loopback and on IP_PKTINFO.
+
+Standalone, it prints READY once listening and its counters as JSON when
+stopped (SIGINT/SIGTERM):
+
+    python -m benchmarks.snmp_simulator --topology tree --devices 200 --port 16161
+"""
+import argparse
+import asyncio
+import bisect
+import functools
+import ipaddress
+import json
+import random
+import signal
+import socket
+import struct
+import time
+from collections import deque
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+
+p = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C]
+
+# Not exported by the socket module before Python 3.12
+IP_PKTINFO = getattr(socket, 'IP_PKTINFO', 8)
+
+# First device is NETWORK_BASE + 1, the next ones follow
+NETWORK_BASE = '127.20.0.0'
+SIMULATOR_PORT = 16161
+# Interfaces per device (more if it has more neighbors than this)
+DEFAULT_PORTS = 24
+# Children per switch in trees, average neighbors per switch in meshes
+TREE_BRANCHING = 4
+MESH_DEGREE = 4
+# Most varbinds put in one GETBULK response
+BULK_MAX_VARBINDS = 500
+# Devices whose MIB is kept built; the others are rebuilt when asked again
+MIB_CACHE_SIZE = 1024
+
+# sysObjectIDs handed out in turn, so the capability cache sees several models
+VENDOR_OIDS = [
+    '1.3.6.1.4.1.9.1.1208',         # Cisco Catalyst 2960
+    '1.3.6.1.4.1.11.2.3.7.11.1',    # HP/Aruba ProCurve
+    '1.3.6.1.4.1.2636.1.1.1.2.29',  # Juniper EX
+]
+CISCO_PREFIX = '1.3.6.1.4.1.9.'
+
+def oid(dotted):
+    return tuple(int(x) for x in dotted.split('.'))
+
+SYS_DESCR = oid('1.3.6.1.2.1.1.1.0')
+SYS_OBJECT_ID = oid('1.3.6.1.2.1.1.2.0')
+SYS_UPTIME = oid('1.3.6.1.2.1.1.3.0')
+SYS_NAME = oid('1.3.6.1.2.1.1.5.0')
+IF_DESCR = oid('1.3.6.1.2.1.2.2.1.2')
+IF_SPEED = oid('1.3.6.1.2.1.2.2.1.5')
+IF_OPER_STATUS = oid('1.3.6.1.2.1.2.2.1.8')
+IF_NAME = oid('1.3.6.1.2.1.31.1.1.1.1')
+IF_HIGH_SPEED = oid('1.3.6.1.2.1.31.1.1.1.15')
+DOT1D_BASE_PORT_IF_INDEX = oid('1.3.6.1.2.1.17.1.4.1.2')
+DOT1D_STP_ROOT_PORT = oid('1.3.6.1.2.1.17.2.7.0')
+DOT1Q_VLAN_EGRESS_PORTS = oid('1.3.6.1.2.1.17.7.1.4.3.1.2')
+DOT1Q_PVID = oid('1.3.6.1.2.1.17.7.1.4.5.1.1')
+CISCO_VM_VLAN = oid('1.3.6.1.4.1.9.9.68.1.2.2.1.2')
+LLDP_LAST_CHANGE = oid('1.0.8802.1.1.2.1.2.1.0')
+LLDP_REM_PORT_ID = oid('1.0.8802.1.1.2.1.4.1.1.7')
+LLDP_REM_SYS_NAME = oid('1.0.8802.1.1.2.1.4.1.1.9')
+LLDP_REM_CAPS_ENABLED = oid('1.0.8802.1.1.2.1.4.1.1.12')
+LLDP_REM_MAN_ADDR_IF_SUBTYPE = oid('1.0.8802.1.1.2.1.4.2.1.3')
+
+# VLANs untagged on the ports (by pvid) and tagged on every port
+ACCESS_VLANS = (10, 11, 12, 13)
+TRUNK_VLANS = (100, 101, 102, 103)
+
+class SimulatedNetwork:
+    """Generated topology of `devices` switches; device 0 is the STP root.
+
+    topology is 'tree' (each switch has `branching` children) or 'mesh' (a
+    random spanning tree plus random extra links, `degree` neighbors per
+    switch on average). A fraction `unresponsive` of the devices (never the
+    root) is advertised over LLDP but never answers SNMP.
+    """
+    def __init__(self, topology, devices, unresponsive=0.0, ports=DEFAULT_PORTS,
+                 branching=TREE_BRANCHING, degree=MESH_DEGREE, seed=1):
+        if devices < 1 or devices > 65000:
+            raise ValueError("devices must be between 1 and 65000")
+        rng = random.Random(seed)
+        self.topology = topology
+        self.devices = devices
+        self.ports = ports
+        self.neighbors = [[] for _ in range(devices)] # [(local_port, device, remote_port)]
+        self._edges = set()
+        if topology == 'tree':
+            for i in range(1, devices):
+                self._connect((i - 1) // branching, i)
+        elif topology == 'mesh':
+            for i in range(1, devices):
+                self._connect(rng.randrange(i), i)
+            extra = min(devices * degree // 2, devices * (devices - 1) // 2) - (devices - 1)
+            while extra > 0:
+                a, b = rng.randrange(devices), rng.randrange(devices)
+                if a != b and (min(a, b), max(a, b)) not in self._edges:
+                    self._connect(a, b)
+                    extra -= 1
+        else:
+            raise ValueError(f"unknown topology '{topology}'")
+
+        # STP: each switch's root port is the one towards its BFS parent from device 0
+        self.root_port = [0] * devices
+        seen = {0}
+        pending = deque([0])
+        while pending:
+            current = pending.popleft()
+            for local_port, other, remote_port in self.neighbors[current]:
+                if other not in seen:
+                    seen.add(other)
+                    self.root_port[other] = remote_port
+                    pending.append(other)
+
+        self.silent = set(rng.sample(range(1, devices), round(unresponsive * (devices - 1))))
+        self.base = int(ipaddress.IPv4Address(NETWORK_BASE))
+        self.started = time.monotonic()
+        self.mib = functools.lru_cache(maxsize=MIB_CACHE_SIZE)(self._build_mib)
+
+    def _connect(self, a, b):
+        port_a = len(self.neighbors[a]) + 1
+        port_b = len(self.neighbors[b]) + 1
+        self.neighbors[a].append((port_a, b, port_b))
+        self.neighbors[b].append((port_b, a, port_a))
+        self._edges.add((min(a, b), max(a, b)))
+
+    def address(self, index):
+        return str(ipaddress.IPv4Address(self.base + 1 + index))
+
+    def device_at(self, ip_int):
+        index = ip_int - self.base - 1
+        return index if 0 <= index < self.devices else None
+
+    @property
+    def cidr(self):
+        """Smallest network holding every device address."""
+        prefix = 32 - (self.devices + 1).bit_length()
+        return f"{NETWORK_BASE}/{prefix}"
+
+    def expected_links(self):
+        """Links a complete scan stores: every cable with at least one answering end."""
+        return sum(1 for a, b in self._edges if a not in self.silent or b not in self.silent)
+
+    def sys_name(self, index):
+        return f"sim-{self.topology}-{index}"
+
+    def _build_mib(self, index):
+        """Returns (sorted OIDs, values) of one device. Values are (kind, value)."""
+        rows = {}
+        neighbors = self.neighbors[index]
+        ports = max(self.ports, len(neighbors))
+        vendor = VENDOR_OIDS[index % len(VENDOR_OIDS)]
+        linked = {local_port for local_port, _, _ in neighbors}
+
+        rows[SYS_DESCR] = ('str', f"Simulated switch {index}")
+        rows[SYS_OBJECT_ID] = ('oid', vendor)
+        rows[SYS_UPTIME] = ('uptime', 100000 + index)
+        rows[SYS_NAME] = ('str', self.sys_name(index))
+        for port in range(1, ports + 1):
+            rows[IF_DESCR + (port,)] = ('str', f"GigabitEthernet1/0/{port}")
+            rows[IF_SPEED + (port,)] = ('gauge', 1000000000)
+            rows[IF_OPER_STATUS + (port,)] = ('int', 1 if port in linked or port % 3 else 2)
+            rows[IF_NAME + (port,)] = ('str', f"Gi1/0/{port}")
+            rows[IF_HIGH_SPEED + (port,)] = ('gauge', 1000)
+            rows[DOT1D_BASE_PORT_IF_INDEX + (port,)] = ('int', port)
+            rows[DOT1Q_PVID + (port,)] = ('gauge', ACCESS_VLANS[port % len(ACCESS_VLANS)])
+            if vendor.startswith(CISCO_PREFIX):
+                rows[CISCO_VM_VLAN + (port,)] = ('int', ACCESS_VLANS[port % len(ACCESS_VLANS)])
+        for vlan in ACCESS_VLANS + TRUNK_VLANS:
+            bits = bytearray((ports + 7) // 8)
+            for port in range(1, ports + 1):
+                if vlan in TRUNK_VLANS or ACCESS_VLANS[port % len(ACCESS_VLANS)] == vlan:
+                    bits[(port - 1) // 8] |= 0x80 >> ((port - 1) % 8)
+            rows[DOT1Q_VLAN_EGRESS_PORTS + (vlan,)] = ('bytes', bytes(bits))
+        rows[DOT1D_STP_ROOT_PORT] = ('int', self.root_port[index])
+
+        rows[LLDP_LAST_CHANGE] = ('ticks', 5000)
+        for local_port, other, remote_port in neighbors:
+            entry = (0, local_port, 1) # lldpRemTimeMark, lldpRemLocalPortNum, lldpRemIndex
+            rows[LLDP_REM_PORT_ID + entry] = ('str', f"Gi1/0/{remote_port}")
+            rows[LLDP_REM_SYS_NAME + entry] = ('str', self.sys_name(other))
+            rows[LLDP_REM_CAPS_ENABLED + entry] = ('bytes', b'\x20\x00') # bridge
+            address = tuple(int(x) for x in self.address(other).split('.'))
+            rows[LLDP_REM_MAN_ADDR_IF_SUBTYPE + entry + (1, 4) + address] = ('int', 2)
+
+        keys = sorted(rows)
+        return keys, [rows[k] for k in keys]
+
+class AgentSimulator:
+    """Serves every device of a SimulatedNetwork on one UDP port.
+
+    Lives on the running asyncio loop between start() and close().
+    `loss` is the probability a request gets no reply; replies are delayed
+    by `latency` plus up to `jitter` seconds. `counters` count requests by
+    outcome and PDU type.
+    """
+    def __init__(self, network, port=SIMULATOR_PORT, community='public', loss=0.0, latency=0.0, jitter=0.0, seed=1):
+        self.network = network
+        self.port = port
+        self.community = community
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.counters = {
+            'received': 0, 'answered': 0, 'lost': 0, 'silent': 0, 'no_device': 0,
+            'bad_community': 0, 'malformed': 0, 'send_errors': 0,
+            'get': 0, 'getnext': 0, 'getbulk': 0, 'varbinds': 0,
+        }
+        self.sock = None
+        self._loop = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8 << 20)
+        except OSError:
+            pass
+        self.sock.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+        # Every loopback address on the port; requests from other hosts are ignored
+        self.sock.bind(('0.0.0.0', self.port))
+        self._loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def close(self):
+        if self.sock is not None:
+            self._loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+    def _on_readable(self):
+        while self.sock is not None:
+            try:
+                data, ancdata, _, addr = self.sock.recvmsg(65535, socket.CMSG_SPACE(12))
+            except (BlockingIOError, InterruptedError):
+                return
+            self.counters['received'] += 1
+            destination = None
+            for level, kind, cdata in ancdata:
+                if level == socket.IPPROTO_IP and kind == IP_PKTINFO:
+                    destination = cdata[8:12] # in_pktinfo.ipi_addr
+            index = None
+            if destination is not None and addr[0].startswith('127.'):
+                index = self.network.device_at(int.from_bytes(destination, 'big'))
+            if index is None:
+                self.counters['no_device'] += 1
+                continue
+            if index in self.network.silent:
+                self.counters['silent'] += 1
+                continue
+            if self.loss and self.rng.random() < self.loss:
+                self.counters['lost'] += 1
+                continue
+            reply = self._respond(index, data)
+            if reply is None:
+                continue
+            delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+            if delay > 0:
+                self._loop.call_later(delay, self._send, reply, destination, addr)
+            else:
+                self._send(reply, destination, addr)
+
+    def _send(self, reply, source, addr):
+        if self.sock is None:
+            return
+        try:
+            # Reply from the address the request went to
+            self.sock.sendmsg([reply], [(socket.IPPROTO_IP, IP_PKTINFO, struct.pack('=i4s4s', 0, source, bytes(4)))],
+                              0, addr)
+            self.counters['answered'] += 1
+        except OSError:
+            self.counters['send_errors'] += 1
+
+    def _value(self, kind, value):
+        if kind in ('str', 'bytes'):
+            return p.OctetString(value)
+        if kind == 'int':
+            return p.Integer(value)
+        if kind == 'gauge':
+            return p.Gauge32(value)
+        if kind == 'oid':
+            return p.ObjectIdentifier(value)
+        if kind == 'ticks':
+            return p.TimeTicks(value)
+        if kind == 'uptime':
+            return p.TimeTicks(value + int((time.monotonic() - self.network.started) * 100))
+        raise ValueError(kind)
+
+    def _respond(self, index, data):
+        try:
+            message, _ = decoder.decode(data, asn1Spec=p.Message())
+            if bytes(p.apiMessage.get_community(message)) != self.community.encode():
+                self.counters['bad_community'] += 1
+                return None
+            pdu = p.apiMessage.get_pdu(message)
+            response = p.apiPDU.get_response(pdu)
+            request_oids = [tuple(name) for name, _ in p.apiPDU.get_varbinds(pdu)]
+        except Exception:
+            self.counters['malformed'] += 1
+            return None
+
+        keys, values = self.network.mib(index)
+
+        def lookup(name):
+            position = bisect.bisect_left(keys, name)
+            if position < len(keys) and keys[position] == name:
+                return name, self._value(*values[position])
+            return name, p.NoSuchInstance()
+
+        def next_of(name):
+            position = bisect.bisect_right(keys, name)
+            if position < len(keys):
+                return keys[position], self._value(*values[position])
+            return name, p.EndOfMibView()
+
+        if pdu.isSameTypeWith(p.GetRequestPDU()):
+            self.counters['get'] += 1
+            varbinds = [lookup(name) for name in request_oids]
+        elif pdu.isSameTypeWith(p.GetNextRequestPDU()):
+            self.counters['getnext'] += 1
+            varbinds = [next_of(name) for name in request_oids]
+        elif pdu.isSameTypeWith(p.GetBulkRequestPDU()):
+            self.counters['getbulk'] += 1
+            non_repeaters = int(p.apiBulkPDU.get_non_repeaters(pdu))
+            max_repetitions = int(p.apiBulkPDU.get_max_repetitions(pdu))
+            varbinds = [next_of(name) for name in request_oids[:non_repeaters]]
+            current = request_oids[non_repeaters:]
+            for _ in range(max_repetitions):
+                if not current or len(varbinds) + len(current) > BULK_MAX_VARBINDS:
+                    break
+                row = [next_of(name) for name in current]
+                varbinds.extend(row)
+                if all(isinstance(value, p.EndOfMibView) for _, value in row):
+                    break
+                current = [name for name, _ in row]
+        else:
+            self.counters['malformed'] += 1
+            return None
+
+        self.counters['varbinds'] += len(varbinds)
+        p.apiPDU.set_varbinds(response, varbinds)
+        p.apiMessage.set_pdu(message, response)
+        return encoder.encode(message)
+
+async def serve(args):
+    network = SimulatedNetwork(args.topology, args.devices, unresponsive=args.unresponsive, ports=args.ports,
+                               branching=args.branching, degree=args.degree, seed=args.seed)
+    simulator = AgentSimulator(network, port=args.port, community=args.community, loss=args.loss,
+                               latency=args.latency / 1000, jitter=args.jitter / 1000, seed=args.seed)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    simulator.start()
+    print("READY", flush=True)
+    await stop.wait()
+    simulator.close()
+    print(json.dumps(simulator.counters), flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated SNMPv2c agents on loopback addresses")
+    parser.add_argument('--topology', choices=['tree', 'mesh'], default='tree')
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--ports', type=int, default=DEFAULT_PORTS, help="interfaces per device")
+    parser.add_argument('--branching', type=int, default=TREE_BRANCHING, help="children per switch (tree)")
+    parser.add_argument('--degree', type=int, default=MESH_DEGREE, help="average neighbors per switch (mesh)")
+    parser.add_argument('--unresponsive', type=float, default=0.0, help="fraction of devices that never answer")
+    parser.add_argument('--loss', type=float, default=0.0, help="probability a request gets no reply")
+    parser.add_argument('--latency', type=float, default=0.0, help="reply delay in ms")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random reply delay in ms")
+    parser.add_argument('--community', default='public')
+    parser.add_argument('--port', type=int, default=SIMULATOR_PORT)
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(serve(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Cold start of the web app: import time, schema check and first responses.
+
+Every run is a fresh interpreter (PYTHONPATH at the project root, working
+directory in a temporary folder so the app creates its network_map.db
+there), timing `import app` (which runs init_db) and the first GET / and
+GET /api/maps through Flask's test client. The first run creates the
+database (every migration runs); the others start on a current one.
+
+Also reports init_db alone on a current database, whether the SNMP stack
+(pysnmp) was loaded at startup, and the slowest top-level imports from
+python -X importtime.
+
+    python -m benchmarks.startup_benchmark
+    python -m benchmarks.startup_benchmark --repeat 10 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON line
+CHILD = r'''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+index = client.get('/')
+maps = client.get('/api/maps')
+served = time.perf_counter()
+import models
+checks = 100
+t = time.perf_counter()
+for _ in range(checks):
+    models.init_db()
+init_db_ms = (time.perf_counter() - t) / checks * 1000
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_requests_ms': (served - imported) * 1000,
+    'statuses': [index.status_code, maps.status_code],
+    'init_db_current_ms': init_db_ms,
+    'pysnmp_loaded': any(name == 'pysnmp' or name.startswith('pysnmp.') for name in sys.modules),
+}))
+'''
+
+def child_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+def run_child(work):
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=work, env=child_env(),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def import_profile(work, top):
+    """The slowest modules imported directly by app (cumulative microseconds)."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=work, env=child_env(),
+                            capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nesting depth is the indentation of the name (two spaces per level)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            modules.append((int(cumulative), name.strip(), depth))
+    return sorted(modules, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the web app's cold start")
+    parser.add_argument('--repeat', type=int, default=5, help="runs on a current database")
+    parser.add_argument('--top', type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work:
+        first = run_child(work)
+        runs = [run_child(work) for _ in range(args.repeat)]
+        profile = import_profile(work, args.top)
+
+    results = {
+        'import_new_db_ms': round(first['import_ms'], 1),
+        'import_current_db_ms': round(statistics.median(r['import_ms'] for r in runs), 1),
+        'first_requests_ms': round(statistics.median(r['first_requests_ms'] for r in runs), 1),
+        'init_db_current_ms': round(statistics.median(r['init_db_current_ms'] for r in runs), 3),
+        'pysnmp_loaded_at_startup': any(r['pysnmp_loaded'] for r in runs),
+        'statuses': runs[-1]['statuses'],
+    }
+    for name, value in results.items():
+        print(f"{name:<26} {value}")
+    print("\nslowest imports (cumulative ms, depth 0 = app itself):")
+    for cumulative, name, depth in profile:
+        print(f"  {cumulative / 1000:8.1f}  {'  ' * depth}{name}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Memory and read cost of the in-memory topology store (topology_store) on a large map.
+
+Builds a map from a simulated topology straight into a temporary database
+(no scan), then measures how much memory the warm MapStore takes and how
+long /api/devices-style reads take from SQLite (dict per sqlite3.Row, as
+before the store) and from the store.
+
+    python -m benchmarks.store_benchmark                  # 10k devices
+    python -m benchmarks.store_benchmark --devices 50000 --topology tree
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.snmp_simulator import SimulatedNetwork
+
+def build_map(models, network):
+    """Writes the network's devices and links as one scan would, in one transaction."""
+    map_id = models.create_map('store-benchmark')
+    conn = sqlite3.connect(models.DB_NAME)
+    cursor = conn.cursor()
+    for i in range(network.devices):
+        models._write_device(cursor, map_id, network.address(i), network.sys_name(i),
+                             'Simulated switch', '1.3.6.1.4.1.9.1.1', 'switch')
+    for i in range(network.devices):
+        for local_port, other, remote_port in network.neighbors[i]:
+            if i < other:
+                models._write_link(cursor, map_id, network.address(i), network.address(other), 'LLDP',
+                                   f'Gi1/0/{local_port}', f'Gi1/0/{remote_port}', '1.0 Gbps', 'Up',
+                                   'U:1, T:100,101', 'U:1, T:100,101', int(network.root_port[i] == local_port),
+                                   int(network.root_port[other] == remote_port))
+    models._bump_version(cursor, map_id)
+    conn.commit()
+    conn.close()
+    return map_id
+
+def read_sqlite(db_name, map_id):
+    """The full /api/devices read as it was before the store."""
+    conn = sqlite3.connect(db_name)
+    conn.row_factory = sqlite3.Row
+    devices = [dict(row) for row in conn.execute("SELECT * FROM devices WHERE map_id = ?", (map_id,))]
+    links = [dict(row) for row in conn.execute("SELECT * FROM links WHERE map_id = ?", (map_id,))]
+    version = conn.execute("SELECT version FROM maps WHERE id = ?", (map_id,)).fetchone()[0]
+    conn.close()
+    return json.dumps({'nodes': devices, 'edges': links, 'version': version, 'full': True}).encode()
+
+def timed(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the topology store on a large map")
+    parser.add_argument('--topology', choices=['tree', 'mesh'], default='mesh')
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work:
+        import models
+        models.DB_NAME = os.path.join(work, 'store.db')
+        models.init_db()
+        network = SimulatedNetwork(args.topology, args.devices)
+        map_id = build_map(models, network)
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        conn = sqlite3.connect(models.DB_NAME)
+        conn.row_factory = sqlite3.Row
+        as_dicts = ([dict(row) for row in conn.execute("SELECT * FROM devices WHERE map_id = ?", (map_id,))],
+                    [dict(row) for row in conn.execute("SELECT * FROM links WHERE map_id = ?", (map_id,))])
+        conn.close()
+        dict_bytes = tracemalloc.get_traced_memory()[0] - before
+        del as_dicts
+
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        store = models.get_topology_store(map_id)
+        warm_ms = (time.perf_counter() - started) * 1000
+        store_bytes = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        devices, links = len(store.devices), len(store.links)
+        version = store.version
+        results = {
+            'devices': devices,
+            'links': links,
+            'store_bytes_traced': store_bytes,
+            'store_bytes_estimated': store.memory_bytes(),
+            'row_dicts_bytes': dict_bytes,
+            'warm_ms': round(warm_ms, 1),
+            'full_read_sqlite_ms': round(timed(lambda: read_sqlite(models.DB_NAME, map_id), args.repeat), 2),
+            'full_read_store_uncached_ms': round(timed(lambda: (store.changed(), models.get_topology_payload(map_id)), args.repeat), 2),
+            'full_read_store_ms': round(timed(lambda: models.get_topology_payload(map_id), args.repeat * 100), 4),
+            'delta_read_store_ms': round(timed(lambda: models.get_topology_changes(map_id, version), args.repeat * 100), 4),
+        }
+    for name, value in results.items():
+        print(f"{name:<28} {value}")
+    print(f"{'bytes_per_device':<28} {results['store_bytes_traced'] / max(1, devices):.0f} "
+          f"(row dicts: {results['row_dicts_bytes'] / max(1, devices):.0f})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Server-side map layout, computed once per topology version.
+
+Devices are first placed radially around their STP root bridge (found from
+the links' source_is_root/target_is_root flags): each switch sits one ring
+further out than its parent, in a wedge sized by how many devices hang
+below it. A vectorized force-directed pass (Fruchterman-Reingold in NumPy)
+then spreads the result out. Coordinates are stored on the devices rows and
+served by /api/devices, so the browser renders with physics off.
+
+When a map only grew, the stored coordinates stay put: new devices start
+next to a placed neighbor and only they move during the force pass.
+"""
+import random
+import threading
+from collections import deque
+
+import numpy as np
+
+from models import get_layout_input, get_layout_state, save_layout
+
+# Ideal distance between linked devices (the vis.js springLength used before)
+NODE_SPACING = 150
+# Force iterations of a full layout and of an incremental one (new devices only)
+LAYOUT_ITERATIONS = 50
+INCREMENTAL_ITERATIONS = 30
+# Pairwise repulsion terms a full layout may evaluate; big maps get fewer iterations
+LAYOUT_PAIR_BUDGET = 100_000_000
+# Rows of the pairwise repulsion computed at once (bounds memory to BLOCK x devices)
+REPULSION_BLOCK = 256
+
+_layout_lock = threading.Lock()
+
+def spanning_forest(count, adjacency, stp_children, stp_parent):
+    """BFS forest following the STP tree first, then any other link.
+
+    Each component is rooted at its STP root bridge (a device others use as
+    root port target and that has no root port itself) when there is one, at
+    its best-connected device otherwise. Returns (roots, parent, order).
+    """
+    parent = [-1] * count
+    visited = [False] * count
+    order = []
+    roots = []
+
+    def grow(queue, neighbors):
+        while queue:
+            u = queue.popleft()
+            for v in neighbors[u]:
+                if not visited[v]:
+                    visited[v] = True
+                    parent[v] = u
+                    order.append(v)
+                    queue.append(v)
+
+    stp_roots = sorted((i for i in range(count) if stp_children[i] and stp_parent[i] < 0),
+                       key=lambda i: -len(stp_children[i]))
+    for start in stp_roots + sorted(range(count), key=lambda i: -len(adjacency[i])):
+        if visited[start]:
+            continue
+        first = len(order)
+        visited[start] = True
+        roots.append(start)
+        order.append(start)
+        grow(deque([start]), stp_children)
+        grow(deque(order[first:]), adjacency)
+    return roots, parent, order
+
+def radial_positions(count, roots, parent, order):
+    """Rings around each root, wedges proportional to subtree size; trees side by side."""
+    children = [[] for _ in range(count)]
+    for v in order:
+        if parent[v] >= 0:
+            children[parent[v]].append(v)
+    weight = [1] * count
+    depth = [0] * count
+    for v in order:
+        if parent[v] >= 0:
+            depth[v] = depth[parent[v]] + 1
+    for v in reversed(order):
+        if parent[v] >= 0:
+            weight[parent[v]] += weight[v]
+
+    pos = np.zeros((count, 2))
+    wedge = {}
+    offset = 0.0
+    for root in roots:
+        tree = [root]
+        wedge[root] = (0.0, 2 * np.pi)
+        radius = 0
+        i = 0
+        while i < len(tree):
+            u = tree[i]
+            i += 1
+            start, span = wedge[u]
+            for v in children[u]:
+                share = span * weight[v] / max(1, weight[u] - 1)
+                wedge[v] = (start, share)
+                start += share
+                tree.append(v)
+            angle = wedge[u][0] + wedge[u][1] / 2
+            pos[u] = (depth[u] * NODE_SPACING * np.cos(angle), depth[u] * NODE_SPACING * np.sin(angle))
+            radius = max(radius, depth[u])
+        # Next tree to the right of this one
+        extent = (radius + 1) * NODE_SPACING
+        pos[tree] += (offset + extent, 0.0)
+        offset += 2 * extent
+    return pos
+
+def force_layout(pos, edges, movable, iterations):
+    """Fruchterman-Reingold on pos (n x 2, modified in place); only rows where movable is True move."""
+    rows = np.nonzero(movable)[0]
+    if not len(rows) or iterations <= 0:
+        return pos
+    k = float(NODE_SPACING)
+    k2 = k * k
+    temperature = NODE_SPACING * 2.0
+    cooling = temperature / iterations
+    source, target = (edges[:, 0], edges[:, 1]) if len(edges) else (None, None)
+    for _ in range(iterations):
+        disp = np.zeros_like(pos)
+        # Repulsion k^2/d between every movable device and every device, in blocks
+        for start in range(0, len(rows), REPULSION_BLOCK):
+            block = rows[start:start + REPULSION_BLOCK]
+            delta = pos[block, None, :] - pos[None, :, :]
+            dist2 = np.einsum('ijk,ijk->ij', delta, delta)
+            np.maximum(dist2, 1e-2, out=dist2)
+            disp[block] += np.einsum('ijk,ij->ik', delta, k2 / dist2)
+        # Attraction d^2/k along the links
+        if source is not None:
+            delta = pos[source] - pos[target]
+            dist = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+            force = delta * (dist / k)[:, None]
+            np.subtract.at(disp, source, force)
+            np.add.at(disp, target, force)
+        disp[~movable] = 0
+        length = np.sqrt(np.einsum('ij,ij->i', disp, disp))
+        np.maximum(length, 1e-9, out=length)
+        pos += disp * (np.minimum(length, temperature) / length)[:, None]
+        temperature = max(temperature - cooling, 1.0)
+    return pos
+
+def compute_layout(ips, links, previous=None, seed=0):
+    """Returns {ip: (x, y)} for ips.
+
+    links are (source_ip, target_ip, source_is_root, target_is_root) rows.
+    previous ({ip: (x, y)}) keeps those devices in place and lays out only the
+    others; without it every device is placed from scratch.
+    """
+    index = {ip: i for i, ip in enumerate(ips)}
+    count = len(ips)
+    if not count:
+        return {}
+    adjacency = [[] for _ in range(count)]
+    stp_children = [[] for _ in range(count)]
+    stp_parent = [-1] * count
+    edges = []
+    for source_ip, target_ip, source_is_root, target_is_root in links:
+        a, b = index.get(source_ip), index.get(target_ip)
+        if a is None or b is None or a == b:
+            continue
+        adjacency[a].append(b)
+        adjacency[b].append(a)
+        edges.append((a, b))
+        # The root port of a bridge leads to its parent in the STP tree
+        if source_is_root and stp_parent[a] < 0:
+            stp_parent[a] = b
+            stp_children[b].append(a)
+        elif target_is_root and stp_parent[b] < 0:
+            stp_parent[b] = a
+            stp_children[a].append(b)
+    edges = np.array(edges, dtype=np.intp).reshape(-1, 2)
+
+    placed = [i for i, ip in enumerate(ips) if previous and previous.get(ip) is not None]
+    if not placed:
+        roots, parent, order = spanning_forest(count, adjacency, stp_children, stp_parent)
+        pos = radial_positions(count, roots, parent, order)
+        iterations = min(LAYOUT_ITERATIONS, max(5, LAYOUT_PAIR_BUDGET // (count * count)))
+        force_layout(pos, edges, np.ones(count, dtype=bool), iterations)
+    else:
+        # Keep what is placed; new devices start next to a placed neighbor (their STP parent first)
+        rng = random.Random(seed)
+        pos = np.zeros((count, 2))
+        movable = np.ones(count, dtype=bool)
+        for i in placed:
+            pos[i] = previous[ips[i]]
+            movable[i] = False
+        queue = deque(placed)
+        done = set(placed)
+        while queue:
+            u = queue.popleft()
+            for v in stp_children[u] + adjacency[u]:
+                if v not in done:
+                    done.add(v)
+                    angle = rng.uniform(0, 2 * np.pi)
+                    pos[v] = pos[u] + (NODE_SPACING * np.cos(angle), NODE_SPACING * np.sin(angle))
+                    queue.append(v)
+        # Devices with no link to the placed ones go in a column right of the map
+        right, top = pos[placed, 0].max() + 2 * NODE_SPACING, pos[placed, 1].min()
+        for n, i in enumerate(i for i in range(count) if i not in done):
+            pos[i] = (right, top + n * NODE_SPACING)
+        force_layout(pos, edges, movable, INCREMENTAL_ITERATIONS)
+    return {ip: (round(float(pos[i, 0]), 1), round(float(pos[i, 1]), 1)) for i, ip in enumerate(ips)}
+
+def ensure_layout(map_id, full=False):
+    """Brings the map's stored coordinates up to its current topology version.
+
+    Only devices without coordinates are laid out, unless full=True, which
+    lays out the whole map again. Moves are published as a new map version.
+    Returns the version the coordinates belong to.
+    """
+    if not full:
+        # Cheap check for the common case: nothing changed since the last layout
+        version, layout_version = get_layout_state(map_id)
+        if layout_version == version:
+            return version
+    with _layout_lock:
+        version, layout_version, positions, links = get_layout_input(map_id)
+        missing = [ip for ip, xy in positions.items() if xy is None]
+        if not full and not missing:
+            # Links may have changed, but devices keep their place until a relayout
+            return version if layout_version == version else save_layout(map_id, {}, version)
+        layout = compute_layout(sorted(positions), links, None if full else positions, seed=map_id)
+        if not full:
+            layout = {ip: layout[ip] for ip in missing}
+        return save_layout(map_id, layout, version)
@@ -1,13 +1,18 @@
 import sqlite3
+import json
 import os
+import queue
+import threading
+import time
+
+from scan_metrics import DB_COMMIT_SECONDS, DB_BATCH_ROWS, DB_ROWS, DB_QUEUE_DEPTH
+from topology_store import MapStore, COLUMN_KINDS
 
 DB_NAME = "network_map.db"
 
-def init_db():
-    # Remove the check 'if not os.path.exists(DB_NAME)' so we always check/migrate
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
+def _migrate_baseline(cursor):
+    """Schema 1: creates the tables, or brings a database from before
+    versioned migrations up to date (each column/index is checked)."""
     # Maps table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS maps (
@@ -53,10 +58,56 @@ def init_db():
         )
     ''')
     
+    # Which MIB groups each device family (sysObjectID) answers, learned by scans
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS capabilities (
+            sys_object_id TEXT,
+            mib TEXT,
+            supported INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (sys_object_id, mib)
+        )
+    ''')
+    
+    # Community that last answered for each device, tried first on rescans
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS device_communities (
+            ip TEXT,
+            map_id INTEGER,
+            community TEXT,
+            PRIMARY KEY (ip, map_id)
+        )
+    ''')
+    
+    # Devices/links removed from a map, so delta readers can drop them too
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tombstones (
+            map_id INTEGER,
+            kind TEXT,
+            item TEXT,
+            version INTEGER
+        )
+    ''')
+    
     cursor.execute("PRAGMA table_info(devices)")
     columns = [column[1] for column in cursor.fetchall()]
     if 'device_type' not in columns:
         cursor.execute("ALTER TABLE devices ADD COLUMN device_type TEXT DEFAULT 'router'")
+    if 'rtt_srtt' not in columns:
+        cursor.execute("ALTER TABLE devices ADD COLUMN rtt_srtt REAL")
+    if 'rtt_var' not in columns:
+        cursor.execute("ALTER TABLE devices ADD COLUMN rtt_var REAL")
+    if 'version' not in columns:
+        cursor.execute("ALTER TABLE devices ADD COLUMN version INTEGER DEFAULT 0")
+    if 'sys_uptime' not in columns:
+        cursor.execute("ALTER TABLE devices ADD COLUMN sys_uptime INTEGER")
+    if 'lldp_last_change' not in columns:
+        cursor.execute("ALTER TABLE devices ADD COLUMN lldp_last_change INTEGER")
+    # Map coordinates computed by graph_layout
+    if 'x' not in columns:
+        cursor.execute("ALTER TABLE devices ADD COLUMN x REAL")
+    if 'y' not in columns:
+        cursor.execute("ALTER TABLE devices ADD COLUMN y REAL")
 
     cursor.execute("PRAGMA table_info(maps)")
     columns = [column[1] for column in cursor.fetchall()]
@@ -64,6 +115,15 @@ def init_db():
         cursor.execute("ALTER TABLE maps ADD COLUMN network TEXT")
     if 'community' not in columns:
         cursor.execute("ALTER TABLE maps ADD COLUMN community TEXT")
+    if 'version' not in columns:
+        cursor.execute("ALTER TABLE maps ADD COLUMN version INTEGER DEFAULT 0")
+    if 'rescan_schedule' not in columns:
+        cursor.execute("ALTER TABLE maps ADD COLUMN rescan_schedule TEXT")
+    if 'last_scan_summary' not in columns:
+        cursor.execute("ALTER TABLE maps ADD COLUMN last_scan_summary TEXT")
+    # Topology version the stored device coordinates were computed for
+    if 'layout_version' not in columns:
+        cursor.execute("ALTER TABLE maps ADD COLUMN layout_version INTEGER")
 
     cursor.execute("PRAGMA table_info(links)")
     columns = [column[1] for column in cursor.fetchall()]
@@ -81,10 +141,74 @@ def init_db():
         cursor.execute("ALTER TABLE links ADD COLUMN source_is_root INTEGER DEFAULT 0")
     if 'target_is_root' not in columns:
         cursor.execute("ALTER TABLE links ADD COLUMN target_is_root INTEGER DEFAULT 0")
-    
-    conn.commit()
-    conn.close()
-    print(f"Database {DB_NAME} initialized/checked.")
+    if 'version' not in columns:
+        cursor.execute("ALTER TABLE links ADD COLUMN version INTEGER DEFAULT 0")
+
+    # Link upserts conflict on (map, normalized endpoints); older databases may hold
+    # duplicates from concurrent scans, keep the first row of each before indexing.
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'idx_links_endpoints'")
+    if not cursor.fetchone():
+        cursor.execute('''
+            DELETE FROM links WHERE id NOT IN (
+                SELECT MIN(id) FROM links GROUP BY map_id, source_ip, target_ip
+            )
+        ''')
+        cursor.execute("CREATE UNIQUE INDEX idx_links_endpoints ON links (map_id, source_ip, target_ip)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_devices_map ON devices (map_id)")
+    # Delta reads: rows changed since a given map version
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_devices_version ON devices (map_id, version)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_links_version ON links (map_id, version)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tombstones_version ON tombstones (map_id, version)")
+
+def _migrate_empty_walk_capabilities(cursor):
+    # Interface snapshot groups used to be learned as unsupported from an empty column
+    # (e.g. vmVlan on a trunk-only switch); drop those so they are walked again
+    cursor.execute('''
+        DELETE FROM capabilities WHERE supported = 0 AND mib IN (
+            'IF-MIB::ifXTable', 'CISCO-VLAN-MEMBERSHIP-MIB::vmVlan',
+            'Q-BRIDGE-MIB::dot1qPvid', 'Q-BRIDGE-MIB::dot1qVlanStaticEgressPorts'
+        )
+    ''')
+
+def _migrate_null_root_flags(cursor):
+    # Links first seen from one end were inserted with NULL root flags; unknown is stored as 0
+    cursor.execute("UPDATE links SET source_is_root = 0 WHERE source_is_root IS NULL")
+    cursor.execute("UPDATE links SET target_is_root = 0 WHERE target_is_root IS NULL")
+
+# Schema migrations in order; PRAGMA user_version holds how many have run.
+# Add new ones at the end (never edit one that has shipped).
+MIGRATIONS = [
+    _migrate_baseline,
+    _migrate_empty_walk_capabilities,
+    _migrate_null_root_flags,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def init_db():
+    """Creates or migrates the database; a current one costs a single PRAGMA read."""
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        # WAL lets the API read maps while a scan is writing (persistent, stored in the file)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # One write transaction: a second process starting at the same time waits, then sees the new version
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            cursor = conn.cursor()
+            for migration in MIGRATIONS[version:]:
+                migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if version < SCHEMA_VERSION:
+            print(f"Database {DB_NAME} migrated from schema {version} to {SCHEMA_VERSION}.")
+    finally:
+        conn.close()
 
 def create_map(name):
     conn = sqlite3.connect(DB_NAME)
@@ -104,6 +228,9 @@ def get_maps():
     cursor.execute("SELECT * FROM maps ORDER BY created_at DESC")
     maps = [dict(row) for row in cursor.fetchall()]
     conn.close()
+    for m in maps:
+        if m.get('last_scan_summary'):
+            m['last_scan_summary'] = json.loads(m['last_scan_summary'])
     return maps
 
 def delete_map(map_id):
@@ -113,8 +240,12 @@ def delete_map(map_id):
         # Delete links and devices first due to FK constraints if any (though SQLite FKs often off by default)
         cursor.execute("DELETE FROM links WHERE map_id = ?", (map_id,))
         cursor.execute("DELETE FROM devices WHERE map_id = ?", (map_id,))
+        cursor.execute("DELETE FROM device_communities WHERE map_id = ?", (map_id,))
+        cursor.execute("DELETE FROM tombstones WHERE map_id = ?", (map_id,))
         cursor.execute("DELETE FROM maps WHERE id = ?", (map_id,))
         conn.commit()
+        with _stores_lock:
+            _stores.pop(map_id, None)
     finally:
         conn.close()
 
@@ -131,129 +262,584 @@ def update_map(map_id, name, network=None, community=None):
     finally:
         conn.close()
 
-def add_device(map_id, ip, sysName, sysDescr, sysObjectID, device_type='router'):
+def set_map_schedule(map_id, rescan_schedule):
+    """Sets the map's cron-like rescan schedule (None disables periodic rescans)."""
     conn = sqlite3.connect(DB_NAME)
     cursor = conn.cursor()
     try:
-        if sysName and sysName != 'Unknown':
-            cursor.execute('''
-                INSERT INTO devices (ip, map_id, sysName, sysDescr, sysObjectID, last_seen, device_type)
-                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
-                ON CONFLICT(ip, map_id) DO UPDATE SET
-                    sysName=excluded.sysName,
-                    sysDescr=excluded.sysDescr,
-                    sysObjectID=excluded.sysObjectID,
-                    last_seen=CURRENT_TIMESTAMP,
-                    device_type=excluded.device_type
-            ''', (ip, map_id, sysName, sysDescr, sysObjectID, device_type))
-        else:
-            # Only update type if it's not unknown
-            cursor.execute('''
-                INSERT INTO devices (ip, map_id, sysName, sysDescr, sysObjectID, last_seen, device_type)
-                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
-                ON CONFLICT(ip, map_id) DO UPDATE SET
-                    last_seen=CURRENT_TIMESTAMP,
-                    device_type=CASE WHEN excluded.device_type != 'router' THEN excluded.device_type ELSE devices.device_type END
-            ''', (ip, map_id, sysName, sysDescr, sysObjectID, device_type))
+        cursor.execute("UPDATE maps SET rescan_schedule = ? WHERE id = ?", (rescan_schedule, map_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def set_map_scan_summary(map_id, summary):
+    """Stores the summary (timings, SNMP and DB counters) of the map's last scan."""
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE maps SET last_scan_summary = ? WHERE id = ?", (json.dumps(summary), map_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+# Learned "unsupported" entries are re-probed after this long, in case of firmware upgrades
+CAPABILITY_TTL_DAYS = 7
+
+def get_capabilities():
+    """Returns {(sys_object_id, mib): supported} for every entry that is still fresh."""
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT sys_object_id, mib, supported FROM capabilities
+        WHERE supported = 1 OR updated_at >= datetime('now', ?)
+    """, (f'-{CAPABILITY_TTL_DAYS} days',))
+    entries = {(row[0], row[1]): bool(row[2]) for row in cursor.fetchall()}
+    conn.close()
+    return entries
+
+def save_capabilities(entries):
+    """Upserts {(sys_object_id, mib): supported} learned during a scan."""
+    if not entries:
+        return
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    try:
+        cursor.executemany('''
+            INSERT INTO capabilities (sys_object_id, mib, supported, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(sys_object_id, mib) DO UPDATE SET
+                supported=excluded.supported,
+                updated_at=CURRENT_TIMESTAMP
+        ''', [(sys_object_id, mib, int(supported)) for (sys_object_id, mib), supported in entries.items()])
+        conn.commit()
+    except Exception as e:
+        print(f"Error saving capabilities: {e}")
+    finally:
+        conn.close()
+
+def get_device_communities(map_id):
+    """Returns {ip: community} for the devices of a map."""
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    cursor.execute("SELECT ip, community FROM device_communities WHERE map_id = ?", (map_id,))
+    communities = dict(cursor.fetchall())
+    conn.close()
+    return communities
+
+def _write_device_community(cursor, map_id, ip, community):
+    cursor.execute('''
+        INSERT INTO device_communities (ip, map_id, community) VALUES (?, ?, ?)
+        ON CONFLICT(ip, map_id) DO UPDATE SET community=excluded.community
+    ''', (ip, map_id, community))
+
+def set_device_community(map_id, ip, community):
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    try:
+        _write_device_community(cursor, map_id, ip, community)
+        conn.commit()
+    except Exception as e:
+        print(f"Error saving community for {ip}: {e}")
+    finally:
+        conn.close()
+
+def get_device_rtts(map_id):
+    """Returns {ip: (srtt, rttvar)} learned by previous scans, in seconds."""
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    cursor.execute("SELECT ip, rtt_srtt, rtt_var FROM devices WHERE map_id = ? AND rtt_srtt IS NOT NULL", (map_id,))
+    rtts = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    conn.close()
+    return rtts
+
+def save_device_rtts(map_id, rtts):
+    """Stores {ip: (srtt, rttvar)} on the device rows so the next scan starts warm."""
+    if not rtts:
+        return
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("UPDATE devices SET rtt_srtt = ?, rtt_var = ? WHERE ip = ? AND map_id = ?",
+                           [(srtt, rttvar, ip, map_id) for ip, (srtt, rttvar) in rtts.items()])
+        conn.commit()
+        _refresh_store(cursor, map_id, ips=rtts)
+    except Exception as e:
+        print(f"Error saving device RTTs: {e}")
+    finally:
+        conn.close()
+
+# Rows written in a transaction are stamped with the map's next version; the
+# map itself is bumped on commit by _bump_version, only if a row got that stamp.
+NEXT_VERSION = "COALESCE((SELECT version + 1 FROM maps WHERE id = ?), 1)"
+
+def _write_device(cursor, map_id, ip, sysName, sysDescr, sysObjectID, device_type=None):
+    # last_seen moves on every write, the version only when a visible field changes.
+    # device_type None means no hint: new rows get 'router', stored rows keep their type
+    # (?6 is the raw device_type, excluded.device_type already has the default applied).
+    if sysName and sysName != 'Unknown':
+        cursor.execute(f'''
+            INSERT INTO devices (ip, map_id, sysName, sysDescr, sysObjectID, last_seen, device_type, version)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, COALESCE(?, 'router'), {NEXT_VERSION})
+            ON CONFLICT(ip, map_id) DO UPDATE SET
+                sysName=excluded.sysName,
+                sysDescr=excluded.sysDescr,
+                sysObjectID=excluded.sysObjectID,
+                last_seen=CURRENT_TIMESTAMP,
+                device_type=COALESCE(?6, devices.device_type),
+                version=CASE WHEN devices.sysName IS NOT excluded.sysName
+                               OR devices.sysDescr IS NOT excluded.sysDescr
+                               OR devices.sysObjectID IS NOT excluded.sysObjectID
+                               OR COALESCE(?6, devices.device_type) IS NOT devices.device_type
+                             THEN excluded.version ELSE devices.version END
+        ''', (ip, map_id, sysName, sysDescr, sysObjectID, device_type, map_id))
+    else:
+        # Only update type if it's not unknown
+        cursor.execute(f'''
+            INSERT INTO devices (ip, map_id, sysName, sysDescr, sysObjectID, last_seen, device_type, version)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, COALESCE(?, 'router'), {NEXT_VERSION})
+            ON CONFLICT(ip, map_id) DO UPDATE SET
+                last_seen=CURRENT_TIMESTAMP,
+                device_type=CASE WHEN excluded.device_type != 'router' THEN excluded.device_type ELSE devices.device_type END,
+                version=CASE WHEN excluded.device_type != 'router' AND excluded.device_type IS NOT devices.device_type
+                             THEN excluded.version ELSE devices.version END
+        ''', (ip, map_id, sysName, sysDescr, sysObjectID, device_type, map_id))
+
+def _bump_version(cursor, map_id):
+    """Publishes the rows stamped in this transaction by advancing the map version."""
+    cursor.execute('''
+        UPDATE maps SET version = version + 1
+        WHERE id = ? AND (
+            EXISTS (SELECT 1 FROM devices WHERE map_id = maps.id AND version > maps.version) OR
+            EXISTS (SELECT 1 FROM links WHERE map_id = maps.id AND version > maps.version) OR
+            EXISTS (SELECT 1 FROM tombstones WHERE map_id = maps.id AND version > maps.version)
+        )
+    ''', (map_id,))
+
+def _write_device_state(cursor, map_id, ip, sys_uptime, lldp_last_change):
+    cursor.execute('''
+        UPDATE devices SET sys_uptime = ?, lldp_last_change = ?, last_seen = CURRENT_TIMESTAMP
+        WHERE ip = ? AND map_id = ?
+    ''', (sys_uptime, lldp_last_change, ip, map_id))
+
+def get_device_states(map_id):
+    """Returns {ip: (sys_uptime, lldp_last_change)} recorded when each device was last walked."""
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    cursor.execute("SELECT ip, sys_uptime, lldp_last_change FROM devices WHERE map_id = ? AND sys_uptime IS NOT NULL", (map_id,))
+    states = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    conn.close()
+    return states
+
+def get_map_neighbors(map_id):
+    """Returns {ip: [neighbor ips]} from the stored links of a map."""
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    cursor.execute("SELECT source_ip, target_ip FROM links WHERE map_id = ?", (map_id,))
+    neighbors = {}
+    for source_ip, target_ip in cursor.fetchall():
+        neighbors.setdefault(source_ip, []).append(target_ip)
+        neighbors.setdefault(target_ip, []).append(source_ip)
+    conn.close()
+    return neighbors
+
+def add_device(map_id, ip, sysName, sysDescr, sysObjectID, device_type=None):
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    try:
+        _write_device(cursor, map_id, ip, sysName, sysDescr, sysObjectID, device_type)
+        _bump_version(cursor, map_id)
         conn.commit()
+        _refresh_store(cursor, map_id, ips=[ip])
     except Exception as e:
         print(f"Error adding device {ip}: {e}")
     finally:
         conn.close()
 
-import threading
+# Merged link columns for the upsert: empty/Unknown values keep what is stored
+LINK_SOURCE_PORT = "COALESCE(NULLIF(NULLIF(excluded.source_port, 'Unknown'), ''), links.source_port)"
+LINK_TARGET_PORT = "COALESCE(NULLIF(NULLIF(excluded.target_port, 'Unknown'), ''), links.target_port)"
+LINK_SPEED = "COALESCE(NULLIF(excluded.speed, ''), links.speed)"
+LINK_STATUS = "COALESCE(NULLIF(NULLIF(excluded.status, 'Unknown'), ''), links.status)"
+LINK_SOURCE_VLAN = "COALESCE(NULLIF(excluded.source_vlan, ''), links.source_vlan)"
+LINK_TARGET_VLAN = "COALESCE(NULLIF(excluded.target_vlan, ''), links.target_vlan)"
+# Root port flags: None means that side was not walked, keep what is stored (new rows get 0).
+# ?11/?12 are the raw flags bound by _write_link; excluded.* already has the default applied
+LINK_SOURCE_ROOT = "COALESCE(?11, links.source_is_root)"
+LINK_TARGET_ROOT = "COALESCE(?12, links.target_is_root)"
 
-DB_LOCK = threading.Lock()
+def _write_link(cursor, map_id, source_ip, target_ip, protocol, source_port=None, target_port=None, speed=None, status=None, source_vlan=None, target_vlan=None, source_is_root=0, target_is_root=0):
+    # Normalize direction: Always store/search as smaller_ip -> larger_ip
+    if source_ip < target_ip:
+        u_source, u_target = source_ip, target_ip
+        u_src_port, u_tgt_port = source_port, target_port
+        u_src_vlan, u_tgt_vlan = source_vlan, target_vlan
+        u_src_root, u_tgt_root = source_is_root, target_is_root
+    else:
+        u_source, u_target = target_ip, source_ip
+        u_src_port, u_tgt_port = target_port, source_port
+        u_src_vlan, u_tgt_vlan = target_vlan, source_vlan
+        u_src_root, u_tgt_root = target_is_root, source_is_root
+    
+    # One indexed upsert (direction-agnostic due to normalization). Ports, speed,
+    # status and VLANs keep their stored value when the new one is empty/Unknown;
+    # a link whose values don't change is left alone, keeping its version.
+    cursor.execute(f'''
+        INSERT INTO links (map_id, source_ip, target_ip, protocol, source_port, target_port, speed, status, source_vlan, target_vlan, source_is_root, target_is_root, version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, 0), COALESCE(?, 0), {NEXT_VERSION})
+        ON CONFLICT(map_id, source_ip, target_ip) DO UPDATE SET
+            source_port={LINK_SOURCE_PORT},
+            target_port={LINK_TARGET_PORT},
+            speed={LINK_SPEED},
+            status={LINK_STATUS},
+            source_vlan={LINK_SOURCE_VLAN},
+            target_vlan={LINK_TARGET_VLAN},
+            source_is_root={LINK_SOURCE_ROOT},
+            target_is_root={LINK_TARGET_ROOT},
+            version=excluded.version
+        WHERE {LINK_SOURCE_PORT} IS NOT links.source_port
+           OR {LINK_TARGET_PORT} IS NOT links.target_port
+           OR {LINK_SPEED} IS NOT links.speed
+           OR {LINK_STATUS} IS NOT links.status
+           OR {LINK_SOURCE_VLAN} IS NOT links.source_vlan
+           OR {LINK_TARGET_VLAN} IS NOT links.target_vlan
+           OR {LINK_SOURCE_ROOT} IS NOT links.source_is_root
+           OR {LINK_TARGET_ROOT} IS NOT links.target_is_root
+    ''', (map_id, u_source, u_target, protocol, u_src_port, u_tgt_port, speed, status,
+          None if u_src_vlan is None else str(u_src_vlan), None if u_tgt_vlan is None else str(u_tgt_vlan),
+          u_src_root, u_tgt_root, map_id))
 
 def add_link(map_id, source_ip, target_ip, protocol, source_port=None, target_port=None, speed=None, status=None, source_vlan=None, target_vlan=None, source_is_root=0, target_is_root=0):
-    with DB_LOCK:
-        conn = sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    try:
+        _write_link(cursor, map_id, source_ip, target_ip, protocol, source_port, target_port, speed, status, source_vlan, target_vlan, source_is_root, target_is_root)
+        _bump_version(cursor, map_id)
+        conn.commit()
+        _refresh_store(cursor, map_id, links=[(source_ip, target_ip)])
+    except Exception as e:
+        print(f"Error adding link {source_ip}->{target_ip}: {e}")
+    finally:
+        conn.close()
+
+# Most rows the writer puts in one transaction
+WRITE_BATCH_SIZE = 1000
+
+class DBWriter:
+    """Single thread that persists queued device/link upserts in batched transactions.
+
+    Scan workers call add_device/add_link/set_device_community, which only
+    enqueue; whatever piles up while a transaction commits goes into the next
+    one. flush() blocks until everything queued before it is committed.
+    """
+    def __init__(self, batch_size=WRITE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self.commits = 0
+        self.commit_seconds = 0.0 # time spent writing and committing batches
+        self._queue = queue.Queue()
+        DB_QUEUE_DEPTH.function = self._queue.qsize
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add_device(self, *args, **kwargs):
+        self._queue.put((_write_device, args, kwargs))
+
+    def add_link(self, *args, **kwargs):
+        self._queue.put((_write_link, args, kwargs))
+
+    def set_device_community(self, *args, **kwargs):
+        self._queue.put((_write_device_community, args, kwargs))
+
+    def set_device_state(self, *args, **kwargs):
+        self._queue.put((_write_device_state, args, kwargs))
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """Waits until every row queued so far is committed."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _run(self):
+        conn = sqlite3.connect(DB_NAME, timeout=30)
+        # Safe with WAL: a crash can only lose the last transactions, never corrupt the file
+        conn.execute("PRAGMA synchronous=NORMAL")
         cursor = conn.cursor()
-        try:
-            # Normalize direction: Always store/search as smaller_ip -> larger_ip
-            if source_ip < target_ip:
-                u_source, u_target = source_ip, target_ip
-                u_src_port, u_tgt_port = source_port, target_port
-                u_src_vlan, u_tgt_vlan = source_vlan, target_vlan
-                u_src_root, u_tgt_root = source_is_root, target_is_root
-            else:
-                u_source, u_target = target_ip, source_ip
-                u_src_port, u_tgt_port = target_port, source_port
-                u_src_vlan, u_tgt_vlan = target_vlan, source_vlan
-                u_src_root, u_tgt_root = target_is_root, source_is_root
-            
-            # Check if this link exists (direction-agnostic due to normalization)
-            cursor.execute('''
-                SELECT id FROM links 
-                WHERE map_id = ? AND source_ip = ? AND target_ip = ?
-            ''', (map_id, u_source, u_target))
-            existing_link = cursor.fetchone()
-            
-            if existing_link:
-                # Update existing link
-                # print(f"DEBUG: Link exists {u_source}->{u_target}. Updating...")
-                
-                updates = []
-                params = []
-                if u_src_port and u_src_port != 'Unknown': 
-                    updates.append("source_port = ?")
-                    params.append(u_src_port)
-                if u_tgt_port and u_tgt_port != 'Unknown': 
-                    updates.append("target_port = ?")
-                    params.append(u_tgt_port)
-                if speed and speed != '':
-                    updates.append("speed = ?")
-                    params.append(speed)
-                if status and status != 'Unknown':
-                    updates.append("status = ?")
-                    params.append(status)
-                if u_src_vlan and u_src_vlan != '':
-                    updates.append("source_vlan = ?")
-                    params.append(str(u_src_vlan))
-                if u_tgt_vlan and u_tgt_vlan != '':
-                    updates.append("target_vlan = ?")
-                    params.append(str(u_tgt_vlan))
-                
-                updates.append("source_is_root = ?")
-                params.append(u_src_root)
-                updates.append("target_is_root = ?")
-                params.append(u_tgt_root)
-                
-                if updates:
-                    sql = f"UPDATE links SET {', '.join(updates)} WHERE id = ?"
-                    params.append(existing_link[0])
-                    cursor.execute(sql, tuple(params))
-                    conn.commit()
-            else:
-                # Insert new link
-                # print(f"DEBUG: Inserting link {u_source} -> {u_target} (Speed: {speed})")
-                cursor.execute('''
-                    INSERT INTO links (map_id, source_ip, target_ip, protocol, source_port, target_port, speed, status, source_vlan, target_vlan, source_is_root, target_is_root)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (map_id, u_source, u_target, protocol, u_src_port, u_tgt_port, speed, status, u_src_vlan, u_tgt_vlan, u_src_root, u_tgt_root))
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            waiters = []
+            touched_maps = {} # {map_id: (device ips, link endpoints)} to copy into the topology stores
+            rows = 0
+            started = time.perf_counter()
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    continue
+                write, args, kwargs = item
+                try:
+                    write(cursor, *args, **kwargs)
+                    ips, links = touched_maps.setdefault(args[0], (set(), set()))
+                    if write is _write_link:
+                        links.add((args[1], args[2]))
+                    elif write is not _write_device_community:
+                        ips.add(args[1])
+                    rows += 1
+                except Exception as e:
+                    print(f"Error writing {write.__name__[7:]} for {args[1]}: {e}")
+            try:
+                for map_id in touched_maps:
+                    _bump_version(cursor, map_id)
                 conn.commit()
-                # print("DEBUG: Link inserted.")
+                self.commits += 1
+            except Exception as e:
+                print(f"Error committing batch: {e}")
+            for map_id, (ips, links) in touched_maps.items():
+                try:
+                    _refresh_store(cursor, map_id, ips, links)
+                except Exception as e:
+                    print(f"Error updating topology store of map {map_id}: {e}")
+            elapsed = time.perf_counter() - started
+            self.rows_written += rows
+            self.commit_seconds += elapsed
+            DB_COMMIT_SECONDS.observe(elapsed)
+            DB_BATCH_ROWS.observe(rows)
+            DB_ROWS.inc(rows)
+            for done in waiters:
+                done.set()
+
+_db_writer = None
+_db_writer_lock = threading.Lock()
+
+def get_db_writer():
+    """Returns the process-wide writer, starting its thread on first use."""
+    global _db_writer
+    with _db_writer_lock:
+        if _db_writer is None:
+            _db_writer = DBWriter()
+        return _db_writer
 
-        except Exception as e:
-            print(f"Error adding link {source_ip}->{target_ip}: {e}")
+# --- In-memory topology stores (topology_store.MapStore), one per map read so far ---
+# Warmed from SQLite on first read; every write below re-reads the rows it
+# committed into the store of its map (write-through), so reads of devices,
+# links, versions and deltas are answered without touching SQLite.
+
+_stores = {}
+_stores_lock = threading.Lock()
+_store_columns = None
+
+# Rows re-read per query when copying written rows into a store
+STORE_REFRESH_CHUNK = 500
+
+def _table_columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [(column[1], COLUMN_KINDS.get((column[2] or '').upper(), 'text')) for column in cursor.fetchall()]
+
+def get_topology_store(map_id):
+    """The map's MapStore, warmed from SQLite on first use."""
+    global _store_columns
+    with _stores_lock:
+        store = _stores.get(map_id)
+        if store is not None:
+            return store
+        conn = sqlite3.connect(DB_NAME)
+        try:
+            if _store_columns is None:
+                _store_columns = (_table_columns(conn.cursor(), 'devices'), _table_columns(conn.cursor(), 'links'))
         finally:
             conn.close()
+        store = MapStore(map_id, *_store_columns)
+        # Writers wait on the lock until the store is warm, then apply their rows on top
+        store.lock.acquire()
+        _stores[map_id] = store
+    try:
+        with TopologySnapshot(map_id) as snapshot:
+            store.version = snapshot.version
+            store.layout_version = snapshot.layout_version
+            for row in snapshot.rows('devices'):
+                store.devices.upsert(row)
+            for row in snapshot.rows('links'):
+                store.links.upsert(row)
+            store.tombstones = sorted(tuple(row) for row in snapshot.rows('tombstones', 'version, kind, item'))
+    except Exception:
+        with _stores_lock:
+            _stores.pop(map_id, None)
+        raise
+    finally:
+        store.lock.release()
+    return store
+
+def _refresh_store(cursor, map_id, ips=(), links=()):
+    """Copies committed rows (device ips, link endpoint pairs) into the map's store, if it is warm."""
+    store = _stores.get(map_id)
+    if store is None:
+        return
+    with store.lock:
+        ips = list(ips)
+        for start in range(0, len(ips), STORE_REFRESH_CHUNK):
+            chunk = ips[start:start + STORE_REFRESH_CHUNK]
+            cursor.execute(f"SELECT * FROM devices WHERE map_id = ? AND ip IN ({','.join('?' * len(chunk))})",
+                           [map_id] + chunk)
+            for row in cursor.fetchall():
+                store.devices.upsert(row)
+        for source_ip, target_ip in links:
+            # Stored as smaller_ip -> larger_ip (see _write_link)
+            cursor.execute("SELECT * FROM links WHERE map_id = ? AND source_ip = ? AND target_ip = ?",
+                           (map_id, min(source_ip, target_ip), max(source_ip, target_ip)))
+            row = cursor.fetchone()
+            if row:
+                store.links.upsert(row)
+        cursor.execute("SELECT version, kind, item FROM tombstones WHERE map_id = ? AND version > ? ORDER BY version",
+                       (map_id, store.version))
+        store.tombstones.extend(cursor.fetchall())
+        cursor.execute("SELECT version, layout_version FROM maps WHERE id = ?", (map_id,))
+        row = cursor.fetchone()
+        store.version, store.layout_version = (row[0], row[1]) if row else (0, None)
+        store.changed()
 
 def get_devices_by_map(map_id):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM devices WHERE map_id = ?", (map_id,))
-    devices = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return devices
+    store = get_topology_store(map_id)
+    with store.lock:
+        return store.devices.all_rows()
 
 def get_links_by_map(map_id):
+    store = get_topology_store(map_id)
+    with store.lock:
+        return store.links.all_rows()
+
+def get_map_version(map_id):
+    return get_topology_store(map_id).version
+
+def get_topology_payload(map_id):
+    """Returns (version, full topology as JSON bytes), encoded once per change of the map."""
+    store = get_topology_store(map_id)
+    with store.lock:
+        return store.version, store.full_payload()
+
+def get_layout_state(map_id):
+    """Returns (version, layout_version) of a map, from its MapStore."""
+    store = get_topology_store(map_id)
+    with store.lock:
+        return store.version, store.layout_version
+
+def get_topology_changes(map_id, since):
+    """Returns what changed on a map after version `since`:
+    {'version', 'nodes', 'edges', 'removed_nodes', 'removed_edges'}."""
+    store = get_topology_store(map_id)
+    with store.lock:
+        return store.changes(since)
+
+def get_layout_input(map_id):
+    """Reads what graph_layout needs from one snapshot: (version, layout_version,
+    {ip: (x, y) or None}, [(source_ip, target_ip, source_is_root, target_is_root)])."""
     conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM links WHERE map_id = ?", (map_id,))
-    links = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return links
+    try:
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT version, layout_version FROM maps WHERE id = ?", (map_id,))
+        row = cursor.fetchone()
+        version, layout_version = row if row else (0, None)
+        cursor.execute("SELECT ip, x, y FROM devices WHERE map_id = ?", (map_id,))
+        positions = {ip: (x, y) if x is not None and y is not None else None for ip, x, y in cursor.fetchall()}
+        cursor.execute("SELECT source_ip, target_ip, source_is_root, target_is_root FROM links WHERE map_id = ?", (map_id,))
+        links = cursor.fetchall()
+        return version, layout_version, positions, links
+    finally:
+        conn.close()
+
+class TopologySnapshot:
+    """A map read from one transaction, row by row, so exports never hold the whole map.
+
+    Use as a context manager; rows() can be called several times and always
+    sees the same version.
+    """
+    def __init__(self, map_id):
+        self.map_id = map_id
+        self.conn = None
+        self.version = 0
+        self.layout_version = None
+
+    def __enter__(self):
+        self.conn = sqlite3.connect(DB_NAME)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("BEGIN")
+        row = self.conn.execute("SELECT version, layout_version FROM maps WHERE id = ?", (self.map_id,)).fetchone()
+        self.version, self.layout_version = (row[0], row[1]) if row else (0, None)
+        return self
+
+    def __exit__(self, *exc):
+        self.conn.close()
+
+    def rows(self, table, columns='*'):
+        # table is 'devices' or 'links' (never user input)
+        cursor = self.conn.execute(f"SELECT {columns} FROM {table} WHERE map_id = ?", (self.map_id,))
+        while True:
+            batch = cursor.fetchmany(500)
+            if not batch:
+                return
+            yield from batch
 
+def save_layout(map_id, positions, layout_version):
+    """Stores device coordinates ({ip: (x, y)}) computed for topology version layout_version.
+
+    The moved devices are stamped with a new map version, so delta readers
+    get the new coordinates too. Returns the map version the coordinates now
+    belong to.
+    """
+    conn = sqlite3.connect(DB_NAME, timeout=30)
+    cursor = conn.cursor()
+    try:
+        if positions:
+            cursor.executemany(f"UPDATE devices SET x = ?, y = ?, version = {NEXT_VERSION} WHERE map_id = ? AND ip = ?",
+                               [(x, y, map_id, map_id, ip) for ip, (x, y) in positions.items()])
+            cursor.execute("SELECT version FROM maps WHERE id = ?", (map_id,))
+            row = cursor.fetchone()
+            _bump_version(cursor, map_id)
+            if row and row[0] == layout_version:
+                # Nothing else changed since the layout was computed: the new version is laid out too
+                cursor.execute("UPDATE maps SET layout_version = version WHERE id = ?", (map_id,))
+            else:
+                # A scan committed meanwhile; its devices still need coordinates
+                cursor.execute("UPDATE maps SET layout_version = ? WHERE id = ?", (layout_version, map_id))
+        else:
+            cursor.execute("UPDATE maps SET layout_version = ? WHERE id = ?", (layout_version, map_id))
+        cursor.execute("SELECT layout_version FROM maps WHERE id = ?", (map_id,))
+        row = cursor.fetchone()
+        conn.commit()
+        _refresh_store(cursor, map_id, ips=positions)
+        return row[0] if row else layout_version
+    finally:
+        conn.close()
+
+def delete_device(map_id, ip):
+    """Removes a device and its links from a map, leaving tombstones for delta readers."""
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f'''
+            INSERT INTO tombstones (map_id, kind, item, version)
+            SELECT map_id, 'link', id, {NEXT_VERSION} FROM links
+            WHERE map_id = ? AND (source_ip = ? OR target_ip = ?)
+        ''', (map_id, map_id, ip, ip))
+        cursor.execute("DELETE FROM links WHERE map_id = ? AND (source_ip = ? OR target_ip = ?)", (map_id, ip, ip))
+        cursor.execute("DELETE FROM devices WHERE map_id = ? AND ip = ?", (map_id, ip))
+        if cursor.rowcount:
+            cursor.execute(f"INSERT INTO tombstones (map_id, kind, item, version) VALUES (?, 'device', ?, {NEXT_VERSION})",
+                           (map_id, ip, map_id))
+        cursor.execute("DELETE FROM device_communities WHERE map_id = ? AND ip = ?", (map_id, ip))
+        _bump_version(cursor, map_id)
+        conn.commit()
+        store = _stores.get(map_id)
+        if store is not None:
+            with store.lock:
+                store.remove_device(ip)
+            _refresh_store(cursor, map_id)
+    finally:
+        conn.close()
@@ -0,0 +1,82 @@
+"""Per-map scan log and progress, shared between the scan engine and the web threads.
+
+Lines live in a bounded ring buffer and carry increasing sequence numbers,
+so readers ask for "everything after seq N" instead of the whole log.
+Every change (line, state, progress) bumps a revision and wakes the
+Server-Sent Events streams waiting on the map.
+"""
+import threading
+from collections import deque
+
+# Lines kept per map; older ones are dropped (readers are told to 'reset')
+LOG_CAPACITY = 2000
+
+class ScanLog:
+    def __init__(self, capacity=LOG_CAPACITY):
+        self.lines = deque(maxlen=capacity) # (seq, message)
+        self.seq = 0        # last sequence number handed out, never reset
+        self.revision = 0   # bumped on any change, for stream waiters
+        self.active = False
+        self.progress = {}
+        self._changed = threading.Condition()
+
+    def _notify(self):
+        self.revision += 1
+        self._changed.notify_all()
+
+    def append(self, message):
+        with self._changed:
+            self.seq += 1
+            self.lines.append((self.seq, message))
+            self._notify()
+
+    def clear(self):
+        """Starts a new scan's log. Sequence numbers keep growing."""
+        with self._changed:
+            # Skipping a seq makes every reader see a gap and reset its view
+            self.seq += 1
+            self.lines.clear()
+            self.progress = {'probed': 0, 'responders': 0, 'links': 0}
+            self._notify()
+
+    def set_active(self, active):
+        with self._changed:
+            self.active = active
+            self._notify()
+
+    def update_progress(self, **counters):
+        with self._changed:
+            self.progress.update(counters)
+            self._notify()
+
+    def read(self, after=0):
+        """Returns the state plus every buffered line with seq > after.
+
+        'reset' means lines after `after` are gone (new scan or dropped from
+        the buffer): the reader should discard what it shows first.
+        """
+        with self._changed:
+            first_seq = self.lines[0][0] if self.lines else self.seq + 1
+            return {
+                'logs': [message for seq, message in self.lines if seq > after],
+                'seq': self.seq,
+                'reset': after + 1 < first_seq and after < self.seq,
+                'active': self.active,
+                'progress': dict(self.progress),
+            }
+
+    def wait(self, revision, timeout):
+        """Blocks until something changes after `revision` (or timeout); returns the new revision."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.revision != revision, timeout)
+            return self.revision
+
+scan_logs = {} # {map_id: ScanLog}
+_scan_logs_lock = threading.Lock()
+
+def get_scan_log(map_id):
+    with _scan_logs_lock:
+        log = scan_logs.get(map_id)
+        if log is None:
+            log = scan_logs[map_id] = ScanLog()
+        return log
@@ -0,0 +1,237 @@
+"""Scan instrumentation: process-wide metrics in the Prometheus text format.
+
+Counters, gauges and histograms are updated from the scan engine loop, the
+DB writer thread and the web threads, and rendered by /metrics. Each scan
+also gets a ScanMetrics, which feeds the process-wide metrics and keeps its
+own per-phase timings and per-OID-family SNMP counts for the summary stored
+on the map when the scan finishes.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Upper bounds of the DB batch size histogram buckets (rows per transaction)
+BATCH_BUCKETS = (1, 5, 10, 50, 100, 250, 500, 1000)
+
+# OID prefixes and the family their requests are counted under (longest prefix first)
+OID_FAMILIES = (
+    ((1, 3, 6, 1, 2, 1, 17, 7), 'q-bridge'),
+    ((1, 3, 6, 1, 2, 1, 17), 'bridge'),
+    ((1, 3, 6, 1, 2, 1, 31), 'if-mib'),
+    ((1, 3, 6, 1, 2, 1, 2), 'if-mib'),
+    ((1, 3, 6, 1, 2, 1, 1), 'system'),
+    ((1, 0, 8802, 1, 1, 2), 'lldp'),
+    ((1, 3, 6, 1, 4, 1, 9, 9, 68), 'cisco-vlan'),
+)
+
+def oid_family(oid):
+    for prefix, family in OID_FAMILIES:
+        if oid[:len(prefix)] == prefix:
+            return family
+    return 'other'
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+class Gauge(Counter):
+    """Gauge set directly, or read from `function()` when rendered (unlabelled)."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self.function is not None:
+            try:
+                return [f"{self.name} {_format_value(self.function())}"]
+            except Exception:
+                return []
+        return super()._samples()
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._values = {} # {label values: [per-bucket counts (+Inf last), sum, count]}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            else:
+                entry[0][-1] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+REGISTRY = []
+
+SCAN_PHASE_SECONDS = Histogram('netmap_scan_phase_seconds', "Time spent per scan phase and operation", ['phase'])
+SNMP_REQUEST_SECONDS = Histogram('netmap_snmp_request_seconds', "SNMP request round trips, timeouts included", ['command'])
+SNMP_REQUESTS = Counter('netmap_snmp_requests_total', "SNMP request PDUs sent, per OID family asked for", ['family', 'command'])
+SNMP_TIMEOUTS = Counter('netmap_snmp_timeouts_total', "SNMP requests that timed out, per OID family", ['family'])
+SNMP_RETRIES = Counter('netmap_snmp_retries_total', "SNMP retransmissions, per OID family", ['family'])
+SCANS = Counter('netmap_scans_total', "Scans finished", ['kind'])
+SCANS_ACTIVE = Gauge('netmap_scans_active', "Scans running")
+SCAN_WORKERS_ACTIVE = Gauge('netmap_scan_workers_active', "Scan workers busy with a host")
+SCAN_HOSTS = Counter('netmap_scan_hosts_total', "Hosts probed by scans")
+DB_COMMIT_SECONDS = Histogram('netmap_db_commit_seconds', "DB writer transactions, writes and commit")
+DB_BATCH_ROWS = Histogram('netmap_db_batch_rows', "Rows per DB writer transaction", buckets=BATCH_BUCKETS)
+DB_ROWS = Counter('netmap_db_rows_written_total', "Rows written by the DB writer")
+# Reads the writer's queue when rendered (function set by models.DBWriter)
+DB_QUEUE_DEPTH = Gauge('netmap_db_queue_depth', "Writes waiting for the DB writer", function=lambda: 0)
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+class ScanMetrics:
+    """One scan's share of the metrics, summarized for the map record.
+
+    Lives on the scan engine loop (or a shard's), like RetryBudget.
+    """
+    def __init__(self):
+        self.phases = {}   # {phase: [count, total seconds, max seconds]}
+        self.families = {} # {family: [{command: requests}, timeouts, retries]}
+        self.db_queue_peak = 0
+
+    def observe(self, phase, seconds):
+        SCAN_PHASE_SECONDS.observe(seconds, phase=phase)
+        entry = self.phases.get(phase)
+        if entry is None:
+            entry = self.phases[phase] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+    @contextmanager
+    def timed(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - started)
+
+    def _family(self, family):
+        entry = self.families.get(family)
+        if entry is None:
+            entry = self.families[family] = [{}, 0, 0]
+        return entry
+
+    def request(self, families, command, seconds, timed_out):
+        SNMP_REQUEST_SECONDS.observe(seconds, command=command)
+        for family in families:
+            SNMP_REQUESTS.inc(family=family, command=command)
+            requests = self._family(family)[0]
+            requests[command] = requests.get(command, 0) + 1
+            if timed_out:
+                SNMP_TIMEOUTS.inc(family=family)
+                self._family(family)[1] += 1
+
+    def retry(self, families):
+        for family in families:
+            SNMP_RETRIES.inc(family=family)
+            self._family(family)[2] += 1
+
+    def sample_db_queue(self, depth):
+        self.db_queue_peak = max(self.db_queue_peak, depth)
+
+    def summary(self):
+        return {
+            'phases': {phase: {'count': count, 'seconds': round(total, 4), 'max': round(peak, 4)}
+                       for phase, (count, total, peak) in sorted(self.phases.items())},
+            'snmp': {family: {'requests': sum(requests.values()), 'by_command': dict(requests),
+                              'timeouts': timeouts, 'retries': retries}
+                     for family, (requests, timeouts, retries) in sorted(self.families.items())},
+            'db_queue_peak': self.db_queue_peak,
+        }
+
+    def merge(self, summary):
+        """Adds another scan's summary (a shard's) to this one and to the process-wide counters."""
+        for phase, values in summary.get('phases', {}).items():
+            entry = self.phases.setdefault(phase, [0, 0.0, 0.0])
+            entry[0] += values['count']
+            entry[1] += values['seconds']
+            entry[2] = max(entry[2], values['max'])
+        for family, values in summary.get('snmp', {}).items():
+            entry = self._family(family)
+            for command, count in values['by_command'].items():
+                entry[0][command] = entry[0].get(command, 0) + count
+                SNMP_REQUESTS.inc(count, family=family, command=command)
+            entry[1] += values['timeouts']
+            entry[2] += values['retries']
+            SNMP_TIMEOUTS.inc(values['timeouts'], family=family)
+            SNMP_RETRIES.inc(values['retries'], family=family)
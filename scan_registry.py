@@ -0,0 +1,128 @@
+"""Devices and links reported during one scan, merged before they are written.
+
+A link between two scanned switches is reported twice, once from each end,
+and every LLDP neighbor comes with a stub device ("Discovered via LLDP")
+that is useless once the neighbor answers SNMP itself. The registry keeps
+each link's two views (each side's port, VLANs and STP root flag, read from
+the device that owns the port) and writes the merged link once, as soon as
+both ends have been scanned; a stub is written only for a neighbor whose own
+scan got no answer. The device type neighbors see in LLDP (switch, access
+point...) is still applied to devices that answered, without touching their
+sysName/sysDescr.
+
+One registry per scan, used from the scan engine loop (or the sharded scan
+coordinator) only; it queues its writes to the DB writer.
+"""
+
+class ScanRegistry:
+    def __init__(self, db, map_id):
+        self.db = db
+        self.map_id = map_id
+        self.described = {}    # {ip: device type written, None if kept} devices that answered SNMP
+        self.device_types = {} # {ip: device type} from neighbors' LLDP capabilities
+        self.finished_ips = set()
+        self.stubs = {}        # {ip: LLDP sysName} neighbors not described yet
+        self.pending = {}      # {(ip, ip) sorted: {ip: side}} links waiting for their other end
+        self.written = set()   # link keys written by this scan
+        self.by_ip = {}        # {ip: set of pending link keys touching it}
+
+    @property
+    def link_count(self):
+        return len(self.written) + len(self.pending)
+
+    def device(self, ip, sys_name, sys_descr, sys_object_id):
+        """A device that answered: written at once, replacing any stub."""
+        # No hint yet: the stored type is kept (a new row gets the default)
+        device_type = self.described[ip] = self.device_types.get(ip)
+        self.stubs.pop(ip, None)
+        self.db.add_device(self.map_id, ip, sys_name, sys_descr, sys_object_id, device_type=device_type)
+
+    def unchanged(self, ip):
+        """A device that answered but is kept as stored (incremental rescan): nothing is written."""
+        self.described.setdefault(ip, None)
+        self.stubs.pop(ip, None)
+
+    def link(self, ip, link):
+        """One end's view of a link (a dict from SNMPHandler.get_links_async)."""
+        other = link['ip']
+        if other == ip:
+            return
+        key = (ip, other) if ip < other else (other, ip)
+        self._type_hint(other, link['device_type'])
+        if key in self.written:
+            return
+        if other not in self.described:
+            self.stubs.setdefault(other, link['sys_name'])
+        sides = self.pending.get(key)
+        if sides is None:
+            sides = self.pending[key] = {}
+            self.by_ip.setdefault(ip, set()).add(key)
+            self.by_ip.setdefault(other, set()).add(key)
+        # Owner's view of its own port; the remote port name from LLDP is only a fallback
+        sides[ip] = {
+            'port': link['source_port'], 'vlan': link['source_vlan'], 'is_root': link['source_is_root'],
+            'speed': link['speed'], 'status': link['status'], 'remote_port': link['target_port'],
+        }
+
+    def finished(self, ip):
+        """ip's scan is over (walked, skipped as unchanged, or silent).
+
+        Writes its stub if it never answered, and every link between it and
+        a device whose scan is over too: neither end will report it again.
+        """
+        self.finished_ips.add(ip)
+        self._write_stub(ip)
+        for key in list(self.by_ip.get(ip, ())):
+            if key[0] in self.finished_ips and key[1] in self.finished_ips:
+                self._write_link(key)
+
+    def flush(self):
+        """End of the scan: writes every stub and link still waiting."""
+        for ip in list(self.stubs):
+            self._write_stub(ip)
+        for key in list(self.pending):
+            self._write_link(key)
+
+    def _type_hint(self, ip, device_type):
+        # 'router' is the default, not something LLDP told us; the first other type wins
+        if device_type == 'router' or ip in self.device_types:
+            return
+        self.device_types[ip] = device_type
+        if self.described.get(ip, device_type) != device_type:
+            # Written before any neighbor reported it: update the type only (no sysName keeps the rest)
+            self.described[ip] = device_type
+            self.db.add_device(self.map_id, ip, None, None, None, device_type=device_type)
+
+    def _write_stub(self, ip):
+        sys_name = self.stubs.pop(ip, None)
+        if sys_name is not None and ip not in self.described:
+            self.db.add_device(self.map_id, ip, sys_name, "Discovered via LLDP", "Unknown",
+                               device_type=self.device_types.get(ip))
+
+    def _write_link(self, key):
+        sides = self.pending.pop(key, None)
+        if sides is None:
+            return
+        for ip in key:
+            keys = self.by_ip.get(ip)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_ip[ip]
+        self.written.add(key)
+        # Neighbors are written before the links that point at them
+        for ip in key:
+            self._write_stub(ip)
+
+        a, b = key
+        side_a, side_b = sides.get(a), sides.get(b)
+        # A side nobody reported: port name from the other end's LLDP table, VLANs and root flag unknown
+        port_a = side_a['port'] if side_a else side_b['remote_port']
+        port_b = side_b['port'] if side_b else side_a['remote_port']
+        first, second = (side_a, side_b) if side_a else (side_b, side_a)
+        speed = first['speed'] or (second['speed'] if second else "")
+        status = first['status'] if first['status'] != "Unknown" or not second else second['status']
+        self.db.add_link(self.map_id, a, b, "LLDP", source_port=port_a, target_port=port_b, speed=speed, status=status,
+                         source_vlan=side_a['vlan'] if side_a else None, target_vlan=side_b['vlan'] if side_b else None,
+                         source_is_root=side_a['is_root'] if side_a else None,
+                         target_is_root=side_b['is_root'] if side_b else None)
@@ -0,0 +1,320 @@
+"""One scheduler for every scan in the app.
+
+Scans run as jobs on the shared scan engine loop. At most MAX_RUNNING_SCANS
+run at once, the rest wait in a FIFO queue. All running scans share one
+RequestLimiter, which caps SNMP requests in flight across the whole app,
+hands free slots to the scans in turn, and paces requests per target subnet.
+Maps with a cron-like `rescan_schedule` are queued for an incremental
+rescan when it matches, each delayed by a per-map offset so maps on the same
+schedule don't start together.
+"""
+import asyncio
+import ipaddress
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+from models import get_maps
+from snmp_handler import get_scan_engine
+
+# Scans running at the same time; later jobs wait in the queue
+MAX_RUNNING_SCANS = 3
+# SNMP requests in flight across all running scans
+GLOBAL_MAX_IN_FLIGHT = 150
+# Slots a sharded scan reserves from the shared limiter and splits between its processes
+SHARDED_SCAN_SLOTS = GLOBAL_MAX_IN_FLIGHT // MAX_RUNNING_SCANS
+# Requests per second sent to one target subnet (of this prefix length), and the burst allowed
+SUBNET_PREFIX = 24
+SUBNET_RATE = 200
+SUBNET_BURST = 20
+# Finished jobs kept for /api/scans
+JOB_HISTORY = 50
+# Seconds between checks of the maps' rescan schedules
+SCHEDULE_TICK = 20
+# Scheduled rescans start up to this many seconds after the minute they match
+SCHEDULE_STAGGER = 300
+
+class RequestLimiter:
+    """Shared SNMP request limiter: global in-flight cap, round-robin between
+    scans when the cap is reached, and per-subnet pacing. Lives on the engine loop."""
+    def __init__(self, max_in_flight=GLOBAL_MAX_IN_FLIGHT, subnet_prefix=SUBNET_PREFIX,
+                 subnet_rate=SUBNET_RATE, subnet_burst=SUBNET_BURST):
+        self.max_in_flight = max_in_flight
+        self.subnet_shift = 32 - subnet_prefix
+        self.subnet_rate = subnet_rate
+        self.subnet_burst = subnet_burst
+        self.in_flight = 0
+        self._waiters = OrderedDict() # {owner: deque of futures}, served round-robin
+        self._next_send = {}          # {subnet: loop time the next request may go out}
+
+    def for_scan(self, owner):
+        return ScanLimiter(self, owner)
+
+    async def acquire(self, owner, ip):
+        await self._pace(ip)
+        await self._take_slot(owner)
+
+    async def reserve(self, owner, slots):
+        """Takes `slots` in-flight slots for requests sent from other processes
+        (a sharded scan's shards); give them back with release() each."""
+        taken = 0
+        try:
+            while taken < slots:
+                await self._take_slot(owner)
+                taken += 1
+        except asyncio.CancelledError:
+            for _ in range(taken):
+                self.release()
+            raise
+
+    async def _take_slot(self, owner):
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(owner, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was handed over just as we got cancelled: pass it on
+                self.release()
+            else:
+                waiters = self._waiters.get(owner)
+                if waiters and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[owner]
+            raise
+
+    def release(self):
+        # Hand the slot straight to the next scan in turn, or free it
+        while self._waiters:
+            owner, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiters.move_to_end(owner)
+            else:
+                del self._waiters[owner]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def _pace(self, ip):
+        try:
+            subnet = int(ipaddress.ip_address(ip)) >> self.subnet_shift
+        except ValueError:
+            return
+        now = asyncio.get_running_loop().time()
+        send_at = max(self._next_send.get(subnet, now), now - self.subnet_burst / self.subnet_rate)
+        self._next_send[subnet] = send_at + 1 / self.subnet_rate
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+class ScanLimiter:
+    """The limiter as seen by one scan's SNMP handlers."""
+    def __init__(self, limiter, owner):
+        self.limiter = limiter
+        self.owner = owner
+
+    async def acquire(self, ip):
+        await self.limiter.acquire(self.owner, ip)
+
+    async def reserve(self, slots):
+        await self.limiter.reserve(self.owner, slots)
+
+    def release(self):
+        self.limiter.release()
+
+def _parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(x) for x in part.split('-', 1))
+        else:
+            start = end = int(part)
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"'{field}' out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """Five-field cron expression (minute hour day month weekday) with
+    '*', lists, ranges and steps. Weekday 0 is Sunday."""
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("expected 5 fields: minute hour day month weekday")
+        self.expression = expression
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = _parse_cron_field(fields[2], 1, 31)
+        self.months = _parse_cron_field(fields[3], 1, 12)
+        self.weekdays = _parse_cron_field(fields[4], 0, 6)
+
+    def matches(self, when):
+        t = time.localtime(when)
+        return (t.tm_min in self.minutes and t.tm_hour in self.hours and t.tm_mday in self.days and
+                t.tm_mon in self.months and (t.tm_wday + 1) % 7 in self.weekdays)
+
+    def min_interval(self):
+        """Lower bound, in seconds, of the time between two matching minutes."""
+        def smallest_gap(values, cycle):
+            ordered = sorted(values)
+            return min(b - a for a, b in zip(ordered, ordered[1:] + [ordered[0] + cycle]))
+        if len(self.minutes) > 1:
+            return smallest_gap(self.minutes, 60) * 60
+        if len(self.hours) > 1:
+            return smallest_gap(self.hours, 24) * 3600
+        return 86400
+
+class ScanJob:
+    def __init__(self, job_id, map_id, network, community, incremental, trigger, shards=1):
+        self.id = job_id
+        self.map_id = map_id
+        self.network = network
+        self.community = community
+        self.incremental = incremental
+        self.trigger = trigger # 'manual' or 'schedule'
+        self.shards = shards   # worker processes (1 = in the app process)
+        self.status = 'queued' # queued, running, done, failed, cancelled
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'map_id': self.map_id, 'network': self.network,
+            'incremental': self.incremental, 'trigger': self.trigger, 'shards': self.shards, 'status': self.status,
+            'error': self.error, 'queued_at': self.queued_at, 'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+class ScanScheduler:
+    """Queues scan jobs and runs them on the scan engine.
+
+    `run_scan(job, limiter)` is the coroutine function doing the actual scan;
+    `on_queue(job, ahead)` is called when a job is accepted, before it can
+    start, with the number of jobs queued before it (e.g. to reset the map's log).
+    """
+    def __init__(self, run_scan, on_queue=None, max_running=MAX_RUNNING_SCANS):
+        self.run_scan = run_scan
+        self.on_queue = on_queue
+        self.max_running = max_running
+        self.limiter = RequestLimiter()
+        self.jobs = OrderedDict() # {job_id: ScanJob}, queued/running plus recent history
+        self._queue = deque()
+        self._running = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._ticker = None
+
+    def start(self):
+        """Starts the periodic rescan loop (once)."""
+        with self._lock:
+            if self._ticker is None:
+                self._ticker = get_scan_engine().submit(self._schedule_loop())
+
+    def submit(self, map_id, network, community, incremental=False, trigger='manual', shards=1):
+        """Queues a scan; returns the job, or None if the map already has one queued or running."""
+        with self._lock:
+            if self._active_job(map_id):
+                return None
+            job = ScanJob(next(self._ids), map_id, network, community, incremental, trigger, shards)
+            self.jobs[job.id] = job
+            self._queue.append(job)
+            if self.on_queue:
+                self.on_queue(job, len(self._queue) - 1)
+            self._dispatch()
+            return job
+
+    def cancel(self, map_id):
+        """Drops the map's queued job; returns True if there was one."""
+        with self._lock:
+            for job in self._queue:
+                if job.map_id == map_id:
+                    self._queue.remove(job)
+                    self._finish(job, 'cancelled')
+                    return True
+            return False
+
+    def active_job(self, map_id):
+        with self._lock:
+            return self._active_job(map_id)
+
+    def list_jobs(self):
+        with self._lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def _active_job(self, map_id):
+        for job in self.jobs.values():
+            if job.map_id == map_id and job.status in ('queued', 'running'):
+                return job
+        return None
+
+    def _dispatch(self):
+        # Called with the lock held
+        while self._queue and self._running < self.max_running:
+            job = self._queue.popleft()
+            job.status = 'running'
+            job.started_at = time.time()
+            self._running += 1
+            get_scan_engine().submit(self._run(job))
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        finished = [j for j in self.jobs.values() if j.status not in ('queued', 'running')]
+        for old in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self.jobs[old.id]
+
+    async def _run(self, job):
+        status, error = 'done', None
+        try:
+            await self.run_scan(job, self.limiter.for_scan(job.id))
+        except Exception as e:
+            status, error = 'failed', str(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._finish(job, status, error)
+                self._dispatch()
+
+    async def _schedule_loop(self):
+        fired = {}   # {map_id: minute (epoch // 60) already queued}
+        pending = {} # {map_id: time the staggered job should be queued}
+        while True:
+            try:
+                maps = await asyncio.to_thread(get_maps)
+                now = time.time()
+                minute = int(now // 60)
+                for m in maps:
+                    if not (m.get('rescan_schedule') and m.get('network') and m.get('community')):
+                        pending.pop(m['id'], None)
+                        continue
+                    try:
+                        schedule = CronSchedule(m['rescan_schedule'])
+                    except ValueError:
+                        continue
+                    if schedule.matches(now) and fired.get(m['id']) != minute:
+                        fired[m['id']] = minute
+                        # Same slot for a map every time, spread across maps, and always before the next match;
+                        # a slot still waiting is kept so frequent matches cannot push it back forever
+                        stagger = min(SCHEDULE_STAGGER, schedule.min_interval())
+                        pending.setdefault(m['id'], minute * 60 + (m['id'] * 97) % stagger)
+                    if m['id'] in pending and now >= pending[m['id']]:
+                        del pending[m['id']]
+                        self.submit(m['id'], m['network'], m['community'], incremental=True, trigger='schedule')
+            except Exception as e:
+                print(f"Scan scheduler error: {e}")
+            await asyncio.sleep(SCHEDULE_TICK)
@@ -0,0 +1,335 @@
+"""Multi-process sharded discovery for very large address spaces.
+
+The address space is partitioned by IP: shard k owns every address with
+int(ip) % shards == k. Each shard is a separate process with its own scan
+engine loop and SNMP handlers, so BER encoding/decoding and LLDP parsing run
+on every core instead of one. A shard sweeps and discovers the CIDR
+addresses it owns and follows the LLDP neighbors it owns itself; neighbors
+owned by another shard go to the coordinator, which routes them to their
+owner. Since every address has exactly one owner and the owner keeps the
+visited set of its partition, no device is probed by two shards.
+
+Shards send their results back in batches; the coordinator (on the app's
+scan engine loop) writes them through models' DB writer like a normal scan.
+"""
+import asyncio
+import ipaddress
+import multiprocessing
+import os
+import queue
+import time
+
+from models import get_db_writer
+from scan_registry import ScanRegistry
+from scan_scheduler import RequestLimiter, GLOBAL_MAX_IN_FLIGHT, SHARDED_SCAN_SLOTS, SUBNET_RATE
+from scan_metrics import ScanMetrics
+from snmp_handler import (SNMPHandler, CapabilityCache, RttEstimator, RetryBudget, SCAN_RETRY_BUDGET,
+                          get_scan_engine, probe_communities_async)
+import snmp_handler
+from snmp_sweep import LivenessSweep, SWEEP_RATE
+
+# Workers (hosts discovered at the same time) per shard process
+SHARD_CONCURRENCY = 50
+# Shards sweep their part of the CIDR first when it has more addresses than this
+SHARD_SWEEP_MIN_HOSTS = 16
+# CIDR addresses stop being generated while this many hosts wait in a shard's frontier
+SHARD_HIGH_WATER = 1000
+# Seconds between result batches sent by a shard
+SHARD_FLUSH_INTERVAL = 0.05
+
+def default_shard_count():
+    return os.cpu_count() or 1
+
+def owned_hosts(network, index, count):
+    """Yields the host addresses of network owned by shard `index`, without walking the others."""
+    start, end = int(network.network_address), int(network.broadcast_address)
+    if network.num_addresses > 2:
+        start, end = start + 1, end - 1
+    first = start + (index - start) % count
+    for ip_int in range(first, end + 1, count):
+        yield str(ipaddress.IPv4Address(ip_int))
+
+def _run_shard(index, count, network_cidr, communities, seed, inbox, outbox):
+    """Process entry point for one shard."""
+    try:
+        get_scan_engine().run(_shard_async(index, count, network_cidr, communities, seed, inbox, outbox))
+    except Exception as e:
+        outbox.put((index, [('log', f"Shard {index} failed: {e}"), ('final', {}, {}, {})]))
+
+async def _shard_async(index, count, network_cidr, communities, seed, inbox, outbox):
+    # Spawned processes start from the default port, not the coordinator's
+    snmp_handler.SNMP_PORT = seed['port']
+    capabilities = CapabilityCache(seed['capabilities'])
+    rtt = {ip: RttEstimator(srtt, rttvar) for ip, (srtt, rttvar) in seed['rtts'].items()}
+    retry_budget = RetryBudget(SCAN_RETRY_BUDGET // count)
+    # The in-flight slots the coordinator reserved, and one scan's subnet rate, split evenly between the shards
+    limiter = RequestLimiter(max(1, seed['max_in_flight'] // count), subnet_rate=SUBNET_RATE / count).for_scan(index)
+    metrics = ScanMetrics()
+    handlers = [SNMPHandler(comm, capabilities=capabilities, rtt=rtt, retry_budget=retry_budget, limiter=limiter,
+                            metrics=metrics)
+                for comm in communities]
+    handlers_by_community = {h.community: h for h in handlers}
+    known_communities = seed['communities']
+    sweep_hints = {}
+    visited = set() # integer IPs of this shard's partition already queued
+    frontier = asyncio.Queue()
+    frontier_space = asyncio.Event()
+    state = {'received': 0, 'in_flight': 0, 'cidr_done': False, 'probed': 0}
+    events = []
+
+    def flush():
+        if events:
+            outbox.put((index, list(events)))
+            events.clear()
+
+    async def flusher():
+        while True:
+            await asyncio.sleep(SHARD_FLUSH_INTERVAL)
+            flush()
+
+    def check_idle():
+        # Tells the coordinator how many routed addresses this shard has fully handled
+        if state['cidr_done'] and state['in_flight'] == 0 and frontier.empty():
+            events.append(('idle', state['received']))
+
+    def enqueue(ip_int):
+        if ip_int not in visited:
+            visited.add(ip_int)
+            frontier.put_nowait(ip_int)
+
+    def follow(ip_str):
+        try:
+            ip_int = int(ipaddress.ip_address(ip_str))
+        except ValueError:
+            return
+        if ip_int % count == index:
+            enqueue(ip_int)
+        else:
+            events.append(('neighbor', ip_str))
+
+    async def scan_ip(ip_str):
+        preferred = handlers_by_community.get(sweep_hints.get(ip_str) or known_communities.get(ip_str))
+        with metrics.timed('community_probe'):
+            valid_snmp, sys_info = await probe_communities_async(handlers, ip_str, preferred)
+        if not (sys_info and valid_snmp):
+            return
+        events.append(('device', ip_str, sys_info['sysName'], sys_info['sysDescr'], sys_info['sysObjectID']))
+        if valid_snmp.community != known_communities.get(ip_str):
+            events.append(('community', ip_str, valid_snmp.community))
+        for link in await valid_snmp.get_links_async(ip_str):
+            events.append(('link', ip_str, link))
+            follow(link['ip'])
+        events.append(('state', ip_str, sys_info['sysUpTime'], sys_info['lldpLastChange']))
+
+    async def worker():
+        while True:
+            ip_int = await frontier.get()
+            frontier_space.set()
+            state['in_flight'] += 1
+            ip_str = str(ipaddress.ip_address(ip_int))
+            try:
+                with metrics.timed('host'):
+                    await scan_ip(ip_str)
+            except Exception as e:
+                events.append(('log', f"Error scanning {ip_str}: {e}"))
+            finally:
+                events.append(('done', ip_str))
+                state['in_flight'] -= 1
+                state['probed'] += 1
+                events.append(('probed', 1))
+                frontier.task_done()
+                check_idle()
+
+    async def candidates(network):
+        hosts = owned_hosts(network, index, count)
+        if network.num_addresses // count > SHARD_SWEEP_MIN_HOSTS:
+            sweep = LivenessSweep(communities, rate=SWEEP_RATE / count, port=snmp_handler.SNMP_PORT)
+            sweep_start = time.monotonic()
+            async for ip, community in sweep.run(hosts):
+                sweep_hints[ip] = community
+                yield ip
+            metrics.observe('sweep', time.monotonic() - sweep_start)
+            events.append(('sweep', sweep.sent, sweep.responders))
+        else:
+            for ip in hosts:
+                yield ip
+
+    async def produce():
+        if '/' in network_cidr:
+            network = ipaddress.ip_network(network_cidr, strict=False)
+            async for ip_str in candidates(network):
+                while frontier.qsize() >= SHARD_HIGH_WATER:
+                    frontier_space.clear()
+                    await frontier_space.wait()
+                enqueue(int(ipaddress.ip_address(ip_str)))
+        elif int(ipaddress.ip_address(network_cidr)) % count == index:
+            enqueue(int(ipaddress.ip_address(network_cidr)))
+        await frontier.join()
+        state['cidr_done'] = True
+        check_idle()
+
+    async def receive():
+        # Addresses routed here by the coordinator; None ends the shard
+        while True:
+            ip_str = await asyncio.to_thread(inbox.get)
+            if ip_str is None:
+                return
+            state['received'] += 1
+            enqueue(int(ipaddress.ip_address(ip_str)))
+            check_idle()
+
+    tasks = [asyncio.ensure_future(worker()) for _ in range(SHARD_CONCURRENCY)]
+    tasks.append(asyncio.ensure_future(flusher()))
+    tasks.append(asyncio.ensure_future(produce()))
+    try:
+        await receive()
+    finally:
+        for task in tasks:
+            task.cancel()
+        events.append(('final', capabilities.dirty,
+                       {ip: (e.srtt, e.rttvar) for ip, e in rtt.items() if e.srtt is not None},
+                       {'retries': retry_budget.used, 'timeouts': retry_budget.timeouts, 'metrics': metrics.summary()}))
+        flush()
+
+async def run_sharded_scan(map_id, network_cidr, communities, shards, capabilities, known_communities, rtts,
+                           log, is_active, on_progress=None, metrics=None, registry=None, limiter=None):
+    """Runs a discovery split across `shards` processes and writes its results.
+
+    `capabilities` ({(sysObjectID, mib): bool}), `known_communities` and
+    `rtts` seed the shards; returns (learned capabilities, {ip: (srtt,
+    rttvar)}, stats). `is_active()` returning False stops the shards. The
+    shards' scan_metrics summaries are merged into `metrics` (a ScanMetrics).
+    Devices and links go through `registry` (a scan_registry.ScanRegistry);
+    one passed in is left for the caller to flush. With `limiter` (the
+    scheduler's ScanLimiter) the shards' in-flight requests come out of
+    SHARDED_SCAN_SLOTS reserved from it for the whole scan, so other running
+    scans keep the app-wide cap; without one they share GLOBAL_MAX_IN_FLIGHT.
+    """
+    max_in_flight = GLOBAL_MAX_IN_FLIGHT
+    if limiter is not None:
+        max_in_flight = SHARDED_SCAN_SLOTS
+        await limiter.reserve(max_in_flight)
+    try:
+        return await _run_shards(map_id, network_cidr, communities, shards, capabilities, known_communities, rtts,
+                                 log, is_active, on_progress, metrics, registry, max_in_flight)
+    finally:
+        if limiter is not None:
+            for _ in range(max_in_flight):
+                limiter.release()
+
+async def _run_shards(map_id, network_cidr, communities, shards, capabilities, known_communities, rtts,
+                      log, is_active, on_progress, metrics, registry, max_in_flight):
+    ctx = multiprocessing.get_context('spawn')
+    outbox = ctx.Queue()
+    inboxes = [ctx.Queue() for _ in range(shards)]
+    processes = []
+    for index in range(shards):
+        def owned(ip):
+            try:
+                return int(ipaddress.ip_address(ip)) % shards == index
+            except ValueError:
+                return False
+        seed = {
+            'capabilities': capabilities,
+            'communities': {ip: c for ip, c in known_communities.items() if owned(ip)},
+            'rtts': {ip: v for ip, v in rtts.items() if owned(ip)},
+            'port': snmp_handler.SNMP_PORT,
+            'max_in_flight': max_in_flight,
+        }
+        process = ctx.Process(target=_run_shard, daemon=True,
+                              args=(index, shards, network_cidr, communities, seed, inboxes[index], outbox))
+        process.start()
+        processes.append(process)
+
+    db = get_db_writer()
+    own_registry = registry is None
+    if own_registry:
+        registry = ScanRegistry(db, map_id)
+    forwarded = [0] * shards # addresses routed to each shard
+    idle = [None] * shards   # routed addresses each shard had handled when it last went idle
+    finished = set()
+    learned, measured_rtts = {}, {}
+    stats = {'probed': 0, 'responders': 0, 'links': 0, 'retries': 0, 'timeouts': 0, 'sweep_sent': 0, 'sweep_responders': 0}
+    stopping = False
+    started = time.monotonic()
+
+    def stop():
+        for inbox in inboxes:
+            inbox.put(None)
+
+    def owner(ip_str):
+        return int(ipaddress.ip_address(ip_str)) % shards
+
+    def apply(index, event):
+        kind = event[0]
+        if kind == 'device':
+            _, ip, sys_name, sys_descr, sys_object_id = event
+            log(f"Found device: {sys_name} ({ip})")
+            stats['responders'] += 1
+            registry.device(ip, sys_name, sys_descr, sys_object_id)
+        elif kind == 'community':
+            db.set_device_community(map_id, event[1], event[2])
+        elif kind == 'link':
+            _, ip, link = event
+            log(f"  Found Link: {ip} -> {link['ip']} ({link['device_type']})")
+            registry.link(ip, link)
+            stats['links'] = registry.link_count
+        elif kind == 'done':
+            registry.finished(event[1])
+        elif kind == 'state':
+            db.set_device_state(map_id, event[1], event[2], event[3])
+        elif kind == 'neighbor':
+            target = owner(event[1])
+            if not stopping and target not in finished:
+                forwarded[target] += 1
+                inboxes[target].put(event[1])
+        elif kind == 'idle':
+            idle[index] = event[1]
+        elif kind == 'probed':
+            stats['probed'] += event[1]
+        elif kind == 'sweep':
+            stats['sweep_sent'] += event[1]
+            stats['sweep_responders'] += event[2]
+        elif kind == 'log':
+            log(event[1])
+        elif kind == 'final':
+            _, shard_learned, shard_rtts, shard_stats = event
+            learned.update(shard_learned)
+            measured_rtts.update(shard_rtts)
+            stats['retries'] += shard_stats.get('retries', 0)
+            stats['timeouts'] += shard_stats.get('timeouts', 0)
+            if metrics is not None and 'metrics' in shard_stats:
+                metrics.merge(shard_stats['metrics'])
+            finished.add(index)
+
+    try:
+        while len(finished) < shards:
+            try:
+                index, batch = await asyncio.to_thread(outbox.get, True, 0.5)
+            except queue.Empty:
+                batch = []
+                for index, process in enumerate(processes):
+                    if index not in finished and not process.is_alive():
+                        log(f"Shard {index} exited unexpectedly (code {process.exitcode})")
+                        finished.add(index)
+                        idle[index] = forwarded[index]
+            for event in batch:
+                apply(index, event)
+            if on_progress:
+                on_progress(probed=stats['probed'], responders=stats['responders'], links=stats['links'])
+            if not stopping and (not is_active() or idle == forwarded):
+                stopping = True
+                stop()
+    finally:
+        if not stopping:
+            stop()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        if own_registry:
+            registry.flush()
+
+    stats['links'] = registry.link_count
+    stats['elapsed'] = time.monotonic() - started
+    return learned, measured_rtts, stats
@@ -0,0 +1,397 @@
+"""Minimal BER encoding/decoding for the SNMPv2c messages the scanner sends itself.
+
+Covers the liveness sweep (a GetRequest with numeric OIDs, reading the
+request-id/error-status back out of a Response) and the fast path of
+SNMPHandler: GET, GETNEXT and GETBULK requests, and Responses carrying
+INTEGER, OCTET STRING, OBJECT IDENTIFIER, IpAddress, Counter32, Gauge32,
+TimeTicks and Counter64 values plus the noSuchObject/noSuchInstance/
+endOfMibView exceptions. Decoded values are small int/bytes/tuple subclasses
+that print like their pysnmp counterparts, so SNMPHandler reads them the
+same way.
+
+Anything else (other PDU or value types, indefinite lengths, long tags)
+raises BerError and that host goes through pysnmp instead. Encoding matches
+pysnmp byte for byte (checked by benchmarks/ber_benchmark.py --validate).
+"""
+import asyncio
+import random
+
+SNMP_VERSION_2C = 1
+
+TAG_INTEGER = 0x02
+TAG_OCTET_STRING = 0x04
+TAG_NULL = 0x05
+TAG_OID = 0x06
+TAG_SEQUENCE = 0x30
+TAG_IP_ADDRESS = 0x40
+TAG_COUNTER32 = 0x41
+TAG_GAUGE32 = 0x42
+TAG_TIMETICKS = 0x43
+TAG_COUNTER64 = 0x46
+TAG_NO_SUCH_OBJECT = 0x80
+TAG_NO_SUCH_INSTANCE = 0x81
+TAG_END_OF_MIB_VIEW = 0x82
+TAG_GET_REQUEST = 0xA0
+TAG_GET_NEXT_REQUEST = 0xA1
+TAG_RESPONSE = 0xA2
+TAG_GET_BULK_REQUEST = 0xA5
+
+# Names of the PDU error-status values (RFC 3416), as pysnmp prints them
+ERROR_STATUS_NAMES = (
+    'noError', 'tooBig', 'noSuchName', 'badValue', 'readOnly', 'genErr', 'noAccess', 'wrongType',
+    'wrongLength', 'wrongEncoding', 'wrongValue', 'noCreation', 'inconsistentValue',
+    'resourceUnavailable', 'commitFailed', 'undoFailed', 'authorizationError', 'notWritable',
+    'inconsistentName',
+)
+
+class BerError(ValueError):
+    """A message this module does not handle (or a malformed one)."""
+
+class RequestTimedOut:
+    """errorIndication of a request that got no reply in time."""
+    def __str__(self):
+        return "No SNMP response received before timeout"
+
+    def __repr__(self):
+        return 'RequestTimedOut()'
+
+class ErrorStatus(int):
+    def prettyPrint(self):
+        return ERROR_STATUS_NAMES[self] if 0 <= self < len(ERROR_STATUS_NAMES) else str(int(self))
+
+# --- Values ---
+
+class Integer(int):
+    __slots__ = ()
+
+class Counter32(int):
+    __slots__ = ()
+
+class Gauge32(int):
+    __slots__ = ()
+
+class TimeTicks(int):
+    __slots__ = ()
+
+class Counter64(int):
+    __slots__ = ()
+
+class OctetString(bytes):
+    __slots__ = ()
+
+    def __str__(self):
+        # pysnmp prints octet strings as ISO-8859-1 text
+        return self.decode('latin-1')
+
+class IpAddress(OctetString):
+    __slots__ = ()
+
+class ObjectIdentifier(tuple):
+    __slots__ = ()
+
+    def __str__(self):
+        return '.'.join(map(str, self))
+
+class _Exception:
+    """Varbind exception values: empty, and no int()."""
+    __slots__ = ()
+
+    def __str__(self):
+        return ''
+
+    def __bytes__(self):
+        return b''
+
+    def __repr__(self):
+        return f'{type(self).__name__}()'
+
+class NoSuchObject(_Exception):
+    __slots__ = ()
+
+class NoSuchInstance(_Exception):
+    __slots__ = ()
+
+class EndOfMibView(_Exception):
+    __slots__ = ()
+
+NO_SUCH_OBJECT = NoSuchObject()
+NO_SUCH_INSTANCE = NoSuchInstance()
+END_OF_MIB_VIEW = EndOfMibView()
+
+# --- Encoding ---
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes((length,))
+    body = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes((0x80 | len(body),)) + body
+
+def encode_tlv(tag, value):
+    return bytes((tag,)) + encode_length(len(value)) + value
+
+def encode_integer(value, tag=TAG_INTEGER):
+    # Two's complement with one spare bit, as pyasn1 writes it (-128 is ff 80)
+    return encode_tlv(tag, value.to_bytes(value.bit_length() // 8 + 1, 'big', signed=True))
+
+def encode_oid(oid):
+    """Encodes a numeric OID given as a tuple of ints or a dotted string."""
+    if isinstance(oid, str):
+        oid = tuple(int(x) for x in oid.strip('.').split('.'))
+    if len(oid) < 2 or oid[0] > 2 or (oid[0] < 2 and oid[1] >= 40):
+        raise BerError(f"invalid OID {oid}")
+    body = bytearray()
+    for arc in (oid[0] * 40 + oid[1],) + tuple(oid[2:]):
+        chunk = bytearray((arc & 0x7F,))
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7F))
+            arc >>= 7
+        body.extend(reversed(chunk))
+    return encode_tlv(TAG_OID, bytes(body))
+
+_EXCEPTION_TAGS = {NoSuchObject: TAG_NO_SUCH_OBJECT, NoSuchInstance: TAG_NO_SUCH_INSTANCE,
+                   EndOfMibView: TAG_END_OF_MIB_VIEW}
+_UNSIGNED_TAGS = {Counter32: TAG_COUNTER32, Gauge32: TAG_GAUGE32, TimeTicks: TAG_TIMETICKS,
+                  Counter64: TAG_COUNTER64}
+
+def encode_value(value):
+    """Encodes a varbind value (None is NULL, as in requests)."""
+    if value is None:
+        return b'\x05\x00'
+    kind = type(value)
+    if kind in _EXCEPTION_TAGS:
+        return bytes((_EXCEPTION_TAGS[kind], 0))
+    if kind is ObjectIdentifier:
+        return encode_oid(value)
+    if kind is IpAddress:
+        return encode_tlv(TAG_IP_ADDRESS, value)
+    if isinstance(value, str):
+        return encode_tlv(TAG_OCTET_STRING, value.encode('latin-1'))
+    if isinstance(value, bytes):
+        return encode_tlv(TAG_OCTET_STRING, bytes(value))
+    if isinstance(value, int):
+        return encode_integer(value, _UNSIGNED_TAGS.get(kind, TAG_INTEGER))
+    raise BerError(f"cannot encode {kind.__name__}")
+
+def encode_message(community, request_id, pdu_tag, varbinds, error_status=0, error_index=0):
+    """Builds a complete SNMPv2c message from (oid, value) varbinds.
+
+    For GetBulkRequest, error_status and error_index carry non-repeaters
+    and max-repetitions.
+    """
+    if isinstance(community, str):
+        community = community.encode()
+    encoded = b''.join(encode_tlv(TAG_SEQUENCE, encode_oid(oid) + encode_value(value)) for oid, value in varbinds)
+    pdu = encode_tlv(pdu_tag,
+                     encode_integer(request_id) + encode_integer(error_status) + encode_integer(error_index) +
+                     encode_tlv(TAG_SEQUENCE, encoded))
+    return encode_tlv(TAG_SEQUENCE,
+                      encode_integer(SNMP_VERSION_2C) + encode_tlv(TAG_OCTET_STRING, community) + pdu)
+
+def encode_request(community, request_id, pdu_tag, oids, non_repeaters=0, max_repetitions=0):
+    """Builds a GetRequest, GetNextRequest or GetBulkRequest for oids."""
+    return encode_message(community, request_id, pdu_tag, [(oid, None) for oid in oids],
+                          non_repeaters, max_repetitions)
+
+def encode_get_request(community, request_id, oids):
+    """Builds a complete SNMPv2c GetRequest message."""
+    return encode_request(community, request_id, TAG_GET_REQUEST, oids)
+
+# --- Decoding ---
+
+def decode_header(data, offset, end=None):
+    """Returns (tag, value_offset, value_length) of the TLV starting at offset."""
+    if end is None:
+        end = len(data)
+    if offset + 2 > end:
+        raise BerError("truncated message")
+    tag = data[offset]
+    if tag & 0x1F == 0x1F:
+        raise BerError("long tags are not supported")
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        n = length & 0x7F
+        if not n:
+            raise BerError("indefinite lengths are not supported")
+        length = int.from_bytes(data[offset:offset + n], 'big')
+        offset += n
+    if offset + length > end:
+        raise BerError("truncated message")
+    return tag, offset, length
+
+def decode_integer(data, offset, length):
+    return int.from_bytes(data[offset:offset + length], 'big', signed=True)
+
+def decode_oid(data, offset, length):
+    arcs = []
+    arc = 0
+    for byte in data[offset:offset + length]:
+        arc = (arc << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            arcs.append(arc)
+            arc = 0
+    if not arcs or data[offset + length - 1] & 0x80:
+        raise BerError("bad OID")
+    first = arcs[0]
+    head = (0, first) if first < 40 else (1, first - 40) if first < 80 else (2, first - 80)
+    return ObjectIdentifier(head + tuple(arcs[1:]))
+
+_UNSIGNED = {tag: kind for kind, tag in _UNSIGNED_TAGS.items()}
+_EXCEPTIONS = {TAG_NO_SUCH_OBJECT: NO_SUCH_OBJECT, TAG_NO_SUCH_INSTANCE: NO_SUCH_INSTANCE,
+               TAG_END_OF_MIB_VIEW: END_OF_MIB_VIEW}
+
+def decode_value(data, tag, offset, length):
+    if tag == TAG_OCTET_STRING:
+        return OctetString(data[offset:offset + length])
+    if tag == TAG_INTEGER:
+        return Integer(decode_integer(data, offset, length))
+    kind = _UNSIGNED.get(tag)
+    if kind is not None:
+        # Unsigned: also reads agents that drop the leading zero byte
+        return kind(int.from_bytes(data[offset:offset + length], 'big'))
+    if tag == TAG_OID:
+        return decode_oid(data, offset, length)
+    if tag == TAG_IP_ADDRESS:
+        return IpAddress(data[offset:offset + length])
+    if tag in _EXCEPTIONS:
+        return _EXCEPTIONS[tag]
+    if tag == TAG_NULL:
+        return None
+    raise BerError(f"unsupported value type 0x{tag:02x}")
+
+def _expect(data, offset, end, tag):
+    found, offset, length = decode_header(data, offset, end)
+    if found != tag:
+        raise BerError(f"expected tag 0x{tag:02x}, got 0x{found:02x}")
+    return offset, length
+
+def decode_message(data):
+    """Decodes a whole SNMPv2c message.
+
+    Returns (community, pdu_tag, request_id, error_status, error_index,
+    [(oid, value), ...]); raises BerError for anything this module does not
+    handle.
+    """
+    data = memoryview(data)
+    offset, length = _expect(data, 0, len(data), TAG_SEQUENCE)
+    end = offset + length
+    offset, length = _expect(data, offset, end, TAG_INTEGER)
+    if decode_integer(data, offset, length) != SNMP_VERSION_2C:
+        raise BerError("not an SNMPv2c message")
+    offset, length = _expect(data, offset + length, end, TAG_OCTET_STRING)
+    community = bytes(data[offset:offset + length])
+    pdu_tag, offset, length = decode_header(data, offset + length, end)
+    if pdu_tag not in (TAG_GET_REQUEST, TAG_GET_NEXT_REQUEST, TAG_RESPONSE, TAG_GET_BULK_REQUEST):
+        raise BerError(f"unsupported PDU type 0x{pdu_tag:02x}")
+    end = offset + length
+    fields = []
+    for _ in range(3): # request-id, error-status, error-index
+        offset, length = _expect(data, offset, end, TAG_INTEGER)
+        fields.append(decode_integer(data, offset, length))
+        offset += length
+    offset, length = _expect(data, offset, end, TAG_SEQUENCE)
+    end = offset + length
+
+    varbinds = []
+    while offset < end:
+        offset, length = _expect(data, offset, end, TAG_SEQUENCE)
+        varbind_end = offset + length
+        oid_offset, oid_length = _expect(data, offset, varbind_end, TAG_OID)
+        tag, value_offset, value_length = decode_header(data, oid_offset + oid_length, varbind_end)
+        varbinds.append((decode_oid(data, oid_offset, oid_length),
+                         decode_value(data, tag, value_offset, value_length)))
+        offset = varbind_end
+    return community, pdu_tag, fields[0], fields[1], fields[2], varbinds
+
+def peek_response(data):
+    """Returns (request_id, error_status, community) of a Response message, or None."""
+    try:
+        tag, offset, _ = decode_header(data, 0)
+        if tag != TAG_SEQUENCE:
+            return None
+        tag, offset, length = decode_header(data, offset)     # version
+        if tag != TAG_INTEGER:
+            return None
+        tag, offset, length = decode_header(data, offset + length) # community
+        if tag != TAG_OCTET_STRING:
+            return None
+        community = bytes(data[offset:offset + length])
+        tag, offset, _ = decode_header(data, offset + length)  # PDU
+        if tag != TAG_RESPONSE:
+            return None
+        tag, offset, length = decode_header(data, offset)      # request-id
+        request_id = decode_integer(data, offset, length)
+        tag, offset, length = decode_header(data, offset + length) # error-status
+        error_status = decode_integer(data, offset, length)
+        return request_id, error_status, community
+    except (IndexError, ValueError):
+        return None
+
+# --- Client ---
+
+class SnmpClient(asyncio.DatagramProtocol):
+    """Sends requests from one UDP socket and matches replies by request-id.
+
+    Lives on the scan engine loop; see ScanEngine.ber_client_async.
+    """
+    def __init__(self):
+        self.transport = None
+        self.pending = {} # {request_id: (future, ip, community)}
+        self._next_id = random.randrange(1, 1 << 30)
+
+    @classmethod
+    async def create(cls):
+        loop = asyncio.get_running_loop()
+        _, client = await loop.create_datagram_endpoint(cls, local_addr=('0.0.0.0', 0))
+        return client
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        header = peek_response(data)
+        if header is None:
+            return
+        request_id, _, community = header
+        entry = self.pending.get(request_id)
+        # Late replies to timed-out requests and strays are dropped
+        if entry is None or entry[1] != addr[0] or entry[2] != community or entry[0].done():
+            return
+        try:
+            _, _, _, error_status, error_index, varbinds = decode_message(data)
+        except BerError as e:
+            entry[0].set_exception(e)
+            return
+        entry[0].set_result((None, ErrorStatus(error_status), error_index, varbinds))
+
+    def error_received(self, exc):
+        # ICMP errors (port unreachable...) are left to the request timeout, as with pysnmp
+        pass
+
+    def _request_id(self):
+        request_id = self._next_id
+        self._next_id = request_id + 1 if request_id < (1 << 31) - 1 else 1
+        return request_id
+
+    async def request(self, ip, port, community, pdu_tag, oids, non_repeaters=0, max_repetitions=0, timeout=1.0):
+        """Sends one request and waits for its reply.
+
+        Returns (errorIndication, errorStatus, errorIndex, varBinds) like
+        pysnmp's commands; raises BerError if the reply cannot be decoded.
+        """
+        if isinstance(community, str):
+            community = community.encode()
+        request_id = self._request_id()
+        message = encode_request(community, request_id, pdu_tag, oids, non_repeaters, max_repetitions)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (future, ip, community)
+        try:
+            self.transport.sendto(message, (ip, port))
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return RequestTimedOut(), ErrorStatus(0), 0, []
+        except OSError as e:
+            return str(e), ErrorStatus(0), 0, []
+        finally:
+            self.pending.pop(request_id, None)
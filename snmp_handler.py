@@ -1,21 +1,74 @@
 import sys
-import importlib
 import asyncio
 import ipaddress
+import threading
+import time
+import types
+from collections import namedtuple
 
-if sys.version_info >= (3, 12):
-    import importlib.metadata
-    import importlib.util
-    # Monkey patch for pysnmp which uses 'imp'
-    import types
-    sys.modules['imp'] = types.ModuleType('imp')
-    import imp
-    imp.reload = importlib.reload
+import snmp_ber
+from scan_metrics import ScanMetrics, oid_family
 
-from pysnmp.hlapi.v3arch import (
-    SnmpEngine, CommunityData, UdpTransportTarget, ContextData,
-    ObjectType, ObjectIdentity, get_cmd, next_cmd, bulk_cmd, walk_cmd
-)
+# UDP port the agents listen on (overridable for local simulators)
+SNMP_PORT = 161
+# Send requests to IPv4 hosts through snmp_ber instead of pysnmp; a host whose
+# reply snmp_ber cannot decode goes back to pysnmp for the rest of the scan
+BER_FAST_PATH = True
+
+# The pysnmp stack, imported on first use (see load_pysnmp)
+_pysnmp = None
+_pysnmp_lock = threading.Lock()
+
+def load_pysnmp():
+    """Imports pysnmp on first use and returns the parts this module needs.
+
+    Importing it takes a large share of the process start-up, and with the
+    snmp_ber fast path most scans never need it, so nothing is imported
+    until a request actually goes through pysnmp.
+    """
+    global _pysnmp
+    with _pysnmp_lock:
+        if _pysnmp is not None:
+            return _pysnmp
+        if sys.version_info >= (3, 12):
+            import importlib.metadata
+            import importlib.util
+            # Monkey patch for pysnmp which uses 'imp'
+            sys.modules['imp'] = types.ModuleType('imp')
+            import imp
+            imp.reload = importlib.reload
+
+        from pysnmp.hlapi.v3arch import (
+            SnmpEngine, CommunityData, UdpTransportTarget, ContextData,
+            ObjectType, ObjectIdentity, get_cmd, next_cmd, bulk_cmd
+        )
+        from pysnmp.proto import errind
+        from pysnmp.proto.rfc1905 import EndOfMibView, NoSuchObject, NoSuchInstance
+
+        _pysnmp = types.SimpleNamespace(
+            SnmpEngine=SnmpEngine, CommunityData=CommunityData, UdpTransportTarget=UdpTransportTarget,
+            ContextData=ContextData, ObjectType=ObjectType, ObjectIdentity=ObjectIdentity,
+            commands={'get': get_cmd, 'getnext': next_cmd, 'getbulk': bulk_cmd},
+            RequestTimedOut=errind.RequestTimedOut, EndOfMibView=EndOfMibView,
+            NoSuchObject=NoSuchObject, NoSuchInstance=NoSuchInstance,
+        )
+        return _pysnmp
+
+def _is_timeout(error_indication):
+    if isinstance(error_indication, snmp_ber.RequestTimedOut):
+        return True
+    # A pysnmp value means pysnmp is already loaded
+    return _pysnmp is not None and isinstance(error_indication, _pysnmp.RequestTimedOut)
+
+def _is_end_of_mib_view(value):
+    if isinstance(value, snmp_ber.EndOfMibView):
+        return True
+    return _pysnmp is not None and isinstance(value, _pysnmp.EndOfMibView)
+
+def _is_no_such(value):
+    if isinstance(value, (snmp_ber.NoSuchObject, snmp_ber.NoSuchInstance)):
+        return True
+    return _pysnmp is not None and isinstance(value, (_pysnmp.NoSuchObject, _pysnmp.NoSuchInstance))
 
 def str_to_tuple(oid_str):
     """Converts a string OID to a tuple of integers for pysnmp to avoid MIB lookups."""
@@ -24,19 +77,538 @@ def str_to_tuple(oid_str):
     except:
         return tuple()
 
+async def probe_communities_async(handlers, ip, preferred=None):
+    """Finds the community a host answers to.
+
+    The preferred handler (the community that worked last time) is tried on
+    its own first; otherwise every candidate is probed at once and the first
+    valid reply wins, cancelling the rest. Returns (handler, sys_info) or
+    (None, None).
+    """
+    if preferred is not None:
+        sys_info = await preferred.get_system_info_async(ip)
+        if sys_info:
+            return preferred, sys_info
+        handlers = [h for h in handlers if h is not preferred]
+
+    tasks = {asyncio.ensure_future(h.get_system_info_async(ip)): h for h in handlers}
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                handler = tasks.pop(task)
+                sys_info = task.result()
+                if sys_info:
+                    return handler, sys_info
+    finally:
+        for task in tasks:
+            task.cancel()
+    return None, None
+
+class ScanEngine:
+    """Owns the single asyncio event loop and SnmpEngine shared by every scan.
+
+    The loop runs forever in a daemon thread. Coroutines are submitted to it
+    from blocking code through run()/submit(); code already running on the
+    loop simply awaits the handler's *_async methods.
+    """
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._snmp_engine = None
+        self._ber_client = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='scan-engine', daemon=True)
+            thread.start()
+            self.loop = loop
+            self._thread = thread
+
+    @property
+    def snmp_engine(self):
+        # Only touched from coroutines running on self.loop, so no locking needed
+        if self._snmp_engine is None:
+            self._snmp_engine = load_pysnmp().SnmpEngine()
+        return self._snmp_engine
+
+    async def ber_client_async(self):
+        """The snmp_ber client (one UDP socket) shared by every scan, opened on first use."""
+        if self._ber_client is None:
+            # A task, so concurrent first callers share one socket
+            self._ber_client = asyncio.ensure_future(snmp_ber.SnmpClient.create())
+        try:
+            return await asyncio.shield(self._ber_client)
+        except OSError:
+            self._ber_client = None
+            raise
+
+    def in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def submit(self, coro):
+        """Schedules a coroutine on the engine loop and returns a concurrent Future."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Runs a coroutine on the engine loop and blocks until it finishes."""
+        if self.in_loop():
+            coro.close()
+            raise RuntimeError("ScanEngine.run() called from the engine loop; await the coroutine instead")
+        return self.submit(coro).result(timeout)
+
+_scan_engine = None
+_scan_engine_lock = threading.Lock()
+
+def get_scan_engine():
+    """Returns the process-wide ScanEngine, creating it on first use."""
+    global _scan_engine
+    with _scan_engine_lock:
+        if _scan_engine is None:
+            _scan_engine = ScanEngine()
+        return _scan_engine
+
+# Rows requested per GETBULK PDU when walking a table
+BULK_MAX_REPETITIONS = 25
+
+class WalkResult:
+    """Rows returned by one table walk plus how many request PDUs it took."""
+    def __init__(self, base_oids):
+        self.base_oids = base_oids
+        self.columns = {oid: [] for oid in base_oids} # {base_oid: [(oid_tuple, value), ...]}
+        self.packets = 0
+        self.mode = 'getbulk'
+        # Columns the agent explicitly rejected (noSuchObject/noSuchInstance or an error status for them)
+        self.unsupported = set()
+
+    @property
+    def base_oid(self):
+        return ', '.join(self.base_oids)
+
+    @property
+    def varbinds(self):
+        """All rows of every column, in column order."""
+        return [vb for oid in self.base_oids for vb in self.columns[oid]]
+
+def table_rows(walk, row_type, columns):
+    """Groups the columns of a WalkResult into row_type instances keyed by OID index."""
+    rows = {}
+    for field, base_oid in columns.items():
+        base_len = len(str_to_tuple(base_oid))
+        for oid, value in walk.columns.get(base_oid, []):
+            index = oid[base_len:]
+            row = rows.get(index)
+            if row is None:
+                row = rows[index] = {'index': index}
+            row[field] = value
+    return {index: row_type(**{f: row.get(f) for f in row_type._fields}) for index, row in rows.items()}
+
+def parse_lldp_capabilities(value):
+    """Decodes lldpRemSysCapEnabled (an LLDP capability BITS value) into names."""
+    caps = []
+    if value is None:
+        return caps
+    data = bytes(value)
+    if len(data) <= 2:
+        # BITS encoding: other(0), repeater(1), bridge(2), wlanAccessPoint(3), router(4), telephone(5), docsis(6), station(7)
+        byte1 = data[0] if data else 0
+        if byte1 & 0x20: caps.append("Bridge")
+        if byte1 & 0x10: caps.append("WLAN AP")
+        if byte1 & 0x08: caps.append("Router")
+        if byte1 & 0x01: caps.append("Station")
+    else:
+        # Some agents return a textual description instead of the bitmask
+        val_str = data.decode('utf-8', 'ignore').lower()
+        if 'wlan' in val_str or 'accesspoint' in val_str: caps.append("WLAN AP")
+        if 'router' in val_str: caps.append("Router")
+        if 'bridge' in val_str: caps.append("Bridge")
+        if 'station' in val_str: caps.append("Station")
+    return caps
+
+class LldpRemoteRow(namedtuple('LldpRemoteRow', ['index', 'port_id', 'sys_name', 'caps_enabled'])):
+    """One lldpRemTable row; index is (lldpRemTimeMark, lldpRemLocalPortNum, lldpRemIndex)."""
+    __slots__ = ()
+
+    @property
+    def port_id_str(self):
+        return str(self.port_id) if self.port_id is not None else "Unknown"
+
+    @property
+    def sys_name_str(self):
+        return str(self.sys_name) if self.sys_name is not None else "Unknown"
+
+    @property
+    def capabilities(self):
+        return parse_lldp_capabilities(self.caps_enabled)
+
+LLDP_REM_COLUMNS = {
+    'port_id': '1.0.8802.1.1.2.1.4.1.1.7',       # lldpRemPortId
+    'sys_name': '1.0.8802.1.1.2.1.4.1.1.9',      # lldpRemSysName
+    'caps_enabled': '1.0.8802.1.1.2.1.4.1.1.12', # lldpRemSysCapEnabled
+}
+LLDP_REM_MAN_ADDR_IF_SUBTYPE = '1.0.8802.1.1.2.1.4.2.1.3'
+
+DOT1Q_VLAN_EGRESS_PORTS = '1.3.6.1.2.1.17.7.1.4.3.1.2'
+
+INTERFACE_SNAPSHOT_COLUMNS = {
+    'if_name': '1.3.6.1.2.1.31.1.1.1.1',        # ifName
+    'if_high_speed': '1.3.6.1.2.1.31.1.1.1.15', # ifHighSpeed (Mbps)
+    'if_descr': '1.3.6.1.2.1.2.2.1.2',          # ifDescr
+    'if_speed': '1.3.6.1.2.1.2.2.1.5',          # ifSpeed (bps)
+    'if_oper_status': '1.3.6.1.2.1.2.2.1.8',    # ifOperStatus
+    'cisco_vlan': '1.3.6.1.4.1.9.9.68.1.2.2.1.2', # CISCO-VLAN-MEMBERSHIP-MIB vmVlan
+    'pvid': '1.3.6.1.2.1.17.7.1.4.5.1.1',       # dot1qPvid
+    'egress_ports': DOT1Q_VLAN_EGRESS_PORTS,
+}
+
+# MIB group probed by each snapshot column; ifTable columns are always read
+CAPABILITY_GROUPS = {
+    'if_name': 'IF-MIB::ifXTable',
+    'if_high_speed': 'IF-MIB::ifXTable',
+    'cisco_vlan': 'CISCO-VLAN-MEMBERSHIP-MIB::vmVlan',
+    'pvid': 'Q-BRIDGE-MIB::dot1qPvid',
+    'egress_ports': 'Q-BRIDGE-MIB::dot1qVlanStaticEgressPorts',
+}
+CAPABILITY_STP = 'BRIDGE-MIB::dot1dStpRootPort'
+
+class CapabilityCache:
+    """Remembers which MIB groups each device family (sysObjectID) answers.
+
+    supports() returns True/False for known groups and None when the group
+    still has to be probed. Learned entries are collected in `dirty` so the
+    caller can persist them; a family that answered a group once is never
+    downgraded by a later empty answer (e.g. a switch without access ports).
+    Callers learn False only from an explicit noSuchObject/noSuchInstance or
+    error status, never from an empty walk.
+    """
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {}) # {(sys_object_id, mib): bool}
+        self.dirty = {}
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def supports(self, sys_object_id, mib):
+        supported = self.entries.get((sys_object_id, mib)) if sys_object_id else None
+        if supported is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if not supported:
+            self.skipped += 1
+        return supported
+
+    def learn(self, sys_object_id, mib, supported):
+        if not sys_object_id:
+            return
+        key = (sys_object_id, mib)
+        current = self.entries.get(key)
+        if current == supported or (current and not supported):
+            return
+        self.entries[key] = supported
+        self.dirty[key] = supported
+
+    def summary(self):
+        return f"{self.hits} hits ({self.skipped} dead probes skipped), {self.misses} misses, {len(self.dirty)} learned"
+
+# Retransmission timeout bounds (seconds). pysnmp keeps one target entry per
+# distinct timeout, so timeouts are rounded up to one of these steps.
+RTO_INITIAL = 1.5
+RTO_STEPS = (0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0)
+# Retries allowed per scan across all hosts, so a lossy site cannot stall the whole scan
+SCAN_RETRY_BUDGET = 10000
+
+# PDU type of each request command ('get', 'getnext', 'getbulk', as named in the metrics)
+BER_PDU_TAGS = {'get': snmp_ber.TAG_GET_REQUEST, 'getnext': snmp_ber.TAG_GET_NEXT_REQUEST,
+                'getbulk': snmp_ber.TAG_GET_BULK_REQUEST}
+
+class RttEstimator:
+    """Smoothed RTT and variance for one target (RFC 6298 SRTT/RTTVAR).
+
+    Only replies to first transmissions are sampled (Karn's algorithm), so
+    a late reply to a retransmitted request cannot skew the estimate.
+    """
+    __slots__ = ('srtt', 'rttvar')
+
+    def __init__(self, srtt=None, rttvar=None):
+        self.srtt = srtt
+        self.rttvar = rttvar
+
+    def observe(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    @property
+    def timeout(self):
+        if self.srtt is None:
+            return RTO_INITIAL
+        rto = self.srtt + max(0.01, 4 * self.rttvar)
+        for step in RTO_STEPS:
+            if step >= rto:
+                return step
+        return RTO_STEPS[-1]
+
+    @property
+    def retries(self):
+        # Fast targets get more, cheaper retries; slow or unknown ones fewer, longer waits
+        if self.srtt is None:
+            return 1
+        return 2 if self.timeout <= 1.0 else 1
+
+class RetryBudget:
+    """Caps the number of retransmissions a scan may spend across all hosts.
+    Also counts the scan's timed-out requests, retried or not."""
+    def __init__(self, limit=SCAN_RETRY_BUDGET):
+        self.limit = limit
+        self.used = 0
+        self.timeouts = 0
+
+    def take(self):
+        if self.used >= self.limit:
+            return False
+        self.used += 1
+        return True
+
+def format_high_speed(high_speed_mbps):
+    if high_speed_mbps >= 1000:
+        return f"{high_speed_mbps/1000} Gbps"
+    elif high_speed_mbps > 0:
+        return f"{high_speed_mbps} Mbps"
+    return ""
+
+def format_speed(speed_bps):
+    if speed_bps >= 1_000_000_000:
+        return f"{speed_bps / 1_000_000_000} Gbps"
+    elif speed_bps >= 1_000_000:
+        return f"{speed_bps / 1_000_000} Mbps"
+    elif speed_bps > 0:
+        return f"{speed_bps} bps"
+    return ""
+
+def format_oper_status(status_int):
+    if status_int == 1: return "Up"
+    elif status_int == 2: return "Down"
+    elif status_int == 5: return "Dormant"
+    return "Other"
+
+def format_vlan_details(untagged, tagged):
+    parts = []
+    if untagged: parts.append(f"U:{untagged}")
+    if tagged: parts.append(f"T:{','.join(map(str, sorted(list(set(tagged)))))}")
+    return ", ".join(parts) if parts else ""
+
+def is_port_in_bitmask(bitmask, port_index):
+    try:
+        if not bitmask: return False
+        data = bytes(bitmask)
+        byte_idx = (port_index - 1) // 8
+        bit_idx = 7 - ((port_index - 1) % 8)
+        if byte_idx < len(data):
+            return bool(data[byte_idx] & (1 << bit_idx))
+    except: pass
+    return False
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except:
+        return None
+
+class InterfaceSnapshot:
+    """In-memory copy of a device's interface, VLAN and STP tables.
+
+    Answers the same questions as the get_interface_* / get_port_vlan_details
+    point GETs, with the same fallbacks and formatting.
+    """
+    def __init__(self, walk, stp_root_port=None):
+        self.stp_root_port = stp_root_port
+        self.packets = walk.packets
+        self.columns = {}
+        for field, base_oid in INTERFACE_SNAPSHOT_COLUMNS.items():
+            base_len = len(str_to_tuple(base_oid))
+            values = {}
+            for oid, value in walk.columns.get(base_oid, []):
+                if len(oid) == base_len + 1:
+                    values[oid[-1]] = value
+            self.columns[field] = values
+        self._tagged_by_port = None
+
+    def name(self, if_index):
+        for field in ('if_name', 'if_descr'):
+            value = self.columns[field].get(if_index)
+            if value is not None and str(value):
+                return str(value)
+        return str(if_index)
+
+    def speed(self, if_index):
+        high_speed = _int_or_none(self.columns['if_high_speed'].get(if_index))
+        if high_speed:
+            speed_str = format_high_speed(high_speed)
+            if speed_str:
+                return speed_str
+        speed = _int_or_none(self.columns['if_speed'].get(if_index))
+        return format_speed(speed) if speed is not None else ""
+
+    def status(self, if_index):
+        status = _int_or_none(self.columns['if_oper_status'].get(if_index))
+        return format_oper_status(status) if status is not None else "Unknown"
+
+    def untagged_vlan(self, if_index):
+        for field in ('cisco_vlan', 'pvid'):
+            vlan = _int_or_none(self.columns[field].get(if_index))
+            if vlan and vlan > 0:
+                return vlan
+        return None
+
+    def vlan_details(self, if_index):
+        if self._tagged_by_port is None:
+            # Invert the egress bitmasks once: port -> [vlan, ...]
+            tagged_by_port = {}
+            for vlan_id, bitmask in self.columns['egress_ports'].items():
+                data = bytes(bitmask)
+                for byte_idx, byte in enumerate(data):
+                    if not byte:
+                        continue
+                    for bit in range(8):
+                        if byte & (0x80 >> bit):
+                            tagged_by_port.setdefault(byte_idx * 8 + bit + 1, []).append(vlan_id)
+            self._tagged_by_port = tagged_by_port
+        untagged = self.untagged_vlan(if_index)
+        tagged = [vlan for vlan in self._tagged_by_port.get(if_index, []) if vlan != untagged]
+        return format_vlan_details(untagged, tagged)
+
 class SNMPHandler:
-    def __init__(self, community):
+    """SNMP v2c queries for one community.
+
+    Every query exists as a coroutine (*_async) for the scan engine and as a
+    blocking method with the original name for existing callers.
+    """
+    def __init__(self, community, engine=None, max_repetitions=None, on_walk=None, capabilities=None,
+                 rtt=None, retry_budget=None, limiter=None, metrics=None):
         self.community = community
+        self.engine = engine or get_scan_engine()
+        self._auth = None # pysnmp CommunityData, built on first pysnmp request
+        self.max_repetitions = max_repetitions or BULK_MAX_REPETITIONS
+        # Called as on_walk(ip, WalkResult) after every table walk
+        self.on_walk = on_walk
+        self.capabilities = capabilities if capabilities is not None else CapabilityCache()
+        # {ip: RttEstimator}; share one dict (and budget) between the handlers of a scan
+        self.rtt = rtt if rtt is not None else {}
+        self.retry_budget = retry_budget if retry_budget is not None else RetryBudget()
+        # Optional shared limiter (acquire(ip)/release()) held around every request sent
+        self.limiter = limiter
+        # Per-scan instrumentation (scan_metrics.ScanMetrics), shared like the retry budget
+        self.metrics = metrics if metrics is not None else ScanMetrics()
+        self._no_bulk_ips = set()
+        self._no_ber_ips = set() # hosts whose replies snmp_ber could not decode
+        self._sys_object_ids = {} # {ip: sysObjectID} from get_system_info
+
+    def _supports(self, ip, mib):
+        return self.capabilities.supports(self._sys_object_ids.get(ip), mib)
+
+    def _learn(self, ip, mib, supported):
+        self.capabilities.learn(self._sys_object_ids.get(ip), mib, supported)
+
+    async def _transport_async(self, ip, timeout):
+        UdpTransportTarget = _pysnmp.UdpTransportTarget
+        try:
+            ipaddress.ip_address(ip)
+        except ValueError:
+            return await UdpTransportTarget.create((ip, SNMP_PORT), timeout=timeout, retries=0)
+        # IP literal: skip the getaddrinfo round trip through the executor
+        transport = UdpTransportTarget.__new__(UdpTransportTarget)
+        transport.transport_address = (ip, SNMP_PORT)
+        transport.__init__(timeout=timeout, retries=0)
+        return transport
 
-    async def _get_cmd_async(self, ip, oids, timeout=1.5, retries=1):
+    def _use_ber(self, ip, command):
+        if not BER_FAST_PATH or ip in self._no_ber_ips:
+            return False
         try:
-            transport = await UdpTransportTarget.create((ip, 161), timeout=timeout, retries=retries)
-            errorIndication, errorStatus, errorIndex, varBinds = await get_cmd(
-                SnmpEngine(),
-                CommunityData(self.community, mpModel=1), # SNMP v2c
-                transport,
-                ContextData(),
-                *[ObjectType(ObjectIdentity(str_to_tuple(oid))) for oid in oids]
+            return ipaddress.ip_address(ip).version == 4
+        except ValueError:
+            return False
+
+    async def _send_async(self, ip, command, oids, args, timeout):
+        """One request PDU, through snmp_ber when possible (may raise BerError), else pysnmp."""
+        if self._use_ber(ip, command):
+            client = await self.engine.ber_client_async()
+            return await client.request(ip, SNMP_PORT, self.community, BER_PDU_TAGS[command], oids,
+                                        *args, timeout=timeout)
+        # First pysnmp request of the process: import it off the engine loop
+        api = _pysnmp or await asyncio.to_thread(load_pysnmp)
+        if self._auth is None:
+            self._auth = api.CommunityData(self.community, mpModel=1) # SNMP v2c
+        transport = await self._transport_async(ip, timeout)
+        request = [api.ObjectType(api.ObjectIdentity(oid)) for oid in oids]
+        return await api.commands[command](self.engine.snmp_engine, self._auth, transport, api.ContextData(),
+                                           *args, *request)
+
+    async def _request_async(self, ip, command, oids, *args):
+        """Sends one request PDU for oids (tuples), retransmitting on timeout.
+
+        command is 'get', 'getnext' or 'getbulk'; args go before the varbinds (GETBULK's non-repeaters and
+        max-repetitions). The timeout and retry count come from the target's
+        RttEstimator; each retransmission doubles the timeout and spends one
+        unit of the scan's retry budget. Returns (errorIndication,
+        errorStatus, errorIndex, varBinds, packets_sent).
+        """
+        families = {oid_family(oid) for oid in oids}
+        estimator = self.rtt.get(ip)
+        if estimator is None:
+            estimator = self.rtt[ip] = RttEstimator()
+        timeout = estimator.timeout
+        retries = estimator.retries
+        packets = 0
+        while True:
+            if self.limiter:
+                await self.limiter.acquire(ip)
+            try:
+                started = time.monotonic()
+                errorIndication, errorStatus, errorIndex, varBinds = await self._send_async(
+                    ip, command, oids, args, timeout
+                )
+            except snmp_ber.BerError as e:
+                print(f"SNMP reply from {ip} not handled by snmp_ber ({e}); using pysnmp")
+                self._no_ber_ips.add(ip)
+                # Timeouts learnt on the fast path are too short for pysnmp's overhead
+                estimator = self.rtt[ip] = RttEstimator()
+                timeout = estimator.timeout
+                retries = estimator.retries
+                continue
+            finally:
+                if self.limiter:
+                    self.limiter.release()
+            packets += 1
+            elapsed = time.monotonic() - started
+            timed_out = _is_timeout(errorIndication)
+            self.metrics.request(families, command, elapsed, timed_out)
+            if not timed_out:
+                if packets == 1 and not errorIndication:
+                    estimator.observe(elapsed)
+                return errorIndication, errorStatus, errorIndex, varBinds, packets
+            self.retry_budget.timeouts += 1
+            if packets > retries or not self.retry_budget.take():
+                return errorIndication, errorStatus, errorIndex, varBinds, packets
+            self.metrics.retry(families)
+            timeout = min(timeout * 2, RTO_STEPS[-1])
+
+    async def _get_cmd_async(self, ip, oids):
+        try:
+            errorIndication, errorStatus, errorIndex, varBinds, _ = await self._request_async(
+                ip, 'get', [str_to_tuple(oid) for oid in oids]
             )
             return errorIndication, errorStatus, errorIndex, varBinds
         except Exception as e:
@@ -44,13 +616,18 @@ class SNMPHandler:
 
     def get_system_info(self, ip):
         """Retrieves system name, description, and OID."""
+        return self.engine.run(self.get_system_info_async(ip))
+
+    async def get_system_info_async(self, ip):
         try:
             oids = [
                 '1.3.6.1.2.1.1.5.0', # sysName
                 '1.3.6.1.2.1.1.1.0', # sysDescr
-                '1.3.6.1.2.1.1.2.0'  # sysObjectID
+                '1.3.6.1.2.1.1.2.0', # sysObjectID
+                '1.3.6.1.2.1.1.3.0', # sysUpTime
+                '1.0.8802.1.1.2.1.2.1.0' # lldpStatsRemTablesLastChangeTime
             ]
-            errorIndication, errorStatus, errorIndex, varBinds = asyncio.run(self._get_cmd_async(ip, oids))
+            errorIndication, errorStatus, errorIndex, varBinds = await self._get_cmd_async(ip, oids)
 
             if errorIndication:
                 print(f"SNMP Error for {ip}: {errorIndication}")
@@ -59,207 +636,271 @@ class SNMPHandler:
                 print(f"SNMP Error for {ip}: {errorStatus.prettyPrint()}")
                 return None
             else:
+                self._sys_object_ids[ip] = str(varBinds[2][1])
                 return {
                     'sysName': str(varBinds[0][1]),
                     'sysDescr': str(varBinds[1][1]),
-                    'sysObjectID': str(varBinds[2][1])
+                    'sysObjectID': str(varBinds[2][1]),
+                    # Change markers for incremental rescans (None if not supported)
+                    'sysUpTime': _int_or_none(varBinds[3][1]),
+                    'lldpLastChange': _int_or_none(varBinds[4][1])
                 }
         except Exception as e:
             print(f"Exception during SNMP get for {ip}: {e}")
             return None
 
-    async def _next_cmd_async(self, ip, base_oid, timeout=3, retries=2):
-        results = []
+    async def _walk_async(self, ip, base_oid, max_repetitions=None):
+        """Walks the subtree under base_oid; see _walk_columns_async."""
+        return await self._walk_columns_async(ip, [base_oid], max_repetitions)
+
+    async def _walk_columns_async(self, ip, base_oids, max_repetitions=None):
+        """Walks several columns in the same request PDUs with GETBULK, falling back to GETNEXT.
+
+        Every PDU carries the next OID of each column that has not finished
+        yet, so the columns advance in lockstep. Agents that answer GETBULK
+        with an error status, an empty PDU or OIDs that do not increase are
+        remembered and walked with GETNEXT from then on; a timeout ends the
+        walk with the rows collected so far.
+        """
+        result = WalkResult(base_oids)
+        bases = [str_to_tuple(oid) for oid in base_oids]
+        current = list(bases)
+        active = list(range(len(bases)))
+        max_repetitions = max_repetitions or self.max_repetitions
+        use_bulk = ip not in self._no_bulk_ips
         try:
-            transport = await UdpTransportTarget.create((ip, 161), timeout=timeout, retries=retries)
-            # walk_cmd in pysnmp 7.x returns an async generator
-            async for (errorIndication, errorStatus, errorIndex, varBinds) in walk_cmd(
-                SnmpEngine(),
-                CommunityData(self.community, mpModel=1),
-                transport,
-                ContextData(),
-                ObjectType(ObjectIdentity(str_to_tuple(base_oid))),
-                lexicographicMode=False
-            ):
-                if errorIndication or errorStatus:
+            while active:
+                request = [current[col] for col in active]
+                if use_bulk:
+                    errorIndication, errorStatus, errorIndex, varBinds, packets = await self._request_async(
+                        ip, 'getbulk', request, 0, max_repetitions
+                    )
+                else:
+                    errorIndication, errorStatus, errorIndex, varBinds, packets = await self._request_async(
+                        ip, 'getnext', request
+                    )
+                result.packets += packets
+
+                if errorIndication:
+                    # Timeout or transport error: the host is not answering, not mishandling GETBULK.
+                    # Keep what was collected rather than retrying the walk with GETNEXT
                     break
-                results.append((errorIndication, errorStatus, errorIndex, varBinds))
+
+                if use_bulk and errorStatus and int(errorStatus) == 1 and max_repetitions > 1:
+                    # tooBig: ask for fewer rows per PDU
+                    max_repetitions = max(1, max_repetitions // 2)
+                    continue
+
+                if not use_bulk and errorStatus and 0 < int(errorIndex) <= len(active):
+                    # GETNEXT error naming one column: that column is done, the others go on
+                    col = active[int(errorIndex) - 1]
+                    if not result.columns[base_oids[col]]:
+                        result.unsupported.add(base_oids[col])
+                    active.remove(col)
+                    continue
+
+                bulk_failed = bool(errorStatus or not varBinds)
+                finished = set()
+                for i, (oid, value) in enumerate([] if bulk_failed else varBinds):
+                    # Responses are row-major: one varbind per requested column per repetition
+                    col = active[i % len(active)]
+                    if col in finished:
+                        continue
+                    oid = tuple(oid)
+                    base = bases[col]
+                    if _is_no_such(value):
+                        result.unsupported.add(base_oids[col])
+                        finished.add(col)
+                        continue
+                    if _is_end_of_mib_view(value) or oid[:len(base)] != base:
+                        finished.add(col)
+                        continue
+                    if oid <= current[col]:
+                        bulk_failed = True
+                        break
+                    result.columns[base_oids[col]].append((oid, value))
+                    current[col] = oid
+
+                active = [col for col in active if col not in finished]
+                if bulk_failed:
+                    if not use_bulk:
+                        break
+                    # Agent mishandles GETBULK: continue this walk (and later ones) with GETNEXT
+                    self._no_bulk_ips.add(ip)
+                    use_bulk = False
+            if not use_bulk:
+                result.mode = 'getnext'
         except Exception as e:
             print(f"Async walk error for {ip}: {e}")
-        return results
+        if self.on_walk:
+            self.on_walk(ip, result)
+        return result
 
-    def get_neighbors_details(self, ip):
+    async def read_table_async(self, ip, row_type, columns, **walk_options):
+        """Reads a table into row_type instances keyed by their OID index.
+
+        columns maps each field of row_type (other than 'index') to its column
+        OID. Columns missing from a row are left as None.
+        """
+        walk = await self._walk_columns_async(ip, list(columns.values()), **walk_options)
+        return table_rows(walk, row_type, columns), walk
+
+    async def get_links_async(self, ip):
+        """Reads the interface snapshot and LLDP table of ip and returns one dict
+        per neighbor that advertised an address: ip, sys_name, device_type,
+        source_port, target_port, speed, status, source_vlan, source_is_root."""
+        # Interface/VLAN/STP tables are read once and answer every per-port lookup below
+        snapshot = await self.get_interface_snapshot_async(ip)
+        stp_root_port = snapshot.stp_root_port
+
+        links = []
+        for neighbor in await self.get_neighbors_details_async(ip, snapshot):
+            if not neighbor.get('ip'):
+                continue
+            link = {
+                'ip': neighbor['ip'],
+                'sys_name': neighbor.get('sys_name', "Unknown"),
+                'device_type': neighbor.get('device_type', 'router'),
+                'source_port': neighbor.get('local_port', 'Unknown'),
+                'target_port': neighbor.get('remote_port', 'Unknown'),
+                'speed': "",
+                'status': "Unknown",
+                'source_vlan': None,
+                'source_is_root': 0,
+            }
+            if 'local_port_index' in neighbor:
+                port_index = neighbor['local_port_index']
+                link['speed'] = snapshot.speed(port_index)
+                link['status'] = snapshot.status(port_index)
+                with self.metrics.timed('vlan_parse'):
+                    link['source_vlan'] = snapshot.vlan_details(port_index)
+                if stp_root_port and int(port_index) == stp_root_port:
+                    link['source_is_root'] = 1
+            links.append(link)
+        return links
+
+    def get_neighbors_details(self, ip, snapshot=None):
+        return self.engine.run(self.get_neighbors_details_async(ip, snapshot))
+
+    async def get_neighbors_details_async(self, ip, snapshot=None):
         neighbors = []
         try:
-            # 1. Fetch lldpRemSysCapEnabled (.12)
-            remote_caps = {}
-            walk_results = asyncio.run(self._next_cmd_async(ip, '1.0.8802.1.1.2.1.4.1.1.12'))
-            for _, _, _, varBinds in walk_results:
-                for varBind in varBinds:
-                    oid, value = varBind
-                    try:
-                        oid_list = list(oid)
-                        if len(oid_list) >= 14:
-                            local_port_num = oid_list[12]
-                            remote_index = oid_list[13]
-                            val_str = value.prettyPrint().strip()
-                            current_caps = []
-                            if val_str.lower().startswith('0x'):
-                                try:
-                                    hex_val = val_str[2:]
-                                    if len(hex_val) >= 2:
-                                        byte1 = int(hex_val[:2], 16)
-                                        if byte1 & 0x20: current_caps.append("Bridge")
-                                        if byte1 & 0x10: current_caps.append("WLAN AP")
-                                        if byte1 & 0x08: current_caps.append("Router")
-                                        if byte1 & 0x01: current_caps.append("Station")
-                                except: pass
-                            else:
-                                if 'wlan' in val_str.lower() or 'accesspoint' in val_str.lower(): current_caps.append("WLAN AP")
-                                if 'router' in val_str.lower(): current_caps.append("Router")
-                                if 'bridge' in val_str.lower(): current_caps.append("Bridge")
-                                if 'station' in val_str.lower(): current_caps.append("Station")
-                            remote_caps[(local_port_num, remote_index)] = current_caps
-                    except: pass
-
-            # 2. Fetch lldpRemPortId (.7)
-            remote_ports = {}
-            walk_results = asyncio.run(self._next_cmd_async(ip, '1.0.8802.1.1.2.1.4.1.1.7'))
-            for _, _, _, varBinds in walk_results:
-                for varBind in varBinds:
-                    oid, value = varBind
-                    try:
-                        oid_list = list(oid)
-                        if len(oid_list) >= 14:
-                            local_port_num = oid_list[12]
-                            remote_index = oid_list[13]
-                            remote_ports[(local_port_num, remote_index)] = str(value)
-                    except: pass
-
-            # 3. Fetch lldpRemSysName (.9)
-            remote_sysnames = {}
-            walk_results = asyncio.run(self._next_cmd_async(ip, '1.0.8802.1.1.2.1.4.1.1.9'))
-            for _, _, _, varBinds in walk_results:
-                for varBind in varBinds:
-                    oid, value = varBind
-                    try:
-                        oid_list = list(oid)
-                        if len(oid_list) >= 14:
-                            local_port_num = oid_list[12]
-                            remote_index = oid_list[13]
-                            remote_sysnames[(local_port_num, remote_index)] = str(value)
-                    except: pass
-
-            # 4. Fetch lldpRemManAddr correlations
-            walk_results = asyncio.run(self._next_cmd_async(ip, '1.0.8802.1.1.2.1.4.2.1.3'))
-            for _, _, _, varBinds in walk_results:
-                for varBind in varBinds:
-                    oid, value = varBind
-                    try:
-                        oid_list = list(oid)
-                        if len(oid_list) >= 16:
-                            local_port_num = oid_list[12]
-                            remote_index = oid_list[13]
-                            subtype = oid_list[14]
-                            addr_len = oid_list[15]
-                            if subtype == 1 and addr_len == 4 and len(oid_list) >= 16+4:
-                                ip_bytes = oid_list[16:16+4]
-                                ip_addr = ".".join(map(str, ip_bytes))
-                                local_port_name = self.get_interface_name(ip, local_port_num)
-                                remote_port_name = remote_ports.get((local_port_num, remote_index), "Unknown")
-                                caps = remote_caps.get((local_port_num, remote_index), [])
-                                sys_name = remote_sysnames.get((local_port_num, remote_index), "Unknown")
-                                device_type = 'router'
-                                if 'WLAN AP' in caps: device_type = 'access_point'
-                                elif 'Bridge' in caps: device_type = 'switch'
-                                elif 'Station' in caps and 'Router' not in caps: device_type = 'server'
-                                neighbors.append({
-                                    'sys_name': sys_name,
-                                    'ip': ip_addr, 
-                                    'local_port': local_port_name,
-                                    'local_port_index': local_port_num,
-                                    'remote_port': remote_port_name,
-                                    'device_type': device_type,
-                                    'capabilities': caps
-                                })
-                    except: pass
+            # lldpRemTable and lldpRemManAddrTable columns travel in the same PDUs
+            with self.metrics.timed('lldp_walk'):
+                walk = await self._walk_columns_async(ip, list(LLDP_REM_COLUMNS.values()) + [LLDP_REM_MAN_ADDR_IF_SUBTYPE])
+            remotes = table_rows(walk, LldpRemoteRow, LLDP_REM_COLUMNS)
+            base_len = len(str_to_tuple(LLDP_REM_MAN_ADDR_IF_SUBTYPE))
+
+            for oid, value in walk.columns[LLDP_REM_MAN_ADDR_IF_SUBTYPE]:
+                try:
+                    # Index: lldpRemTimeMark, lldpRemLocalPortNum, lldpRemIndex, lldpRemManAddrSubtype, lldpRemManAddr (length-prefixed)
+                    index = oid[base_len:]
+                    if len(index) < 5:
+                        continue
+                    local_port_num = index[1]
+                    subtype = index[3]
+                    addr_len = index[4]
+                    if subtype == 1 and addr_len == 4 and len(index) >= 5+4:
+                        ip_addr = ".".join(map(str, index[5:5+4]))
+                        remote = remotes.get(index[:3])
+                        if snapshot is not None:
+                            local_port_name = snapshot.name(local_port_num)
+                        else:
+                            with self.metrics.timed('interface_get'):
+                                local_port_name = await self.get_interface_name_async(ip, local_port_num)
+                        caps = remote.capabilities if remote else []
+                        device_type = 'router'
+                        if 'WLAN AP' in caps: device_type = 'access_point'
+                        elif 'Bridge' in caps: device_type = 'switch'
+                        elif 'Station' in caps and 'Router' not in caps: device_type = 'server'
+                        neighbors.append({
+                            'sys_name': remote.sys_name_str if remote else "Unknown",
+                            'ip': ip_addr, 
+                            'local_port': local_port_name,
+                            'local_port_index': local_port_num,
+                            'remote_port': remote.port_id_str if remote else "Unknown",
+                            'device_type': device_type,
+                            'capabilities': caps
+                        })
+                except: pass
         except Exception as e:
             print(f"Error fetching LLDP neighbors for {ip}: {e}")
         return neighbors
 
     def get_interface_name(self, ip, interface_index):
+        return self.engine.run(self.get_interface_name_async(ip, interface_index))
+
+    async def get_interface_name_async(self, ip, interface_index):
         name = str(interface_index)
         try:
+            if self._supports(ip, 'IF-MIB::ifXTable') is False: raise Exception()
             oids = [f'1.3.6.1.2.1.31.1.1.1.1.{interface_index}']
-            errorIndication, errorStatus, errorIndex, varBinds = asyncio.run(self._get_cmd_async(ip, oids, timeout=3.0, retries=2))
+            errorIndication, errorStatus, errorIndex, varBinds = await self._get_cmd_async(ip, oids)
             if not errorIndication and not errorStatus and varBinds:
                 name = str(varBinds[0][1])
                 if not name: raise Exception()
         except:
             try:
                 oids = [f'1.3.6.1.2.1.2.2.1.2.{interface_index}']
-                errorIndication, errorStatus, errorIndex, varBinds = asyncio.run(self._get_cmd_async(ip, oids, timeout=3.0, retries=2))
+                errorIndication, errorStatus, errorIndex, varBinds = await self._get_cmd_async(ip, oids)
                 if not errorIndication and not errorStatus and varBinds:
                     name = str(varBinds[0][1])
             except: pass
         return name
 
     def get_interface_speed(self, ip, interface_index):
+        return self.engine.run(self.get_interface_speed_async(ip, interface_index))
+
+    async def get_interface_speed_async(self, ip, interface_index):
         speed_str = ""
         try:
+            if self._supports(ip, 'IF-MIB::ifXTable') is False: raise Exception()
             oids = [f'1.3.6.1.2.1.31.1.1.1.15.{interface_index}']
-            errorIndication, errorStatus, errorIndex, varBinds = asyncio.run(self._get_cmd_async(ip, oids, timeout=3.0, retries=2))
+            errorIndication, errorStatus, errorIndex, varBinds = await self._get_cmd_async(ip, oids)
             if not errorIndication and not errorStatus and varBinds:
                 val = varBinds[0][1]
                 if val is not None:
-                    high_speed_mbps = int(val)
-                    if high_speed_mbps > 0:
-                        if high_speed_mbps >= 1000:
-                            speed_str = f"{high_speed_mbps/1000} Gbps"
-                        else:
-                            speed_str = f"{high_speed_mbps} Mbps"
+                    speed_str = format_high_speed(int(val))
+                    if speed_str:
                         return speed_str
         except: pass
 
         try:
             oids = [f'1.3.6.1.2.1.2.2.1.5.{interface_index}']
-            errorIndication, errorStatus, errorIndex, varBinds = asyncio.run(self._get_cmd_async(ip, oids, timeout=3.0, retries=2))
+            errorIndication, errorStatus, errorIndex, varBinds = await self._get_cmd_async(ip, oids)
             if not errorIndication and not errorStatus and varBinds:
                 val = varBinds[0][1]
                 if val is not None:
-                    speed_bps = int(val)
-                    if speed_bps >= 1_000_000_000:
-                         speed_str = f"{speed_bps / 1_000_000_000} Gbps"
-                    elif speed_bps >= 1_000_000:
-                         speed_str = f"{speed_bps / 1_000_000} Mbps"
-                    elif speed_bps > 0:
-                         speed_str = f"{speed_bps} bps"
+                    speed_str = format_speed(int(val))
         except: pass
         return speed_str
 
     def get_interface_status(self, ip, interface_index):
+        return self.engine.run(self.get_interface_status_async(ip, interface_index))
+
+    async def get_interface_status_async(self, ip, interface_index):
         status_str = "Unknown"
         try:
             oids = [f'1.3.6.1.2.1.2.2.1.8.{interface_index}']
-            errorIndication, errorStatus, errorIndex, varBinds = asyncio.run(self._get_cmd_async(ip, oids, timeout=3.0, retries=2))
+            errorIndication, errorStatus, errorIndex, varBinds = await self._get_cmd_async(ip, oids)
             if not errorIndication and not errorStatus and varBinds:
                 val = varBinds[0][1]
                 if val is not None:
-                    status_int = int(val)
-                    if status_int == 1: status_str = "Up"
-                    elif status_int == 2: status_str = "Down"
-                    elif status_int == 5: status_str = "Dormant"
-                    else: status_str = "Other"
+                    status_str = format_oper_status(int(val))
         except: pass
         return status_str
 
     def get_port_vlan_details(self, ip, interface_index):
+        return self.engine.run(self.get_port_vlan_details_async(ip, interface_index))
+
+    async def get_port_vlan_details_async(self, ip, interface_index):
         untagged = None
         tagged = []
         try:
             # 1. Untagged Cisco
+            if self._supports(ip, CAPABILITY_GROUPS['cisco_vlan']) is False: raise Exception()
             oids = [f'1.3.6.1.4.1.9.9.68.1.2.2.1.2.{interface_index}']
-            errorIndication, errorStatus, errorIndex, varBinds = asyncio.run(self._get_cmd_async(ip, oids, timeout=2.0, retries=1))
+            errorIndication, errorStatus, errorIndex, varBinds = await self._get_cmd_async(ip, oids)
             if not errorIndication and not errorStatus and varBinds:
                 val = int(varBinds[0][1])
                 if val > 0: untagged = val
@@ -269,49 +910,82 @@ class SNMPHandler:
             try:
                 # dot1qPvid
                 oids = [f'1.3.6.1.2.1.17.7.1.4.5.1.1.{interface_index}']
-                errorIndication, errorStatus, errorIndex, varBinds = asyncio.run(self._get_cmd_async(ip, oids, timeout=2.0, retries=1))
+                errorIndication, errorStatus, errorIndex, varBinds = await self._get_cmd_async(ip, oids)
                 if not errorIndication and not errorStatus and varBinds:
                     val = int(varBinds[0][1])
                     if val > 0: untagged = val
             except: pass
 
         try:
-            walk_results = asyncio.run(self._next_cmd_async(ip, '1.3.6.1.2.1.17.7.1.4.3.1.2', timeout=2.0, retries=1))
-            for _, _, _, varBinds in walk_results:
-                for varBind in varBinds:
-                    oid, value = varBind
-                    vlan_id = list(oid)[-1]
-                    if vlan_id == untagged: continue
-                    if self._is_port_in_bitmask(value, interface_index):
-                        tagged.append(vlan_id)
+            walk = await self._walk_async(ip, DOT1Q_VLAN_EGRESS_PORTS)
+            for oid, value in walk.varbinds:
+                vlan_id = list(oid)[-1]
+                if vlan_id == untagged: continue
+                if self._is_port_in_bitmask(value, interface_index):
+                    tagged.append(vlan_id)
         except: pass
 
-        parts = []
-        if untagged: parts.append(f"U:{untagged}")
-        if tagged: parts.append(f"T:{','.join(map(str, sorted(list(set(tagged)))))}")
-        return ", ".join(parts) if parts else ""
+        return format_vlan_details(untagged, tagged)
 
     def _is_port_in_bitmask(self, bitmask, port_index):
-        try:
-            if not bitmask: return False
-            data = bytes(bitmask)
-            byte_idx = (port_index - 1) // 8
-            bit_idx = 7 - ((port_index - 1) % 8)
-            if byte_idx < len(data):
-                return bool(data[byte_idx] & (1 << bit_idx))
-        except: pass
-        return False
+        return is_port_in_bitmask(bitmask, port_index)
+
+    def get_interface_snapshot(self, ip):
+        return self.engine.run(self.get_interface_snapshot_async(ip))
+
+    async def get_interface_snapshot_async(self, ip):
+        """Reads the interface, VLAN and STP tables of a device once.
+
+        The IF-MIB, Cisco vmVlan, dot1qPvid and egress-ports columns are
+        walked together while the STP root port is fetched alongside, so
+        every later per-port lookup is answered from memory.
+        """
+        fields = [f for f in INTERFACE_SNAPSHOT_COLUMNS
+                  if f not in CAPABILITY_GROUPS or self._supports(ip, CAPABILITY_GROUPS[f]) is not False]
+        async def walk_interfaces():
+            with self.metrics.timed('interface_walk'):
+                return await self._walk_columns_async(ip, [INTERFACE_SNAPSHOT_COLUMNS[f] for f in fields])
+        walk_task = asyncio.ensure_future(walk_interfaces())
+        with self.metrics.timed('stp'):
+            stp_root_port = await self.get_stp_root_port_async(ip)
+        walk = await walk_task
+
+        # A column with rows proves its group; only an explicit rejection disproves it. An empty
+        # column (no trunk-only access ports, no static VLANs) stays in the walk, where it costs nothing
+        answered, rejected = set(), {}
+        for field in fields:
+            if field in CAPABILITY_GROUPS:
+                mib = CAPABILITY_GROUPS[field]
+                column = INTERFACE_SNAPSHOT_COLUMNS[field]
+                if walk.columns[column]:
+                    answered.add(mib)
+                rejected[mib] = rejected.get(mib, True) and column in walk.unsupported
+        for mib, all_rejected in rejected.items():
+            if mib in answered:
+                self._learn(ip, mib, True)
+            elif all_rejected:
+                self._learn(ip, mib, False)
+        return InterfaceSnapshot(walk, stp_root_port)
 
     def get_stp_root_port(self, ip):
+        return self.engine.run(self.get_stp_root_port_async(ip))
+
+    async def get_stp_root_port_async(self, ip):
+        if self._supports(ip, CAPABILITY_STP) is False:
+            return None
         try:
             oids = ['1.3.6.1.2.1.17.2.7.0']
-            errorIndication, errorStatus, errorIndex, varBinds = asyncio.run(self._get_cmd_async(ip, oids, timeout=2.0, retries=1))
+            errorIndication, errorStatus, errorIndex, varBinds = await self._get_cmd_async(ip, oids)
             if not errorIndication and not errorStatus and varBinds:
+                if _is_no_such(varBinds[0][1]):
+                    self._learn(ip, CAPABILITY_STP, False)
+                    return None
+                self._learn(ip, CAPABILITY_STP, True)
                 bridge_port_idx = int(varBinds[0][1])
                 if bridge_port_idx == 0: return None
                 
                 oids2 = [f'1.3.6.1.2.1.17.1.4.1.2.{bridge_port_idx}']
-                errorIndication, errorStatus, errorIndex, varBinds2 = asyncio.run(self._get_cmd_async(ip, oids2, timeout=2.0, retries=1))
+                errorIndication, errorStatus, errorIndex, varBinds2 = await self._get_cmd_async(ip, oids2)
                 if not errorIndication and not errorStatus and varBinds2:
                     if_index = int(varBinds2[0][1])
                     return if_index
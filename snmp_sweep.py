@@ -0,0 +1,161 @@
+"""High-rate SNMP liveness sweep over raw UDP sockets.
+
+Before the full discovery of a CIDR, every address gets one small
+GET(sysObjectID) datagram per community, sent from a few non-blocking UDP
+sockets at a fixed packet rate. Replies are matched back to the probe by
+request-id, so only hosts that actually answer go through pysnmp.
+"""
+import asyncio
+import random
+import socket
+from collections import deque
+
+import snmp_ber
+
+SYS_OBJECT_ID = (1, 3, 6, 1, 2, 1, 1, 2, 0)
+
+SWEEP_RATE = 5000    # packets per second
+SWEEP_TIMEOUT = 1.0  # seconds to wait for a reply before retrying
+SWEEP_RETRIES = 1
+SWEEP_SOCKETS = 2
+
+class _SweepProtocol(asyncio.DatagramProtocol):
+    def __init__(self, sweep):
+        self.sweep = sweep
+
+    def datagram_received(self, data, addr):
+        self.sweep._on_reply(data, addr)
+
+    def error_received(self, exc):
+        # ICMP port unreachable from hosts without an agent
+        pass
+
+class LivenessSweep:
+    """Sweeps a stream of addresses and yields the ones that answer SNMP.
+
+    Usage (on a running event loop):
+
+        sweep = LivenessSweep(['public'])
+        async for ip, community in sweep.run(hosts):
+            ...
+
+    `hosts` may be any iterable of IPv4 strings and is consumed lazily.
+    """
+    def __init__(self, communities, rate=SWEEP_RATE, timeout=SWEEP_TIMEOUT, retries=SWEEP_RETRIES,
+                 port=161, sockets=SWEEP_SOCKETS):
+        self.communities = [c.encode() if isinstance(c, str) else c for c in communities]
+        self.rate = rate
+        self.timeout = timeout
+        self.retries = retries
+        self.port = port
+        self.sockets = sockets
+        self.sent = 0
+        self.replies = 0
+        self.responders = 0
+        self._pending = {}         # {request_id: (ip, community, attempt)}
+        self._deadlines = deque()  # (deadline, request_id) in send order
+        self._retry = deque()      # (ip, community, attempt)
+        self._responded = set()
+        self._found = None
+        self._next_id = random.randrange(1, 1 << 30)
+
+    async def run(self, hosts):
+        loop = asyncio.get_running_loop()
+        self._found = asyncio.Queue()
+        transports = []
+        sender = None
+        try:
+            for _ in range(self.sockets):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+                except OSError:
+                    pass
+                sock.bind(('0.0.0.0', 0))
+                transport, _ = await loop.create_datagram_endpoint(lambda: _SweepProtocol(self), sock=sock)
+                transports.append(transport)
+
+            sender = asyncio.ensure_future(self._send_all(hosts, transports))
+            while True:
+                item = await self._found.get()
+                if item is None:
+                    break
+                yield item
+            await sender
+        finally:
+            if sender is not None:
+                sender.cancel()
+            for transport in transports:
+                transport.close()
+
+    def _request_id(self):
+        request_id = self._next_id
+        self._next_id = request_id + 1 if request_id < (1 << 31) - 1 else 1
+        return request_id
+
+    async def _send_all(self, hosts, transports):
+        loop = asyncio.get_running_loop()
+        self._start = loop.time()
+        for ip in hosts:
+            for community in self.communities:
+                await self._send(loop, transports, ip, community, 0)
+            await self._send_retries(loop, transports)
+
+        # Wait out the probes still in flight, retrying the silent ones
+        while self._deadlines or self._retry:
+            if self._deadlines:
+                await asyncio.sleep(max(0, self._deadlines[0][0] - loop.time()))
+            await self._send_retries(loop, transports)
+        self._found.put_nowait(None)
+
+    async def _send_retries(self, loop, transports):
+        now = loop.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, request_id = self._deadlines.popleft()
+            entry = self._pending.pop(request_id, None)
+            if entry and entry[0] not in self._responded and entry[2] < self.retries:
+                self._retry.append((entry[0], entry[1], entry[2] + 1))
+        while self._retry:
+            ip, community, attempt = self._retry.popleft()
+            if ip not in self._responded:
+                await self._send(loop, transports, ip, community, attempt)
+
+    async def _send(self, loop, transports, ip, community, attempt):
+        # Pace to self.rate; sleep only once we are a few ms ahead of schedule
+        now = loop.time()
+        due = self._start + self.sent / self.rate
+        if due - now > 0.005:
+            await asyncio.sleep(due - now)
+        elif now - due > 0.1:
+            # Fell behind (busy loop): don't burst to catch up
+            self._start = now - self.sent / self.rate
+
+        request_id = self._request_id()
+        message = snmp_ber.encode_get_request(community, request_id, [SYS_OBJECT_ID])
+        transport = transports[self.sent % len(transports)]
+        try:
+            transport.sendto(message, (ip, self.port))
+        except OSError:
+            return
+        self.sent += 1
+        self._pending[request_id] = (ip, community, attempt)
+        self._deadlines.append((loop.time() + self.timeout, request_id))
+
+    def _on_reply(self, data, addr):
+        self.replies += 1
+        header = snmp_ber.peek_response(data)
+        if header is None:
+            return
+        request_id, _, community = header
+        entry = self._pending.get(request_id)
+        # A stray or spoofed datagram must not cancel the real probe
+        if entry is None or entry[0] != addr[0] or entry[1] != community:
+            return
+        del self._pending[request_id]
+        ip = entry[0]
+        if ip in self._responded:
+            return
+        self._responded.add(ip)
+        self.responders += 1
+        self._found.put_nowait((ip, community.decode(errors='replace')))
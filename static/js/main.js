@@ -5,6 +5,7 @@ document.addEventListener('DOMContentLoaded', function () {
     const statusDiv = document.getElementById('status');
     const container = document.getElementById('network-map');
     const exportPngBtn = document.getElementById('export-png-btn');
+    const exportSvgBtn = document.getElementById('export-svg-btn');
     const exportPdfBtn = document.getElementById('export-pdf-btn');
     const reorganizeBtn = document.getElementById('reorganize-btn');
 
@@ -14,6 +15,7 @@ document.addEventListener('DOMContentLoaded', function () {
     const newMapNameInput = document.getElementById('new-map-name');
 
     let currentMapId = 1; // Default
+    let mapVersion = null; // Topology version of currentMapId shown on screen
     let network = null;
     let nodes = new vis.DataSet([]);
     let edges = new vis.DataSet([]);
@@ -28,6 +30,7 @@ document.addEventListener('DOMContentLoaded', function () {
     const editMapName = document.getElementById('edit-map-name');
     const editMapNetwork = document.getElementById('edit-map-network');
     const editMapCommunity = document.getElementById('edit-map-community');
+    const editMapSchedule = document.getElementById('edit-map-schedule');
 
     let lastScanActive = false;
 
@@ -47,18 +50,9 @@ document.addEventListener('DOMContentLoaded', function () {
             width: 2,
             color: '#ccc'
         },
+        // Positions come from the server (graph_layout.py), so nothing moves on its own
         physics: {
-            enabled: true,
-            stabilization: {
-                enabled: true,
-                iterations: 1000,
-                updateInterval: 50
-            },
-            barnesHut: {
-                gravitationalConstant: -20000,
-                springConstant: 0.04,
-                springLength: 150
-            }
+            enabled: false
         },
         groups: {
             router: {
@@ -86,12 +80,6 @@ document.addEventListener('DOMContentLoaded', function () {
 
     network = new vis.Network(container, data, options);
 
-    // Disable physics once stabilization is finished to keep map static
-    network.on("stabilized", function (params) {
-        console.log("Stabilization finished. Freezing layout.");
-        network.setOptions({ physics: { enabled: false } });
-    });
-
     // --- Map Management Functions ---
 
     function loadMaps() {
@@ -101,8 +89,10 @@ document.addEventListener('DOMContentLoaded', function () {
                 mapList.innerHTML = '';
                 if (maps.length === 0) {
                     currentMapId = null;
+                    closeLogStream();
                     nodes.clear();
                     edges.clear();
+                    mapVersion = null;
                     document.getElementById('log-content').innerText = '';
                     document.getElementById('scan-status').textContent = 'Idle';
                     document.getElementById('scan-status').className = 'badge badge-idle';
@@ -157,10 +147,11 @@ document.addEventListener('DOMContentLoaded', function () {
 
                 if (currentMapId) {
                     refreshMap();
-                    refreshLogs();
+                    openLogStream();
                 } else {
                     nodes.clear();
                     edges.clear();
+                    mapVersion = null;
                 }
             });
     }
@@ -183,10 +174,12 @@ document.addEventListener('DOMContentLoaded', function () {
 
     function switchMap(id) {
         currentMapId = id;
+        closeLogStream();
         loadMaps();
 
         nodes.clear();
         edges.clear();
+        mapVersion = null;
         document.getElementById('log-content').innerText = '';
         document.getElementById('scan-status').textContent = 'Idle';
         document.getElementById('scan-status').className = 'badge badge-idle';
@@ -212,7 +205,6 @@ document.addEventListener('DOMContentLoaded', function () {
                 if (data.error) alert(data.error);
                 else {
                     switchMap(id);
-                    refreshLogs();
                 }
             });
     }
@@ -222,6 +214,7 @@ document.addEventListener('DOMContentLoaded', function () {
         editMapName.value = map.name;
         editMapNetwork.value = map.network || '';
         editMapCommunity.value = map.community || '';
+        editMapSchedule.value = map.rescan_schedule || '';
         editModal.style.display = 'block';
     }
 
@@ -238,16 +231,23 @@ document.addEventListener('DOMContentLoaded', function () {
         const data = {
             name: editMapName.value,
             network: editMapNetwork.value,
-            community: editMapCommunity.value
+            community: editMapCommunity.value,
+            rescan_schedule: editMapSchedule.value
         };
         fetch(`/api/maps/${id}`, {
             method: 'PUT',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(data)
-        }).then(() => {
-            closeEditModal();
-            loadMaps();
-        });
+        })
+            .then(res => res.json())
+            .then(result => {
+                if (result.error) {
+                    alert(result.error);
+                    return;
+                }
+                closeEditModal();
+                loadMaps();
+            });
     };
 
     createMapBtn.addEventListener('click', () => {
@@ -259,157 +259,227 @@ document.addEventListener('DOMContentLoaded', function () {
 
     // --- Core Functions ---
 
+    function deviceToNode(device) {
+        try {
+            let group = 'router';
+            if (device.device_type && device.device_type !== 'router') {
+                group = device.device_type;
+            }
+            else if (device.sysName && (device.sysName.toLowerCase().includes('switch') || device.sysName.toLowerCase().includes('aruba') || (device.sysDescr && (device.sysDescr.toLowerCase().includes('switch') || device.sysDescr.toLowerCase().includes('aruba'))))) {
+                group = 'switch';
+            }
+            else if (device.device_type) {
+                group = device.device_type;
+            }
+
+            const node = {
+                id: device.ip,
+                label: (device.sysName && device.sysName !== 'Unknown' && device.sysName !== device.ip) ? `${device.sysName}\n${device.ip}` : device.ip,
+                title: `IP: ${device.ip}\nType: ${device.device_type}\nDescr: ${device.sysDescr}`,
+                group: group
+            };
+            if (device.x != null && device.y != null) {
+                node.x = device.x;
+                node.y = device.y;
+            }
+            return node;
+        } catch (e) {
+            console.error("Error processing node:", device, e);
+            return null;
+        }
+    }
+
+    function linkToEdge(link) {
+        try {
+            let label = "";
+            if (link.source_port && link.target_port) {
+                let srcLabel = link.source_port;
+                if (link.source_vlan) srcLabel += ` (${link.source_vlan})`;
+                if (link.source_is_root) srcLabel += " (ROOT)";
+                let tgtLabel = link.target_port;
+                if (link.target_vlan) tgtLabel += ` (${link.target_vlan})`;
+                if (link.target_is_root) tgtLabel += " (ROOT)";
+                let srcIpLastOctet = link.source_ip.split('.').pop();
+                let tgtIpLastOctet = link.target_ip.split('.').pop();
+                label = `${srcLabel} (.${srcIpLastOctet}) <-> ${tgtLabel} (.${tgtIpLastOctet})`;
+            } else if (link.source_port) {
+                label = link.source_port;
+                if (link.source_vlan) label += ` (${link.source_vlan})`;
+                if (link.source_is_root) label += " (ROOT)";
+                label += " ->";
+            }
+            if (link.speed) label += `\n(${link.speed})`;
+
+            let color = { color: '#848484' };
+            if (link.status === 'Up') {
+                color = { color: '#28a745', highlight: '#34ce57' };
+                if (link.speed) {
+                    const speed = link.speed.toLowerCase();
+                    if (speed.includes('100 mbps')) color = { color: '#fbc02d', highlight: '#fff176' };
+                    else if (speed.includes('10 mbps')) color = { color: '#d32f2f', highlight: '#ef5350' };
+                }
+            } else if (link.status === 'Down') {
+                color = { color: '#9e9e9e', highlight: '#bdbdbd' };
+            } else if (link.status === 'Dormant') {
+                color = { color: 'orange' };
+            }
+
+            return {
+                id: link.id,
+                from: link.source_ip,
+                to: link.target_ip,
+                label: label,
+                color: color,
+                font: { align: 'top', size: 10 }
+            };
+        } catch (e) {
+            console.error("Error processing edge:", link, e);
+            return null;
+        }
+    }
+
+    // Applies a full topology or a delta (rows changed since mapVersion) to the DataSets.
+    // DataSets are indexed by id, so every lookup below is a Map get, not a scan.
+    function applyTopology(data) {
+        const newNodes = data.nodes.map(deviceToNode).filter(n => n !== null);
+        const newEdges = data.edges.map(linkToEdge).filter(e => e !== null);
+
+        if (data.full) {
+            const nodeIds = new Set(newNodes.map(n => n.id));
+            const edgeIds = new Set(newEdges.map(e => e.id));
+            nodes.remove(nodes.getIds().filter(id => !nodeIds.has(id)));
+            edges.remove(edges.getIds().filter(id => !edgeIds.has(id)));
+        } else {
+            nodes.remove(data.removed_nodes || []);
+            edges.remove(data.removed_edges || []);
+        }
+
+        const added = [];
+        const changed = [];
+        newNodes.forEach(newNode => {
+            const existing = nodes.get(newNode.id);
+            if (!existing) {
+                added.push(newNode);
+            } else if (existing.label !== newNode.label || existing.group !== newNode.group
+                || (newNode.x !== undefined && (existing.x !== newNode.x || existing.y !== newNode.y))) {
+                // Minimal update to avoid flicker
+                changed.push(newNode);
+            }
+        });
+        if (newEdges.length) edges.update(newEdges);
+        placeNearNeighbors(added.filter(n => n.x === undefined));
+        if (added.length) nodes.add(added);
+        if (changed.length) nodes.update(changed);
+    }
+
+    // Devices the server has no coordinates for yet start next to a placed neighbor
+    function placeNearNeighbors(unplaced) {
+        unplaced.forEach(node => {
+            const neighborIds = edges.get({ filter: e => e.from === node.id || e.to === node.id })
+                .map(e => e.from === node.id ? e.to : e.from)
+                .filter(id => nodes.get(id));
+            if (!neighborIds.length) return;
+            const pos = network.getPositions([neighborIds[0]])[neighborIds[0]];
+            const angle = Math.random() * 2 * Math.PI;
+            node.x = pos.x + 150 * Math.cos(angle);
+            node.y = pos.y + 150 * Math.sin(angle);
+        });
+    }
+
     function refreshMap() {
         if (!currentMapId) return;
-        fetch(`/api/devices?map_id=${currentMapId}`)
+        const mapId = currentMapId;
+        // After the first load only ask for what changed; unchanged maps answer 304
+        const url = mapVersion === null
+            ? `/api/devices?map_id=${mapId}`
+            : `/api/devices?map_id=${mapId}&since=${mapVersion}`;
+        fetch(url)
             .then(response => response.json())
             .then(data => {
+                if (mapId !== currentMapId) return; // switched maps while loading
                 if (!data.nodes || !data.edges) {
                     console.error("API returned invalid data format:", data);
                     return;
                 }
+                applyTopology(data);
+                mapVersion = data.version;
+            })
+            .catch(err => console.error("Error fetching map data:", err));
+    }
 
-                const newNodes = data.nodes.map(device => {
-                    try {
-                        let group = 'router';
-                        if (device.device_type && device.device_type !== 'router') {
-                            group = device.device_type;
-                        }
-                        else if (device.sysName && (device.sysName.toLowerCase().includes('switch') || device.sysName.toLowerCase().includes('aruba') || (device.sysDescr && (device.sysDescr.toLowerCase().includes('switch') || device.sysDescr.toLowerCase().includes('aruba'))))) {
-                            group = 'switch';
-                        }
-                        else if (device.device_type) {
-                            group = device.device_type;
-                        }
-
-                        return {
-                            id: device.ip,
-                            label: (device.sysName && device.sysName !== 'Unknown' && device.sysName !== device.ip) ? `${device.sysName}\n${device.ip}` : device.ip,
-                            title: `IP: ${device.ip}\nType: ${device.device_type}\nDescr: ${device.sysDescr}`,
-                            group: group
-                        };
-                    } catch (e) {
-                        console.error("Error processing node:", device, e);
-                        return null;
-                    }
-                }).filter(n => n !== null);
+    // --- Scan log stream (Server-Sent Events, no polling) ---
 
-                const newEdges = data.edges.map(link => {
-                    try {
-                        let label = "";
-                        if (link.source_port && link.target_port) {
-                            let srcLabel = link.source_port;
-                            if (link.source_vlan) srcLabel += ` (${link.source_vlan})`;
-                            if (link.source_is_root) srcLabel += " (ROOT)";
-                            let tgtLabel = link.target_port;
-                            if (link.target_vlan) tgtLabel += ` (${link.target_vlan})`;
-                            if (link.target_is_root) tgtLabel += " (ROOT)";
-                            let srcIpLastOctet = link.source_ip.split('.').pop();
-                            let tgtIpLastOctet = link.target_ip.split('.').pop();
-                            label = `${srcLabel} (.${srcIpLastOctet}) <-> ${tgtLabel} (.${tgtIpLastOctet})`;
-                        } else if (link.source_port) {
-                            label = link.source_port;
-                            if (link.source_vlan) label += ` (${link.source_vlan})`;
-                            if (link.source_is_root) label += " (ROOT)";
-                            label += " ->";
-                        }
-                        if (link.speed) label += `\n(${link.speed})`;
-
-                        let color = { color: '#848484' };
-                        if (link.status === 'Up') {
-                            color = { color: '#28a745', highlight: '#34ce57' };
-                            if (link.speed) {
-                                const speed = link.speed.toLowerCase();
-                                if (speed.includes('100 mbps')) color = { color: '#fbc02d', highlight: '#fff176' };
-                                else if (speed.includes('10 mbps')) color = { color: '#d32f2f', highlight: '#ef5350' };
-                            }
-                        } else if (link.status === 'Down') {
-                            color = { color: '#9e9e9e', highlight: '#bdbdbd' };
-                        } else if (link.status === 'Dormant') {
-                            color = { color: 'orange' };
-                        }
+    const MAX_LOG_LINES = 2000;
+    let logStream = null;
+    let logStreamMapId = null;
 
-                        return {
-                            id: link.id,
-                            from: link.source_ip,
-                            to: link.target_ip,
-                            label: label,
-                            color: color,
-                            font: { align: 'top', size: 10 }
-                        };
-                    } catch (e) {
-                        console.error("Error processing edge:", link, e);
-                        return null;
-                    }
-                }).filter(e => e !== null);
-
-                const currentNodes = nodes.get();
-                let hasChanges = false;
-
-                newNodes.forEach(newNode => {
-                    const existing = currentNodes.find(n => n.id === newNode.id);
-                    if (!existing) {
-                        nodes.add(newNode);
-                        hasChanges = true;
-                    } else {
-                        // Minimal update to avoid flicker
-                        if (existing.label !== newNode.label || existing.group !== newNode.group) {
-                            nodes.update(newNode);
-                        }
-                    }
-                });
-
-                if (hasChanges) {
-                    console.log("Map updated with new nodes. Re-stabilizing.");
-                    network.setOptions({ physics: { enabled: true } });
-                    network.stabilize();
-                }
+    function closeLogStream() {
+        if (logStream) logStream.close();
+        logStream = null;
+        logStreamMapId = null;
+    }
 
-                edges.clear();
-                edges.add(newEdges);
-            })
-            .catch(err => console.error("Error fetching map data:", err));
+    function openLogStream() {
+        if (!currentMapId) {
+            closeLogStream();
+            return;
+        }
+        if (logStreamMapId === currentMapId) return;
+        closeLogStream();
+        document.getElementById('log-content').textContent = '';
+        // The browser reconnects by itself and resumes after the last event id
+        logStream = new EventSource(`/api/logs/stream?map_id=${currentMapId}&after=0`);
+        logStreamMapId = currentMapId;
+        logStream.onmessage = (event) => applyLogs(JSON.parse(event.data));
     }
 
-    function refreshLogs() {
-        if (!currentMapId) return;
-        fetch(`/api/logs?map_id=${currentMapId}`)
-            .then(response => response.json())
-            .then(data => {
-                const logContent = document.getElementById('log-content');
-                const statusBadge = document.getElementById('scan-status');
-
-                if (logContent) {
-                    // Check if content changed to avoid auto-scroll if user scrolling?
-                    // Simple replacement for now.
-                    logContent.innerText = data.logs.join('\n');
-                    logContent.scrollTop = logContent.scrollHeight;
-                }
+    function applyLogs(data) {
+        const logContent = document.getElementById('log-content');
+        const statusBadge = document.getElementById('scan-status');
+        const progress = document.getElementById('scan-progress');
+
+        if (logContent) {
+            const atBottom = logContent.scrollTop + logContent.clientHeight >= logContent.scrollHeight - 5;
+            if (data.reset) logContent.textContent = '';
+            const fragment = document.createDocumentFragment();
+            data.logs.forEach(line => fragment.appendChild(document.createTextNode(line + '\n')));
+            logContent.appendChild(fragment);
+            // Keep the DOM as bounded as the server buffer
+            while (logContent.childNodes.length > MAX_LOG_LINES) logContent.removeChild(logContent.firstChild);
+            if (atBottom) logContent.scrollTop = logContent.scrollHeight;
+        }
 
-                const isActive = data.active;
+        const isActive = data.active;
 
-                if (statusBadge) {
-                    if (isActive) {
-                        statusBadge.textContent = "Scanning...";
-                        statusBadge.className = "badge badge-scanning";
-                    } else {
-                        statusBadge.textContent = "Idle";
-                        statusBadge.className = "badge badge-idle";
-                    }
-                }
+        if (statusBadge) {
+            if (isActive) {
+                statusBadge.textContent = "Scanning...";
+                statusBadge.className = "badge badge-scanning";
+            } else {
+                statusBadge.textContent = "Idle";
+                statusBadge.className = "badge badge-idle";
+            }
+        }
 
-                // Update Button State
-                if (isActive) {
-                    scanBtn.style.display = 'none';
-                    stopBtn.style.display = 'inline-block';
-                } else {
-                    scanBtn.style.display = 'inline-block';
-                    stopBtn.style.display = 'none';
-                }
+        if (progress) {
+            const p = data.progress || {};
+            progress.textContent = p.probed !== undefined
+                ? `${p.probed} hosts probed, ${p.responders} responders, ${p.links} links`
+                : '';
+        }
 
-                lastScanActive = isActive;
-            })
-            .catch(err => console.error("Error fetching logs:", err));
+        // Update Button State
+        if (isActive) {
+            scanBtn.style.display = 'none';
+            stopBtn.style.display = 'inline-block';
+        } else {
+            scanBtn.style.display = 'inline-block';
+            stopBtn.style.display = 'none';
+        }
+
+        // Show the final topology as soon as a scan ends
+        if (lastScanActive && !isActive) refreshMap();
+        lastScanActive = isActive;
     }
 
     // Initial load
@@ -419,10 +489,6 @@ document.addEventListener('DOMContentLoaded', function () {
         if (currentMapId) refreshMap();
     }, 5000);
 
-    setInterval(() => {
-        if (currentMapId) refreshLogs();
-    }, 2000);
-
     // Scan Button Handler
     scanBtn.addEventListener('click', function () {
         const net = networkInput.value;
@@ -457,7 +523,6 @@ document.addEventListener('DOMContentLoaded', function () {
             .then(data => {
                 console.log(data);
                 statusDiv.textContent = data.message;
-                refreshLogs(); // Immediate update
             })
             .catch(err => {
                 console.error(err);
@@ -496,7 +561,8 @@ document.addEventListener('DOMContentLoaded', function () {
 
     /**
      * Renders the map onto a hidden, high-resolution canvas to ensure native sharpness.
-     * @param {string} format 'png' or 'pdf'
+     * Only used for PNG; SVG and PDF are rendered by the server (exportVector).
+     * @param {string} format 'png'
      */
     function exportHD(format) {
         statusDiv.textContent = "Gerando exportação ULTRA-HD Dinâmica...";
@@ -654,37 +720,6 @@ document.addEventListener('DOMContentLoaded', function () {
                             link.download = `mapa-rede-ULTRA-HD-${timestamp}.png`;
                             link.href = dataUrl;
                             link.click();
-                        } else if (format === 'pdf') {
-                            const dataUrl = finalCanvas.toDataURL('image/png', 1.0);
-                            const { jsPDF } = window.jspdf;
-                            const orientation = canvas.width > canvas.height ? 'l' : 'p';
-
-                            const pdf = new jsPDF({
-                                orientation: orientation,
-                                unit: 'mm',
-                                format: 'a3',
-                                compress: true
-                            });
-
-                            const pageWidth = pdf.internal.pageSize.getWidth();
-                            const pageHeight = pdf.internal.pageSize.getHeight();
-                            const canvasRatio = canvas.width / canvas.height;
-                            const pageRatio = pageWidth / pageHeight;
-
-                            let renderWidth, renderHeight;
-                            if (canvasRatio > pageRatio) {
-                                renderWidth = pageWidth - 10;
-                                renderHeight = renderWidth / canvasRatio;
-                            } else {
-                                renderHeight = pageHeight - 10;
-                                renderWidth = renderHeight * canvasRatio;
-                            }
-
-                            const x = (pageWidth - renderWidth) / 2;
-                            const y = (pageHeight - renderHeight) / 2;
-
-                            pdf.addImage(dataUrl, 'PNG', x, y, renderWidth, renderHeight, undefined, 'FAST');
-                            pdf.save(`mapa-rede-ULTRA-HD-${timestamp}.pdf`);
                         }
 
                         statusDiv.textContent = "Exportação ULTRA-HD concluída!";
@@ -712,14 +747,26 @@ document.addEventListener('DOMContentLoaded', function () {
             if (hiddenContainer && hiddenContainer.parentNode) document.body.removeChild(hiddenContainer);
         }
     }
+    // Vector exports are streamed by the server from the stored layout, whatever the map size
+    function exportVector(format) {
+        if (!currentMapId) return;
+        const link = document.createElement('a');
+        link.href = `/api/maps/${currentMapId}/export.${format}`;
+        link.click();
+    }
+
     if (exportPngBtn) exportPngBtn.addEventListener('click', () => exportHD('png'));
-    if (exportPdfBtn) exportPdfBtn.addEventListener('click', () => exportHD('pdf'));
+    if (exportSvgBtn) exportSvgBtn.addEventListener('click', () => exportVector('svg'));
+    if (exportPdfBtn) exportPdfBtn.addEventListener('click', () => exportVector('pdf'));
 
     if (reorganizeBtn) {
         reorganizeBtn.addEventListener('click', () => {
-            console.log("Manual reorganization triggered.");
-            network.setOptions({ physics: { enabled: true } });
-            network.stabilize();
+            // The server lays the map out again; the moves arrive with the next refresh
+            if (!currentMapId) return;
+            fetch(`/api/maps/${currentMapId}/layout`, { method: 'POST' })
+                .then(response => response.json())
+                .then(() => refreshMap())
+                .catch(err => console.error("Error reorganizing map:", err));
         });
     }
 
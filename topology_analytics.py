@@ -0,0 +1,296 @@
+"""Graph analytics over a map: paths, cut points, components and the STP tree.
+
+Each map is indexed once per topology version as a compact CSR adjacency
+(NumPy arrays over integer device ids: the neighbors of device i are
+indices[indptr[i]:indptr[i + 1]]), built from one database snapshot.
+Results are computed on first use and kept on the MapGraph, which is
+replaced as soon as the map's version changes.
+"""
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from models import TopologySnapshot, get_map_version
+
+# Shortest paths kept per map version
+PATH_CACHE_SIZE = 1024
+
+class MapGraph:
+    """CSR adjacency of one map version.
+
+    Every link appears twice, once per direction; entry e goes from device
+    owner[e] to indices[e] over link link_ids[e], and root[e] says the
+    owner's port on that link is its STP root port.
+    """
+    def __init__(self, version, ips, sources, targets, link_ids, source_is_root, target_is_root):
+        self.version = version
+        self.ips = ips
+        self.index = {ip: i for i, ip in enumerate(ips)}
+        count = len(ips)
+
+        owner = np.concatenate([sources, targets])
+        order = np.argsort(owner, kind='stable')
+        self.indices = np.concatenate([targets, sources])[order].astype(np.int32)
+        self.link_ids = np.concatenate([link_ids, link_ids])[order]
+        self.root = np.concatenate([source_is_root, target_is_root])[order].astype(bool)
+        self.indptr = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owner, minlength=count), out=self.indptr[1:])
+
+        # Plain lists for the Python traversals below (much faster to index than arrays)
+        self._indptr = self.indptr.tolist()
+        self._indices = self.indices.tolist()
+        self._link_ids = self.link_ids.tolist()
+
+        self._lock = threading.Lock()
+        self._paths = OrderedDict()
+        self._cut_points = None
+        self._components = None
+        self._stp_tree = None
+
+    @property
+    def link_count(self):
+        return len(self._indices) // 2
+
+    def neighbors(self, i):
+        return self._indices[self._indptr[i]:self._indptr[i + 1]]
+
+    def shortest_path(self, source_ip, target_ip):
+        """Fewest-hops path as (ips, link ids), or None if unreachable. Bidirectional BFS."""
+        key = (source_ip, target_ip)
+        with self._lock:
+            if key in self._paths:
+                self._paths.move_to_end(key)
+                return self._paths[key]
+        result = self._bidirectional_bfs(self.index[source_ip], self.index[target_ip])
+        with self._lock:
+            self._paths[key] = result
+            if len(self._paths) > PATH_CACHE_SIZE:
+                self._paths.popitem(last=False)
+        return result
+
+    def _bidirectional_bfs(self, source, target):
+        if source == target:
+            return [self.ips[source]], []
+        indptr, indices, link_ids = self._indptr, self._indices, self._link_ids
+        # {device: (previous device, link)} seen from each end
+        forward = {source: None}
+        backward = {target: None}
+        frontiers = ([source], [target])
+        meeting = None
+        while frontiers[0] and frontiers[1] and meeting is None:
+            # Grow the smaller frontier
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            seen, other = (forward, backward) if side == 0 else (backward, forward)
+            next_frontier = []
+            for u in frontiers[side]:
+                for e in range(indptr[u], indptr[u + 1]):
+                    v = indices[e]
+                    if v in seen:
+                        continue
+                    seen[v] = (u, link_ids[e])
+                    if v in other:
+                        meeting = v
+                        break
+                    next_frontier.append(v)
+                if meeting is not None:
+                    break
+            frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+        if meeting is None:
+            return None
+
+        nodes, links = [meeting], []
+        step = forward[meeting]
+        while step is not None:
+            nodes.append(step[0])
+            links.append(step[1])
+            step = forward[step[0]]
+        nodes.reverse()
+        links.reverse()
+        step = backward[meeting]
+        while step is not None:
+            nodes.append(step[0])
+            links.append(step[1])
+            step = backward[step[0]]
+        return [self.ips[i] for i in nodes], links
+
+    def cut_points(self):
+        """Articulation points (devices) and bridges (link ids) whose loss splits the map.
+
+        Iterative Tarjan DFS; the link used to reach a device is skipped by id,
+        not by neighbor, so parallel links between two devices are no bridge.
+        """
+        with self._lock:
+            if self._cut_points is not None:
+                return self._cut_points
+        indptr, indices, link_ids = self._indptr, self._indices, self._link_ids
+        count = len(self.ips)
+        discovered = [-1] * count
+        low = [0] * count
+        articulation = set()
+        bridges = []
+        clock = 0
+        for start in range(count):
+            if discovered[start] >= 0:
+                continue
+            discovered[start] = low[start] = clock
+            clock += 1
+            root_children = 0
+            # (device, link it was reached by, next adjacency entry to look at)
+            stack = [(start, -1, indptr[start])]
+            while stack:
+                u, via, e = stack[-1]
+                if e < indptr[u + 1]:
+                    stack[-1] = (u, via, e + 1)
+                    v = indices[e]
+                    if link_ids[e] == via:
+                        continue
+                    if discovered[v] < 0:
+                        discovered[v] = low[v] = clock
+                        clock += 1
+                        if u == start:
+                            root_children += 1
+                        stack.append((v, link_ids[e], indptr[v]))
+                    elif discovered[v] < low[u]:
+                        low[u] = discovered[v]
+                    continue
+                stack.pop()
+                if stack:
+                    parent = stack[-1][0]
+                    if low[u] < low[parent]:
+                        low[parent] = low[u]
+                    if low[u] > discovered[parent]:
+                        bridges.append(via)
+                    if low[u] >= discovered[parent] and parent != start:
+                        articulation.add(parent)
+            if root_children > 1:
+                articulation.add(start)
+        result = {
+            'articulation_points': sorted(self.ips[i] for i in articulation),
+            'bridges': sorted(bridges),
+        }
+        with self._lock:
+            self._cut_points = result
+        return result
+
+    def components(self):
+        """Connected components, largest first, as lists of device ips."""
+        with self._lock:
+            if self._components is not None:
+                return self._components
+        indptr, indices = self._indptr, self._indices
+        label = [-1] * len(self.ips)
+        groups = []
+        for start in range(len(self.ips)):
+            if label[start] >= 0:
+                continue
+            label[start] = len(groups)
+            members = [start]
+            queue = deque([start])
+            while queue:
+                u = queue.popleft()
+                for v in indices[indptr[u]:indptr[u + 1]]:
+                    if label[v] < 0:
+                        label[v] = label[start]
+                        members.append(v)
+                        queue.append(v)
+            groups.append(members)
+        groups.sort(key=len, reverse=True)
+        result = [sorted(self.ips[i] for i in members) for members in groups]
+        with self._lock:
+            self._components = result
+        return result
+
+    def stp_tree(self):
+        """The spanning tree(s) STP built, from the links' root port flags.
+
+        A device's root port faces its parent; roots are devices other bridges
+        point to that have no root port themselves. Returns the roots and one
+        entry per device reached from them, in BFS order; devices with a root
+        port that never lead to a root (stale or partial data) are listed apart.
+        """
+        with self._lock:
+            if self._stp_tree is not None:
+                return self._stp_tree
+        indptr, indices, link_ids = self._indptr, self._indices, self._link_ids
+        root_port = self.root.tolist()
+        count = len(self.ips)
+        parent = [-1] * count
+        parent_link = [None] * count
+        children = [[] for _ in range(count)]
+        for u in range(count):
+            for e in range(indptr[u], indptr[u + 1]):
+                if root_port[e]:
+                    parent[u] = indices[e]
+                    parent_link[u] = link_ids[e]
+                    break
+            if parent[u] >= 0:
+                children[parent[u]].append(u)
+
+        roots = [i for i in range(count) if parent[i] < 0 and children[i]]
+        depth = [-1] * count
+        tree = []
+        for r in roots:
+            depth[r] = 0
+            queue = deque([r])
+            while queue:
+                u = queue.popleft()
+                tree.append({
+                    'ip': self.ips[u],
+                    'parent': self.ips[parent[u]] if parent[u] >= 0 else None,
+                    'link_id': parent_link[u],
+                    'depth': depth[u],
+                    'children': len(children[u]),
+                })
+                for v in children[u]:
+                    if depth[v] < 0:
+                        depth[v] = depth[u] + 1
+                        queue.append(v)
+        result = {
+            'roots': [self.ips[i] for i in roots],
+            'nodes': tree,
+            'unreached': sorted(self.ips[i] for i in range(count) if parent[i] >= 0 and depth[i] < 0),
+        }
+        with self._lock:
+            self._stp_tree = result
+        return result
+
+def build_graph(map_id):
+    """Indexes a map from one snapshot."""
+    with TopologySnapshot(map_id) as snapshot:
+        ips = sorted(ip for (ip,) in snapshot.rows('devices', 'ip'))
+        index = {ip: i for i, ip in enumerate(ips)}
+        sources, targets, link_ids, source_is_root, target_is_root = [], [], [], [], []
+        for row in snapshot.rows('links', 'id, source_ip, target_ip, source_is_root, target_is_root'):
+            a, b = index.get(row[1]), index.get(row[2])
+            # Links to devices not (or no longer) on the map are left out
+            if a is None or b is None or a == b:
+                continue
+            link_ids.append(row[0])
+            sources.append(a)
+            targets.append(b)
+            source_is_root.append(bool(row[3]))
+            target_is_root.append(bool(row[4]))
+        return MapGraph(snapshot.version, ips,
+                        np.array(sources, dtype=np.int32), np.array(targets, dtype=np.int32),
+                        np.array(link_ids, dtype=np.int64),
+                        np.array(source_is_root, dtype=bool), np.array(target_is_root, dtype=bool))
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+def get_map_graph(map_id):
+    """The map's current MapGraph, rebuilt only when the topology version moved."""
+    version = get_map_version(map_id)
+    graph = _graphs.get(map_id)
+    if graph is not None and graph.version == version:
+        return graph
+    with _graphs_lock:
+        graph = _graphs.get(map_id)
+        if graph is None or graph.version != get_map_version(map_id):
+            graph = _graphs[map_id] = build_graph(map_id)
+        return graph
+
+def forget_map(map_id):
+    with _graphs_lock:
+        _graphs.pop(map_id, None)
@@ -0,0 +1,346 @@
+"""Vector exports of a map (SVG and PDF), rendered on the server.
+
+The map is read row by row from one database snapshot (models.TopologySnapshot)
+and written out in chunks as it is read, so memory stays flat however large
+the map is; only the device coordinates are kept while links are drawn.
+Positions are the ones graph_layout stored for the map. Finished exports are
+kept in EXPORT_CACHE_DIR per map, format and topology version, and served
+from there until the map changes.
+"""
+import glob
+import os
+import threading
+from contextlib import ExitStack
+from xml.sax.saxutils import escape
+
+from models import TopologySnapshot
+from graph_layout import ensure_layout, NODE_SPACING
+
+EXPORT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'export_cache')
+# Bytes gathered before a chunk is sent to the client (and the cache file)
+CHUNK_SIZE = 64 * 1024
+# Margin around the drawing, in map units
+MARGIN = 100
+NODE_RADIUS = 15
+# Largest PDF page side (the PDF 1.4 limit is 14400 units); bigger maps are scaled down
+PDF_MAX_SIDE = 14400
+
+MIMETYPES = {'svg': 'image/svg+xml', 'pdf': 'application/pdf'}
+
+# Node fill per group, close to the icons used by the web map
+GROUP_COLORS = {
+    'router': '#d9534f',
+    'switch': '#0275d8',
+    'access_point': '#5cb85c',
+    'server': '#6c757d',
+}
+
+def device_group(device):
+    """Same grouping as deviceToNode in static/js/main.js."""
+    device_type = device['device_type']
+    if device_type and device_type != 'router':
+        return device_type
+    text = f"{device['sysName'] or ''} {device['sysDescr'] or ''}".lower()
+    if 'switch' in text or 'aruba' in text:
+        return 'switch'
+    return device_type or 'router'
+
+def device_label(device):
+    name = device['sysName']
+    if name and name != 'Unknown' and name != device['ip']:
+        return [name, device['ip']]
+    return [device['ip']]
+
+def link_color(link):
+    """Same colors as linkToEdge in static/js/main.js."""
+    status = link['status']
+    if status == 'Up':
+        speed = (link['speed'] or '').lower()
+        if '100 mbps' in speed:
+            return '#fbc02d'
+        if '10 mbps' in speed:
+            return '#d32f2f'
+        return '#28a745'
+    if status == 'Down':
+        return '#9e9e9e'
+    if status == 'Dormant':
+        return '#ffa500'
+    return '#848484'
+
+def link_label(link):
+    if link['source_port'] and link['target_port']:
+        return f"{link['source_port']} <-> {link['target_port']}"
+    return link['source_port'] or ''
+
+def _load_positions(snapshot):
+    """{ip: (x, y)} and the bounding box; devices without coordinates go in a column to the right."""
+    positions = {}
+    unplaced = []
+    for ip, x, y in snapshot.rows('devices', 'ip, x, y'):
+        if x is None or y is None:
+            unplaced.append(ip)
+        else:
+            positions[ip] = (x, y)
+    if positions:
+        min_x = min(x for x, _ in positions.values())
+        max_x = max(x for x, _ in positions.values())
+        min_y = min(y for _, y in positions.values())
+        max_y = max(y for _, y in positions.values())
+    else:
+        min_x = max_x = min_y = max_y = 0.0
+    if unplaced:
+        column = max_x + 2 * NODE_SPACING if positions else 0.0
+        for n, ip in enumerate(unplaced):
+            positions[ip] = (column, min_y + n * NODE_SPACING)
+        max_x = column
+        max_y = max(max_y, min_y + (len(unplaced) - 1) * NODE_SPACING)
+    return positions, (min_x - MARGIN, min_y - MARGIN, max_x + MARGIN, max_y + MARGIN)
+
+def _chunked(pieces):
+    """Joins small str/bytes pieces into CHUNK_SIZE byte chunks."""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        if isinstance(piece, str):
+            piece = piece.encode('utf-8')
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+def render_svg(snapshot):
+    """Yields the SVG document of a snapshot, piece by piece."""
+    positions, (min_x, min_y, max_x, max_y) = _load_positions(snapshot)
+    width, height = max_x - min_x, max_y - min_y
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" '
+           f'viewBox="{min_x:.1f} {min_y:.1f} {width:.1f} {height:.1f}" font-family="Helvetica, Arial, sans-serif">\n'
+           f'<rect x="{min_x:.1f}" y="{min_y:.1f}" width="{width:.1f}" height="{height:.1f}" fill="#ffffff"/>\n')
+
+    yield '<g stroke-width="2">\n'
+    for link in snapshot.rows('links'):
+        source, target = positions.get(link['source_ip']), positions.get(link['target_ip'])
+        if source is None or target is None:
+            continue
+        yield (f'<line x1="{source[0]:.1f}" y1="{source[1]:.1f}" x2="{target[0]:.1f}" y2="{target[1]:.1f}" '
+               f'stroke="{link_color(link)}"/>\n')
+        label = link_label(link)
+        if label:
+            yield (f'<text x="{(source[0] + target[0]) / 2:.1f}" y="{(source[1] + target[1]) / 2 - 4:.1f}" '
+                   f'font-size="9" fill="#555" text-anchor="middle">{escape(label)}</text>\n')
+    yield '</g>\n<g font-size="12" text-anchor="middle">\n'
+
+    for device in snapshot.rows('devices'):
+        x, y = positions[device['ip']]
+        color = GROUP_COLORS.get(device_group(device), GROUP_COLORS['router'])
+        yield f'<circle cx="{x:.1f}" cy="{y:.1f}" r="{NODE_RADIUS}" fill="{color}" stroke="#333" stroke-width="1.5"/>\n'
+        for n, line in enumerate(device_label(device)):
+            yield f'<text x="{x:.1f}" y="{y + NODE_RADIUS + 14 + n * 14:.1f}" fill="#333">{escape(line)}</text>\n'
+    yield '</g>\n</svg>\n'
+
+def _pdf_text(text):
+    """A PDF string literal in WinAnsiEncoding (Helvetica is not embedded)."""
+    data = text.encode('cp1252', errors='replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+def _pdf_color(color):
+    return ' '.join(f'{int(color[i:i + 2], 16) / 255:.3f}' for i in (1, 3, 5))
+
+# Bezier control distance of a circle drawn with four curves
+_KAPPA = 0.5523
+
+def _pdf_circle(x, y, r):
+    k = r * _KAPPA
+    return (f'{x + r:.1f} {y:.1f} m '
+            f'{x + r:.1f} {y + k:.1f} {x + k:.1f} {y + r:.1f} {x:.1f} {y + r:.1f} c '
+            f'{x - k:.1f} {y + r:.1f} {x - r:.1f} {y + k:.1f} {x - r:.1f} {y:.1f} c '
+            f'{x - r:.1f} {y - k:.1f} {x - k:.1f} {y - r:.1f} {x:.1f} {y - r:.1f} c '
+            f'{x + k:.1f} {y - r:.1f} {x + r:.1f} {y - k:.1f} {x + r:.1f} {y:.1f} c ')
+
+def render_pdf(snapshot):
+    """Yields a one-page PDF of a snapshot, piece by piece.
+
+    The content stream's length is written as an indirect object after the
+    stream, and the xref offsets are counted as pieces go out, so nothing
+    has to be buffered.
+    """
+    positions, (min_x, min_y, max_x, max_y) = _load_positions(snapshot)
+    scale = min(1.0, PDF_MAX_SIDE / max(max_x - min_x, max_y - min_y, 1))
+    page_width, page_height = (max_x - min_x) * scale, (max_y - min_y) * scale
+
+    offsets = {}
+    written = 0
+
+    def emit(number, body):
+        nonlocal written
+        offsets[number] = written
+        data = f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+        written += len(data)
+        return data
+
+    header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    written = len(header)
+    yield header
+    yield emit(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+    yield emit(2, b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>')
+    yield emit(3, f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.1f} {page_height:.1f}] '
+                  f'/Contents 4 0 R /Resources << /Font << /F1 6 0 R >> >> >>'.encode())
+    yield emit(6, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+
+    start = b'4 0 obj\n<< /Length 5 0 R >>\nstream\n'
+    offsets[4] = written
+    written += len(start)
+    yield start
+    length = 0
+
+    def content(data):
+        nonlocal length, written
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        length += len(data)
+        written += len(data)
+        return data
+
+    # Map units to page: scale, flip y (the map's y grows downwards) and move the box to the origin
+    yield content(f'{scale:.6f} 0 0 {-scale:.6f} {-min_x * scale:.3f} {max_y * scale:.3f} cm\n'
+                  f'1 1 1 rg 0 0 0 RG 2 w\n')
+    for link in snapshot.rows('links'):
+        source, target = positions.get(link['source_ip']), positions.get(link['target_ip'])
+        if source is None or target is None:
+            continue
+        yield content(f'{_pdf_color(link_color(link))} RG {source[0]:.1f} {source[1]:.1f} m '
+                      f'{target[0]:.1f} {target[1]:.1f} l S\n')
+        label = link_label(link)
+        if label:
+            # Text is drawn with its own y flip so it reads upright
+            x, y = (source[0] + target[0]) / 2, (source[1] + target[1]) / 2 - 4
+            yield content(f'BT /F1 9 Tf 0.333 0.333 0.333 rg 1 0 0 -1 {x - len(label) * 2.2:.1f} {y:.1f} Tm ')
+            yield content(_pdf_text(label) + b' Tj ET\n')
+
+    yield content('1.5 w 0.2 0.2 0.2 RG\n')
+    for device in snapshot.rows('devices'):
+        x, y = positions[device['ip']]
+        color = GROUP_COLORS.get(device_group(device), GROUP_COLORS['router'])
+        yield content(f'{_pdf_color(color)} rg {_pdf_circle(x, y, NODE_RADIUS)}B\n')
+        for n, line in enumerate(device_label(device)):
+            # Helvetica averages about 0.55 em per character; good enough to center a label
+            yield content(f'BT /F1 12 Tf 0.2 0.2 0.2 rg 1 0 0 -1 {x - len(line) * 3.3:.1f} '
+                          f'{y + NODE_RADIUS + 14 + n * 14:.1f} Tm ')
+            yield content(_pdf_text(line) + b' Tj ET\n')
+
+    end = b'\nendstream\nendobj\n'
+    written += len(end)
+    yield end
+    yield emit(5, str(length).encode())
+
+    xref = [b'xref\n0 7\n0000000000 65535 f \n']
+    xref += [f'{offsets[n]:010d} 00000 n \n'.encode() for n in range(1, 7)]
+    yield b''.join(xref)
+    yield f'trailer\n<< /Size 7 /Root 1 0 R >>\nstartxref\n{written}\n%%EOF\n'.encode()
+
+RENDERERS = {'svg': render_svg, 'pdf': render_pdf}
+
+_cache_lock = threading.Lock()
+
+def _cache_path(map_id, fmt, version):
+    return os.path.join(EXPORT_CACHE_DIR, f'map{map_id}-v{version}.{fmt}')
+
+def _read_file(cache_file):
+    while True:
+        chunk = cache_file.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+def _open_cached(map_id, fmt, version):
+    """Open handle on the finished export of this map version, or None.
+
+    The handle is opened before anything is streamed, so pruning the file
+    meanwhile cannot cut the download short.
+    """
+    try:
+        return open(_cache_path(map_id, fmt, version), 'rb')
+    except OSError:
+        return None
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # Still being streamed (open files cannot be removed on Windows): the next render retries
+        pass
+
+def stream_export(map_id, fmt):
+    """Returns (version, chunks) for an export of the map in fmt ('svg' or 'pdf').
+
+    A cached file is streamed when the map has not changed since it was
+    written; otherwise the export is rendered from a snapshot and copied to
+    the cache as it goes out (and only kept if it was sent in full). The
+    version is the snapshot's, so it always matches the content. chunks has
+    a close() that releases the file or snapshot, even if nothing was sent.
+    """
+    try:
+        ensure_layout(map_id)
+    except Exception as e:
+        print(f"Layout error for map {map_id}: {e}")
+    with ExitStack() as stack:
+        snapshot = stack.enter_context(TopologySnapshot(map_id))
+        cache_file = _open_cached(map_id, fmt, snapshot.version)
+        if cache_file is not None:
+            # The file is this version's export: the snapshot is closed on the way out
+            return snapshot.version, _ExportStream(cache_file, _read_file(cache_file))
+        chunks = _render_and_cache(snapshot, fmt)
+        # From here on the response owns the snapshot
+        return snapshot.version, _ExportStream(stack.pop_all(), chunks)
+
+class _ExportStream:
+    """Chunks read from `resource` (a cache file or the ExitStack holding a snapshot); close() releases it."""
+    def __init__(self, resource, chunks):
+        self.resource = resource
+        self.chunks = chunks
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        try:
+            self.chunks.close()
+        finally:
+            self.resource.close()
+
+def _render_and_cache(snapshot, fmt):
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    map_id = snapshot.map_id
+    path = _cache_path(map_id, fmt, snapshot.version)
+    temp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+    complete = False
+    try:
+        with open(temp_path, 'wb') as cache_file:
+            for chunk in _chunked(RENDERERS[fmt](snapshot)):
+                cache_file.write(chunk)
+                yield chunk
+        complete = True
+    finally:
+        if complete:
+            with _cache_lock:
+                try:
+                    os.replace(temp_path, path)
+                except OSError:
+                    # This version is already cached and being streamed (Windows): keep that copy
+                    _remove_quietly(temp_path)
+                # Exports of older versions of this map are never served again
+                for old in glob.glob(os.path.join(EXPORT_CACHE_DIR, f'map{map_id}-v*.{fmt}')):
+                    if old != path:
+                        _remove_quietly(old)
+        elif os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def clear_export_cache(map_id):
+    """Removes every cached export of a map (when the map is deleted)."""
+    with _cache_lock:
+        for path in glob.glob(os.path.join(EXPORT_CACHE_DIR, f'map{map_id}-v*')):
+            _remove_quietly(path)
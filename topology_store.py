@@ -0,0 +1,256 @@
+"""Compact in-memory copy of a map's devices and links, used to serve reads.
+
+A MapStore keeps each table column by column: text is interned per map
+(IPs, names, ports and VLAN strings become int32 ids into one string table),
+integers and timestamps live in int64 arrays and reals in float64 arrays, so
+a row costs a few dozen bytes instead of a dict of Python objects.
+
+This module holds no database code. models.py warms a store from SQLite the
+first time a map is read and, after every commit, re-reads the rows the
+transaction wrote into it (write-through), so reads never touch SQLite.
+"""
+import calendar
+import json
+import math
+import sys
+import threading
+import time
+from array import array
+
+import numpy as np
+
+# None in int/time columns (no SQLite integer has this value in practice)
+NULL_INT = -2 ** 63
+# SQLite CURRENT_TIMESTAMP format, kept as epoch seconds (UTC)
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Declared SQLite column types and how they are stored
+COLUMN_KINDS = {'INTEGER': 'int', 'REAL': 'real', 'TIMESTAMP': 'time'}
+
+class Interner:
+    """Per-map string table: equal strings are stored once and referenced by id (0 is None)."""
+    __slots__ = ('ids', 'values')
+
+    def __init__(self):
+        self.ids = {None: 0}
+        self.values = [None]
+
+    def id(self, value):
+        i = self.ids.get(value)
+        if i is None:
+            i = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+class Column:
+    """One attribute of every row of a table.
+
+    kind is 'text' (interned ids), 'int', 'real' or 'time'; a value that does
+    not fit (SQLite columns are loosely typed) turns the column into 'object',
+    a plain list.
+    """
+    __slots__ = ('kind', 'data', 'strings', '_last_time')
+
+    def __init__(self, kind, strings):
+        self.kind = kind
+        self.strings = strings
+        self.data = {'text': lambda: array('i'), 'int': lambda: array('q'), 'time': lambda: array('q'),
+                     'real': lambda: array('d'), 'object': list}[kind]()
+        self._last_time = (None, NULL_INT)
+
+    def encode(self, value):
+        kind = self.kind
+        if kind == 'text':
+            if value is None or type(value) is str:
+                return self.strings.id(value)
+        elif kind == 'int':
+            if value is None:
+                return NULL_INT
+            if type(value) is int:
+                return value
+        elif kind == 'real':
+            if value is None:
+                return math.nan
+            if type(value) in (float, int):
+                return float(value)
+        elif kind == 'time':
+            if value is None:
+                return NULL_INT
+            # Rows written in one transaction share their timestamp
+            if value == self._last_time[0]:
+                return self._last_time[1]
+            if type(value) is str:
+                try:
+                    seconds = calendar.timegm(time.strptime(value, TIME_FORMAT))
+                except ValueError:
+                    seconds = None
+                if seconds is not None and time.strftime(TIME_FORMAT, time.gmtime(seconds)) == value:
+                    self._last_time = (value, seconds)
+                    return seconds
+        else:
+            return value
+        raise TypeError
+
+    def decode(self, stored):
+        kind = self.kind
+        if kind == 'text':
+            return self.strings.values[stored]
+        if kind == 'int':
+            return None if stored == NULL_INT else stored
+        if kind == 'real':
+            return None if stored != stored else stored
+        if kind == 'time':
+            return None if stored == NULL_INT else time.strftime(TIME_FORMAT, time.gmtime(stored))
+        return stored
+
+    def _promote(self):
+        self.data = [self.decode(stored) for stored in self.data]
+        self.kind = 'object'
+
+    def append(self, value):
+        try:
+            self.data.append(self.encode(value))
+        except TypeError:
+            self._promote()
+            self.data.append(value)
+
+    def set(self, i, value):
+        try:
+            self.data[i] = self.encode(value)
+        except TypeError:
+            self._promote()
+            self.data[i] = value
+
+    def get(self, i):
+        return self.decode(self.data[i])
+
+    def nbytes(self):
+        if self.kind == 'object':
+            return sys.getsizeof(self.data) + sum(sys.getsizeof(v) for v in self.data)
+        return self.data.buffer_info()[1] * self.data.itemsize
+
+class Table:
+    """Rows of one table, column by column, indexed by a key column."""
+    __slots__ = ('names', 'columns', 'key', 'rows')
+
+    def __init__(self, columns, key, strings):
+        self.names = [name for name, _ in columns]
+        self.columns = [Column(kind, strings) for _, kind in columns]
+        self.key = self.names.index(key)
+        self.rows = {} # {key value: row index}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def upsert(self, values):
+        """Adds or replaces a row given as a sequence in column order."""
+        i = self.rows.get(values[self.key])
+        if i is None:
+            self.rows[values[self.key]] = len(self.rows)
+            for column, value in zip(self.columns, values):
+                column.append(value)
+        else:
+            for column, value in zip(self.columns, values):
+                column.set(i, value)
+
+    def remove(self, key):
+        """Drops a row, moving the last row into its slot so columns stay dense."""
+        i = self.rows.pop(key, None)
+        if i is None:
+            return False
+        last = len(self.rows)
+        for column in self.columns:
+            if i != last:
+                column.data[i] = column.data[last]
+            column.data.pop()
+        if i != last:
+            self.rows[self.columns[self.key].get(i)] = i
+        return True
+
+    def row(self, i):
+        return {name: column.decode(column.data[i]) for name, column in zip(self.names, self.columns)}
+
+    def all_rows(self):
+        return [self.row(i) for i in range(len(self.rows))]
+
+    def column(self, name):
+        return self.columns[self.names.index(name)]
+
+    def where(self, name, predicate):
+        """Row indices whose column `name` matches predicate, an array -> bool array function."""
+        column = self.column(name)
+        if column.kind == 'object':
+            values = np.array([v if v is not None else NULL_INT for v in column.data])
+        else:
+            values = np.frombuffer(column.data, dtype=column.data.typecode) if len(column.data) else np.zeros(0)
+        return np.nonzero(predicate(values))[0].tolist()
+
+    def nbytes(self):
+        # Key index: dict slots (key strings are shared with the string table)
+        return sum(column.nbytes() for column in self.columns) + sys.getsizeof(self.rows)
+
+class MapStore:
+    """Devices, links and tombstones of one map at one version."""
+    __slots__ = ('map_id', 'version', 'layout_version', 'strings', 'devices', 'links', 'tombstones', 'lock', '_payload')
+
+    def __init__(self, map_id, device_columns, link_columns):
+        self.map_id = map_id
+        self.version = 0
+        self.layout_version = None # topology version the stored coordinates belong to
+        self.strings = Interner()
+        self.devices = Table(device_columns, 'ip', self.strings)
+        self.links = Table(link_columns, 'id', self.strings)
+        self.tombstones = [] # [(version, kind, item)], oldest first
+        self.lock = threading.RLock()
+        self._payload = None
+
+    def changed(self):
+        self._payload = None
+
+    def remove_device(self, ip):
+        """Drops a device and every link touching it; returns the removed link ids."""
+        ip_id = self.strings.ids.get(ip)
+        rows = []
+        for name in ('source_ip', 'target_ip'):
+            column = self.links.column(name)
+            if column.kind == 'text':
+                rows += self.links.where(name, lambda values: values == ip_id) if ip_id is not None else []
+            else:
+                rows += [i for i, value in enumerate(column.data) if value == ip]
+        key = self.links.columns[self.links.key]
+        ids = list(dict.fromkeys(key.get(i) for i in rows))
+        for link_id in ids:
+            self.links.remove(link_id)
+        self.devices.remove(ip)
+        self.changed()
+        return ids
+
+    def full_payload(self):
+        """The full topology as JSON bytes, encoded once per change."""
+        payload = self._payload
+        if payload is None:
+            payload = self._payload = json.dumps({
+                'nodes': self.devices.all_rows(),
+                'edges': self.links.all_rows(),
+                'version': self.version,
+                'full': True,
+            }, separators=(',', ':')).encode()
+        return payload
+
+    def changes(self, since):
+        """Same shape as models.get_topology_changes."""
+        removed = [(kind, item) for version, kind, item in self.tombstones if version > since]
+        return {
+            'version': self.version,
+            'nodes': [self.devices.row(i) for i in self.devices.where('version', lambda v: v > since)],
+            'edges': [self.links.row(i) for i in self.links.where('version', lambda v: v > since)],
+            'removed_nodes': [item for kind, item in removed if kind == 'device'],
+            'removed_edges': [int(item) for kind, item in removed if kind == 'link'],
+        }
+
+    def memory_bytes(self):
+        """Approximate memory held by the store (columns, indexes and unique strings)."""
+        strings = sys.getsizeof(self.strings.ids) + sys.getsizeof(self.strings.values)
+        strings += sum(sys.getsizeof(s) for s in self.strings.values if s is not None)
+        tombstones = sys.getsizeof(self.tombstones) + sum(sys.getsizeof(t) for t in self.tombstones)
+        return self.devices.nbytes() + self.links.nbytes() + strings + tombstones